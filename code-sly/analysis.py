@@ -0,0 +1,330 @@
+from ir import Var
+
+# Control-flow facts about an IR function (see ir.py). Everything walks the
+# graph with explicit stacks - nesting depth is only limited by memory.
+
+LOOP_WEIGHT = 10  # assumed trips of a loop whose trip count is unknown
+MAX_DEPTH = 6
+
+def predecessors(function):
+    # block -> list of distinct predecessors, for reachable and unreachable blocks alike
+    result = {block: [] for block in function.blocks}
+    for block in function.blocks:
+        for successor in block.successors():
+            # both targets of a branch may be one block
+            if not result[successor] or result[successor][-1] is not block:
+                result[successor].append(block)
+    return result
+
+def reverse_postorder(function):
+    # the blocks reachable from the entry, every block before its successors
+    # except along back edges
+    order = []
+    visited = {function.entry}
+    stack = [(function.entry, iter(function.entry.successors()))]
+    while stack:
+        block, successors = stack[-1]
+        for successor in successors:
+            if successor not in visited:
+                visited.add(successor)
+                stack.append((successor, iter(successor.successors())))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+def remove_unreachable(function):
+    # drops blocks the entry can't reach; returns how many instructions went
+    reachable = set(reverse_postorder(function))
+    removed = sum(len(block.instrs) for block in function.blocks if block not in reachable)
+    function.blocks = [block for block in function.blocks if block in reachable]
+    return removed
+
+def dominators(function, order=None):
+    # immediate dominator of every reachable block (the entry maps to itself),
+    # after Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm"
+    order = order or reverse_postorder(function)
+    number = {block: k for k, block in enumerate(order)}
+    preds = predecessors(function)
+    entry = function.entry
+    idom = {entry: entry}
+
+    def intersect(a, b, below):
+        # below: blocks already walked from, all dominated by b - the
+        # walk from a stops there, so a join of many deeply nested branches
+        # isn't quadratic
+        while a is not b:
+            while number[a] > number[b]:
+                if a in below:
+                    return b
+                below.add(a)
+                a = idom[a]
+            while number[b] > number[a]:
+                below.add(b)
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new = None
+            below = set()
+            for pred in preds[block]:
+                if pred in idom:
+                    new = pred if new is None else intersect(pred, new, below)
+            if idom.get(block) is not new:
+                idom[block] = new
+                changed = True
+    return idom
+
+def dominates(idom, a, b):
+    # whether a dominates b
+    while True:
+        if b is a:
+            return True
+        parent = idom[b]
+        if parent is b:
+            return False
+        b = parent
+
+def dominator_tree(idom):
+    children = {block: [] for block in idom}
+    for block, parent in idom.items():
+        if parent is not block:
+            children[parent].append(block)
+    return children
+
+def dominator_numbering(idom):
+    # (preorder, postorder) numbers of the dominator tree: a dominates b
+    # exactly when pre[a] <= pre[b] and post[b] <= post[a]
+    children = dominator_tree(idom)
+    root = next(block for block, parent in idom.items() if parent is block)
+    pre, post = {}, {}
+    stack = [(root, iter(children[root]))]
+    pre[root] = 0
+    while stack:
+        block, rest = stack[-1]
+        child = next(rest, None)
+        if child is None:
+            stack.pop()
+            post[block] = len(post)
+        else:
+            pre[child] = len(pre)
+            stack.append((child, iter(children[child])))
+    return pre, post
+
+def dominance_frontiers(function, idom):
+    preds = predecessors(function)
+    frontiers = {block: set() for block in idom}
+    for block in idom:
+        reachable_preds = [pred for pred in preds[block] if pred in idom]
+        if len(reachable_preds) < 2:
+            continue
+        for pred in reachable_preds:
+            runner = pred
+            while runner is not idom[block]:
+                frontiers[runner].add(block)
+                runner = idom[runner]
+    return frontiers
+
+class Loop:
+    __slots__ = ("header", "latches", "parent", "children", "depth", "own", "members")
+
+    def __init__(self, header):
+        self.header = header
+        self.latches = []  # blocks with a back edge to the header
+        self.parent = None  # innermost enclosing loop
+        self.children = []  # loops directly inside
+        self.depth = 1
+        self.own = [header]  # blocks this is the innermost loop of
+        self.members = None
+
+    @property
+    def blocks(self):
+        # every block of the loop, those of inner loops included
+        if self.members is None:
+            members = set()
+            stack = [self]
+            while stack:
+                loop = stack.pop()
+                members.update(loop.own)
+                stack.extend(loop.children)
+            self.members = members
+        return self.members
+
+    def contains(self, block, innermost):
+        # whether block is in the loop, without building the set of its
+        # blocks; innermost maps blocks to the innermost loop they are in
+        loop = innermost.get(block)
+        while loop is not None and loop.depth > self.depth:
+            loop = loop.parent
+        return loop is self
+
+    def exits(self):
+        # (inside, outside) edges leaving the loop
+        blocks = self.blocks
+        return [(block, successor) for block in blocks for successor in block.successors()
+                if successor not in blocks]
+
+def find_loops(function, idom=None):
+    # natural loops, outer loops before the loops they contain; back edges
+    # to the same header make one loop. Inner loops are found first and
+    # collapsed into their header (union-find), so every block is visited
+    # once however deep the nesting.
+    order = reverse_postorder(function)
+    number = {block: k for k, block in enumerate(order)}
+    if all(number[successor] > number[block] for block in order for successor in block.successors()):
+        return []  # no edge goes back, no loops
+    idom = idom or dominators(function, order)
+    preds = predecessors(function)
+    pre, post = dominator_numbering(idom)
+    leader = {}  # block -> header of the outermost loop found so far around it
+    headed = {}  # header -> Loop
+
+    def find(block):
+        root = block
+        while root in leader:
+            root = leader[root]
+        while block is not root:
+            following = leader[block]
+            leader[block] = root
+            block = following
+        return root
+
+    found = []
+    for header in reversed(order):
+        latches = [pred for pred in preds[header]
+                   if pred in idom and pre[header] <= pre[pred] and post[pred] <= post[header]]
+        if not latches:
+            continue
+        loop = headed[header] = Loop(header)
+        loop.latches = latches
+        found.append(loop)
+        stack = [find(latch) for latch in latches]
+        while stack:
+            block = stack.pop()
+            if block is header or block in leader:
+                continue
+            leader[block] = header
+            inner = headed.get(block)
+            if inner is not None:
+                inner.parent = loop
+                loop.children.append(inner)
+            else:
+                loop.own.append(block)
+            stack.extend(find(pred) for pred in preds[block] if pred in idom)
+    found.reverse()
+    for loop in found:
+        if loop.parent is not None:
+            loop.depth = loop.parent.depth + 1
+    return found
+
+def innermost_loops(loops):
+    # block -> innermost loop it is in, for the blocks of loops
+    return {block: loop for loop in loops for block in loop.own}
+
+def loop_depths(function, loops=None):
+    # block -> number of loops containing it
+    depths = {block: 0 for block in function.blocks}
+    for loop in (find_loops(function) if loops is None else loops):
+        for block in loop.own:
+            depths[block] = loop.depth
+    return depths
+
+def block_weights(function, loops=None):
+    # block -> estimated executions per execution of the function
+    return {block: LOOP_WEIGHT ** min(depth, MAX_DEPTH) for block, depth in loop_depths(function, loops).items()}
+
+def use_counts(function):
+    # Var -> number of instructions reading it
+    counts = {}
+    for block in function.blocks:
+        for instr in block.instrs:
+            for var in instr.uses():
+                counts[var] = counts.get(var, 0) + 1
+    return counts
+
+def upward_exposed(function):
+    # variables some path from the entry may read before writing them
+    preds = predecessors(function)
+    live_in = {}
+    uses = {}
+    kills = {}
+    for block in function.blocks:
+        used, killed = set(), set()
+        for instr in block.instrs:
+            used.update(var for var in instr.uses() if var not in killed)
+            if instr.dst is not None:
+                killed.add(instr.dst)
+        uses[block], kills[block] = used, killed
+        live_in[block] = set(used)
+    worklist = list(function.blocks)
+    while worklist:
+        block = worklist.pop()
+        live_out = set()
+        for successor in block.successors():
+            live_out |= live_in[successor]
+        new = uses[block] | (live_out - kills[block])
+        if new != live_in[block]:
+            live_in[block] = new
+            worklist.extend(preds[block])
+    return live_in[function.entry]
+
+# Estimated VM cycles of the code backend.py selects for an instruction -
+# close for the straight-line cases, a typical figure for the routines.
+ROUTINE_COSTS = {"mul": 900, "div": 1800, "mod": 1600}
+
+def instruction_cost(instr):
+    op, args = instr.op, instr.args
+    if op in ("copy", "half"):
+        return 20 + 5 * (op == "half")
+    if op in ("add", "sub"):
+        return 30
+    if op in ("mul", "div", "mod"):
+        a, b = args
+        if isinstance(a, int) and isinstance(b, int):
+            return 20
+        if op == "mul" and isinstance(a, int):
+            a, b = b, a
+        if not isinstance(b, int):
+            return ROUTINE_COSTS[op]
+        if b in (0, 1, -1):
+            return 20 + 20 * (op == "mul" and b == -1)
+        if op == "mul":
+            return 20 + 15 * abs(b).bit_length()
+        if b > 0 and b & (b - 1) == 0:
+            return 20 + 5 * b.bit_length() * (1 if op == "div" else 2) + 20 * (op == "mod")
+        return ROUTINE_COSTS[op]
+    if op in ("load", "store"):
+        array, index = args[0], args[1]
+        direct = not array.by_ref and isinstance(index, int)
+        return 20 if direct else 60
+    if op == "addr":
+        return 30
+    if op in ("loadi", "storei"):
+        return 30
+    if op == "read":
+        return 110
+    if op == "write":
+        return 100 if isinstance(args[0], Var) and not args[0].temp else 110
+    if op == "call":
+        return 20 * (len(args) - 1) + 81 + 10  # the RTRN included
+    if op == "init":
+        return 60
+    if op == "branch":
+        return 22
+    if op == "jump":
+        return 1
+    if op == "exit":
+        return 10
+    return 20
+
+def estimated_cost(function, weights=None):
+    # VM cycles of one execution of the function, loops assumed to run
+    # LOOP_WEIGHT times and callees not counted
+    weights = weights or block_weights(function)
+    return sum(weights.get(block, 1) * sum(instruction_cost(instr) for instr in block.instrs)
+               for block in function.blocks)
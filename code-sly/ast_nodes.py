@@ -1,6 +1,12 @@
+# Nodes are slotted: large programs build millions of them. Every node
+# knows the line and column (both counted from 1, 0 if unknown) where its
+# source text starts.
 class AstNode:
-    def __init__(self):
-        self.lineno = 0
+    __slots__ = ("lineno", "column")
+
+    def __init__(self, lineno=0, column=0):
+        self.lineno = lineno
+        self.column = column
 
     def print(self, indent=0):
         raise NotImplementedError
@@ -9,12 +15,80 @@ class AstNode:
         print(' ' * indent, end='')
 
 
+class NodeWalker:
+    # Visits a tree without recursing on the Python stack. Handlers are named
+    # `{prefix}{NodeClass}` and looked up once per node class. A handler that
+    # is a generator yields the nested nodes it wants visited and is resumed
+    # after each of them, so the nesting depth of the program only grows the
+    # explicit `stack` below.
+    prefix = None
+    handlers = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handlers = {}
+
+    @classmethod
+    def handler(cls, node_class):
+        name = f"{cls.prefix}{node_class.__name__}"
+        handler = cls.handlers[node_class] = getattr(cls, name, cls.missing_handler)
+        return handler
+
+    def missing_handler(self, node):
+        raise NotImplementedError(f"No {self.prefix}{type(node).__name__} method")
+
+    def visit(self, node):
+        handler = self.handlers.get(node.__class__) or self.handler(node.__class__)
+        return handler(self, node)
+
+    def walk(self, node):
+        pending = self.visit(node)
+        if pending is None:
+            return
+        stack = [pending]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            else:
+                pending = self.visit(child)
+                if pending is not None:
+                    stack.append(pending)
+
+
+def iter_nodes(root):
+    # every node of the tree, in no particular order
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, AstNode):
+            yield item
+            for cls in type(item).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    if name != "symbol":
+                        stack.append(getattr(item, name, None))
+
+def count_nodes(root):
+    return sum(1 for _ in iter_nodes(root))
+
+def shift_lines(root, delta):
+    # for a reused subtree when lines were inserted or removed above it
+    for node in iter_nodes(root):
+        if node.lineno:
+            node.lineno += delta
+
+
 class ExpressionNode(AstNode):
-    pass
+    __slots__ = ()
 
 
 class ValueNode(ExpressionNode):
-    def __init__(self, value):
+    __slots__ = ("value",)
+
+    def __init__(self, value, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.value = value
 
     def print(self, indent=0):
@@ -23,14 +97,16 @@ class ValueNode(ExpressionNode):
 
 
 class IdentifierNode(ExpressionNode):
-    def __init__(self, name, index=None, start=0, end=0, is_array_range=False, lineno=0):
-        super().__init__()
+    __slots__ = ("name", "index", "start", "end", "is_array_range", "symbol")
+
+    def __init__(self, name, index=None, lineno=0, column=0, start=0, end=0, is_array_range=False):
+        super().__init__(lineno, column)
         self.name = name
         self.index = index
         self.start = start
         self.end = end
         self.is_array_range = is_array_range
-        self.lineno = lineno
+        self.symbol = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -45,7 +121,10 @@ class IdentifierNode(ExpressionNode):
             print()
 
 class BinaryExpressionNode(ExpressionNode):
-    def __init__(self, left, right, operation):
+    __slots__ = ("left", "right", "operation")
+
+    def __init__(self, left, right, operation, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.left = left
         self.right = right
         self.operation = operation
@@ -62,7 +141,10 @@ class BinaryExpressionNode(ExpressionNode):
 
 
 class ConditionNode(AstNode):
-    def __init__(self, left_value, right_value, operation):
+    __slots__ = ("left_value", "right_value", "operation")
+
+    def __init__(self, left_value, right_value, operation, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.left_value = left_value
         self.right_value = right_value
         self.operation = operation
@@ -81,14 +163,17 @@ class ConditionNode(AstNode):
 
 
 class DeclarationsNode(AstNode):
-    def __init__(self):
+    __slots__ = ("variables",)
+
+    def __init__(self, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.variables = []
 
-    def add_variable_declaration(self, name):
-        self.variables.append(IdentifierNode(name))
+    def add_variable_declaration(self, name, lineno=0, column=0):
+        self.variables.append(IdentifierNode(name, lineno=lineno, column=column))
 
-    def add_array_declaration(self, name, start, end):
-        self.variables.append(IdentifierNode(name, start=start, end=end, is_array_range=True))
+    def add_array_declaration(self, name, start, end, lineno=0, column=0):
+        self.variables.append(IdentifierNode(name, start=start, end=end, is_array_range=True, lineno=lineno, column=column))
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -98,11 +183,14 @@ class DeclarationsNode(AstNode):
 
 
 class CommandNode(AstNode):
-    pass
+    __slots__ = ()
 
 
 class CommandsNode(AstNode):
-    def __init__(self):
+    __slots__ = ("commands",)
+
+    def __init__(self, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.commands = []
 
     def add_command(self, command):
@@ -119,10 +207,12 @@ class CommandsNode(AstNode):
 
 
 class AssignNode(CommandNode):
-    def __init__(self, identifier, expression, lineno=0):
+    __slots__ = ("identifier", "expression")
+
+    def __init__(self, identifier, expression, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.identifier = identifier
         self.expression = expression
-        self.lineno = lineno
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -136,7 +226,10 @@ class AssignNode(CommandNode):
 
 
 class IfNode(CommandNode):
-    def __init__(self, condition, then_commands, else_commands=None):
+    __slots__ = ("condition", "then_commands", "else_commands")
+
+    def __init__(self, condition, then_commands, else_commands=None, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.condition = condition
         self.then_commands = then_commands
         self.else_commands = else_commands
@@ -157,7 +250,10 @@ class IfNode(CommandNode):
 
 
 class WhileNode(CommandNode):
-    def __init__(self, condition, commands):
+    __slots__ = ("condition", "commands")
+
+    def __init__(self, condition, commands, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.condition = condition
         self.commands = commands
 
@@ -173,7 +269,10 @@ class WhileNode(CommandNode):
 
 
 class RepeatUntilNode(CommandNode):
-    def __init__(self, condition, commands):
+    __slots__ = ("condition", "commands")
+
+    def __init__(self, condition, commands, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.condition = condition
         self.commands = commands
 
@@ -189,11 +288,15 @@ class RepeatUntilNode(CommandNode):
 
 
 class ForToNode(CommandNode):
-    def __init__(self, pidentifier, from_value, to_value, commands):
-        self.pidentifier = IdentifierNode(pidentifier)
+    __slots__ = ("pidentifier", "from_value", "to_value", "commands", "bound_address")
+
+    def __init__(self, pidentifier, from_value, to_value, commands, lineno=0, column=0):
+        super().__init__(lineno, column)
+        self.pidentifier = IdentifierNode(pidentifier, lineno=lineno, column=column)
         self.from_value = from_value
         self.to_value = to_value
         self.commands = commands
+        self.bound_address = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -213,11 +316,15 @@ class ForToNode(CommandNode):
 
 
 class ForDownToNode(CommandNode):
-    def __init__(self, pidentifier, from_value, to_value, commands):
-        self.pidentifier = IdentifierNode(pidentifier)
+    __slots__ = ("pidentifier", "from_value", "to_value", "commands", "bound_address")
+
+    def __init__(self, pidentifier, from_value, to_value, commands, lineno=0, column=0):
+        super().__init__(lineno, column)
+        self.pidentifier = IdentifierNode(pidentifier, lineno=lineno, column=column)
         self.from_value = from_value
         self.to_value = to_value
         self.commands = commands
+        self.bound_address = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -236,7 +343,10 @@ class ForDownToNode(CommandNode):
         self.commands.print(indent + 4)
 
 class WriteNode(CommandNode):
-    def __init__(self, value):
+    __slots__ = ("value",)
+
+    def __init__(self, value, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.value = value
 
     def print(self, indent=0):
@@ -246,7 +356,10 @@ class WriteNode(CommandNode):
 
 
 class ReadNode(CommandNode):
-    def __init__(self, identifier):
+    __slots__ = ("identifier",)
+
+    def __init__(self, identifier, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.identifier = identifier
 
     def print(self, indent=0):
@@ -255,7 +368,10 @@ class ReadNode(CommandNode):
         self.identifier.print(indent + 2)
 
 class ProceduresNode(AstNode):
-    def __init__(self):
+    __slots__ = ("procedures",)
+
+    def __init__(self, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.procedures = []
 
     def add_procedure(self, procedure):
@@ -268,10 +384,15 @@ class ProceduresNode(AstNode):
             procedure.print(indent + 2)
 
 class ProcedureNode(AstNode):
-    def __init__(self, procedure_head, declarations=None, commands=None):
+    __slots__ = ("procedure_head", "declarations", "commands", "source", "symbol")
+
+    def __init__(self, procedure_head, declarations=None, commands=None, lineno=0, column=0, source=None):
+        super().__init__(lineno, column)
         self.procedure_head = procedure_head
         self.declarations = declarations
         self.commands = commands
+        self.source = source  # text of the whole procedure, when the parser had it
+        self.symbol = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -289,7 +410,10 @@ class ProcedureNode(AstNode):
             self.commands.print(indent + 4)
 
 class ProcedureHeadNode(AstNode):
-    def __init__(self, procedure_name, arguments_declaration):
+    __slots__ = ("procedure_name", "arguments_declaration")
+
+    def __init__(self, procedure_name, arguments_declaration, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.procedure_name = procedure_name
         self.arguments_declaration = arguments_declaration
 
@@ -303,9 +427,13 @@ class ProcedureHeadNode(AstNode):
 
 
 class ArgumentNode(AstNode):
-    def __init__(self, argument_name, is_array=False):
+    __slots__ = ("argument_name", "is_array", "symbol")
+
+    def __init__(self, argument_name, is_array=False, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.argument_name = argument_name
         self.is_array = is_array
+        self.symbol = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -316,14 +444,17 @@ class ArgumentNode(AstNode):
             print()
 
 class ArgumentsDeclarationNode(AstNode):
-    def __init__(self):
+    __slots__ = ("args",)
+
+    def __init__(self, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.args = []
 
-    def add_variable_argument(self, pidentifier):
-        self.args.append(ArgumentNode(pidentifier))
+    def add_variable_argument(self, pidentifier, lineno=0, column=0):
+        self.args.append(ArgumentNode(pidentifier, False, lineno, column))
 
-    def add_array_argument(self, pidentifier):
-        self.args.append(ArgumentNode(pidentifier, True))
+    def add_array_argument(self, pidentifier, lineno=0, column=0):
+        self.args.append(ArgumentNode(pidentifier, True, lineno, column))
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -332,9 +463,13 @@ class ArgumentsDeclarationNode(AstNode):
             arg.print(indent + 2)
 
 class ProcedureCallNode(CommandNode):
-    def __init__(self, procedure_name, arguments):
+    __slots__ = ("procedure_name", "arguments", "symbol")
+
+    def __init__(self, procedure_name, arguments, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.procedure_name = procedure_name
         self.arguments = arguments
+        self.symbol = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -345,7 +480,10 @@ class ProcedureCallNode(CommandNode):
             self.arguments.print(indent + 4)
 
 class ProcedureCallArguments(AstNode):
-    def __init__(self):
+    __slots__ = ("arguments",)
+
+    def __init__(self, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.arguments = []
 
     def add_argument(self, argument):
@@ -361,7 +499,10 @@ class ProcedureCallArguments(AstNode):
 
 
 class MainNode(AstNode):
-    def __init__(self, declarations, commands):
+    __slots__ = ("declarations", "commands")
+
+    def __init__(self, declarations, commands, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.declarations = declarations
         self.commands = commands
 
@@ -375,9 +516,13 @@ class MainNode(AstNode):
 
 
 class ProgramNode(AstNode):
-    def __init__(self, procedures=None, main=None):
+    __slots__ = ("procedures", "main", "memory_size")
+
+    def __init__(self, procedures=None, main=None, lineno=0, column=0):
+        super().__init__(lineno, column)
         self.procedures = procedures
         self.main = main
+        self.memory_size = None  # set by Resolver
 
     def print(self, indent=0):
         self._print_indent(indent)
@@ -0,0 +1,767 @@
+from instructions import Opcode
+from codegen import CodeGenerator, ZERO_CONSTANT_ADDR, ONE_CONSTANT_ADDR, MINUS_ONE_CONSTANT_ADDR, POINTER_HANDLING_ADDR
+from ir import Var, Array, MIRRORED, compare, evaluate
+from analysis import predecessors, block_weights, use_counts
+
+# Machine code for IR programs (see ir.py). Every function is selected into a
+# list of MachineInstructions and labels, then assembled into the same
+# relocatable fragments CodeGenerator produces.
+#
+# Temporaries get cells above the resolver's memory, a few per function. The
+# selector remembers which operands the accumulator holds, so values are not
+# loaded again, and a temporary read only by the next instruction is handed
+# over in the accumulator without ever being stored. Constants used in loops
+# or more than once are SET into cells at the entry of the function.
+#
+# Multiplication, division and modulo by constants become shifts and adds;
+# otherwise they run the routines at the end of this file. Division rounds
+# down and the remainder takes the sign of the divisor, as constant folding
+# does; x / 0 and x % 0 are 0.
+
+OPERAND_A = 3  # cells the routines take their operands in
+OPERAND_B = 4
+SCRATCH = 1  # free between instructions, like 2
+POINTER = POINTER_HANDLING_ADDR
+
+# instructions that replace the accumulator
+ACCUMULATOR_WRITERS = frozenset({Opcode.LOAD, Opcode.LOADI, Opcode.ADD, Opcode.SUB, Opcode.ADDI, Opcode.SUBI,
+                                 Opcode.SET, Opcode.HALF})
+
+class MachineInstruction:
+    __slots__ = ("opcode", "operand", "label", "callee")
+
+    def __init__(self, opcode, operand=0, label=None, callee=None):
+        self.opcode = opcode
+        self.operand = operand
+        self.label = label  # jumps: target label; SET: absolute address of the label
+        self.callee = callee  # JUMP to the first instruction of another fragment
+
+    def __repr__(self):
+        target = self.callee or (f"L{self.label}" if self.label is not None else self.operand)
+        return f"{self.opcode.name} {target}"
+
+def naf(n):
+    # non-adjacent form of n > 0, most significant digit (always 1) first
+    digits = []
+    while n:
+        digit = 2 - (n & 3) if n & 1 else 0
+        digits.append(digit)
+        n = (n - digit) >> 1
+    return digits[::-1]
+
+def power_of_two(n):
+    # k with n = 2**k, or None
+    if n > 0 and n & (n - 1) == 0:
+        return n.bit_length() - 1
+    return None
+
+class Selector:
+    # instruction selection for one function
+    def __init__(self, backend, function):
+        self.backend = backend
+        self.function = function
+        self.code = []  # MachineInstructions and int labels
+        self.acc = set()  # operands whose value the accumulator holds
+        self.cells = {}  # temporary -> cell
+        self.forwarded = set()  # temporaries never stored, see store_to
+        self.pool = {0: ZERO_CONSTANT_ADDR, 1: ONE_CONSTANT_ADDR, -1: MINUS_ONE_CONSTANT_ADDR}
+        self.uses = use_counts(function)
+        self.labels = {block: backend.new_label() for block in function.blocks}
+        self.next = None  # instruction after the one being selected
+        self.skip = False  # set when the next instruction was selected too
+
+    def emit(self, opcode, operand=0):
+        self.code.append(MachineInstruction(opcode, operand))
+        if opcode in ACCUMULATOR_WRITERS or (opcode == Opcode.GET and operand == 0):
+            self.acc = set()
+
+    def emit_jump(self, opcode, label):
+        self.code.append(MachineInstruction(opcode, label=label))
+
+    def place(self, label):
+        self.code.append(label)
+
+    def select(self):
+        function = self.function
+        self.place_constants()
+        preds = predecessors(function)
+        acc_out = {}
+        blocks = function.blocks
+        for k, block in enumerate(blocks):
+            self.place(self.labels[block])
+            if k:
+                # jumps keep the accumulator, what a single predecessor left there is still there
+                sources = preds[block]
+                self.acc = set(acc_out[sources[0]]) if len(sources) == 1 and sources[0] in acc_out else set()
+            elif preds[block]:
+                self.acc = set()
+            following = blocks[k + 1] if k + 1 < len(blocks) else None
+            instrs = block.instrs
+            for position, instr in enumerate(instrs):
+                if self.skip:
+                    self.skip = False
+                    continue
+                self.next = instrs[position + 1] if position + 1 < len(instrs) else None
+                getattr(self, f"select_{instr.op}")(instr, following)
+            acc_out[block] = self.acc
+        return self.code
+
+    # constants
+
+    def constant_uses(self, instr):
+        # constants selection would otherwise SET, see the select_* methods
+        op, args = instr.op, instr.args
+        if op in ("copy", "write"):
+            return [arg for arg in args if isinstance(arg, int)]
+        if op in ("add", "sub", "branch"):
+            values = args[1:3] if op == "branch" else args
+            constants = [arg for arg in values if isinstance(arg, int)]
+            return constants if len(constants) == 1 else []
+        if op in ("div", "mod"):
+            a, b = args
+            if isinstance(a, int) and isinstance(b, int):
+                return []
+            if isinstance(b, int) and (b in (0, 1, -1) or (op == "div" and power_of_two(abs(b)) is not None)
+                                       or (op == "mod" and power_of_two(b) is not None)):
+                return []
+            return [arg for arg in args if isinstance(arg, int)]
+        if op in ("load", "store", "addr"):
+            array, index = args[0], args[1]
+            constants = []
+            if array.by_ref and isinstance(index, int):
+                constants.append(index)
+            elif not array.by_ref and not isinstance(index, int):
+                constants.append(array.offset)
+            if op == "store" and isinstance(args[2], int):
+                constants.append(args[2])
+            return constants
+        if op == "storei" and isinstance(args[1], int):
+            return [args[1]]
+        if op == "call":
+            constants = []
+            for arg in args[1:]:
+                if isinstance(arg, Array) and not arg.by_ref:
+                    constants.append(arg.offset)
+                elif isinstance(arg, Var) and not arg.by_ref:
+                    constants.append(arg.address)
+            return constants
+        return []
+
+    def place_constants(self):
+        # a cell costs a SET and a STORE once, and saves about 40 every time the constant is used
+        block_weight = block_weights(self.function)
+        weights = {}
+        for block in self.function.blocks:
+            weight = block_weight[block]
+            for instr in block.instrs:
+                for constant in self.constant_uses(instr):
+                    if constant not in self.pool:
+                        weights[constant] = weights.get(constant, 0) + weight
+        for constant, weight in weights.items():
+            if weight * 40 > 60:
+                cell = self.backend.allocate()
+                self.emit(Opcode.SET, constant)
+                self.emit(Opcode.STORE, cell)
+                self.pool[constant] = cell
+
+    # operands
+
+    def address(self, var, write=False):
+        if var.address is not None:
+            return var.address
+        if var in self.forwarded and not write:
+            raise Exception(f"Temporary {var} was never stored")
+        cell = self.cells.get(var)
+        if cell is None:
+            cell = self.cells[var] = self.backend.allocate()
+        return cell
+
+    def load(self, operand):
+        if operand in self.acc:
+            return
+        if isinstance(operand, int):
+            cell = self.pool.get(operand)
+            if cell is None:
+                self.emit(Opcode.SET, operand)
+            else:
+                self.emit(Opcode.LOAD, cell)
+        elif operand.by_ref:
+            self.emit(Opcode.LOADI, operand.address)
+        else:
+            self.emit(Opcode.LOAD, self.address(operand))
+        self.acc = {operand}
+
+    def combine(self, opcode, operand):
+        # accumulator = accumulator + operand, or - operand for SUB
+        if operand in self.acc:
+            self.emit(opcode, 0)
+        elif isinstance(operand, int):
+            cell = self.pool.get(operand)
+            if cell is None:
+                self.emit(Opcode.STORE, SCRATCH)
+                self.emit(Opcode.SET, operand if opcode == Opcode.ADD else -operand)
+                self.emit(Opcode.ADD, SCRATCH)
+            else:
+                self.emit(opcode, cell)
+        elif operand.by_ref:
+            self.emit(Opcode.ADDI if opcode == Opcode.ADD else Opcode.SUBI, operand.address)
+        else:
+            self.emit(opcode, self.address(operand))
+
+    def accumulate(self, a, b, add=True):
+        # accumulator = a + b, or a - b
+        if add and b in self.acc and a not in self.acc:
+            a, b = b, a
+        if isinstance(b, int) and b == 0:
+            self.load(a)
+        elif add and isinstance(a, int) and a == 0:
+            self.load(b)
+        elif (a not in self.acc and not isinstance(a, int)
+              and isinstance(b, int) and b not in self.pool):
+            self.load(b if add else -b)
+            self.combine(Opcode.ADD, a)
+        else:
+            self.load(a)
+            self.combine(Opcode.ADD if add else Opcode.SUB, b)
+
+    def in_memory(self, operand, scratch):
+        # (opcode for ADD, opcode for SUB, address) reaching a Var, which is
+        # stored in scratch first when only the accumulator has it
+        if operand in self.forwarded:
+            self.emit(Opcode.STORE, scratch)
+            return Opcode.ADD, Opcode.SUB, scratch
+        if operand.by_ref:
+            return Opcode.ADDI, Opcode.SUBI, operand.address
+        return Opcode.ADD, Opcode.SUB, self.address(operand)
+
+    def negate(self, operand):
+        # accumulator = -operand
+        _, sub, address = self.in_memory(operand, 2)
+        self.emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        self.emit(sub, address)
+
+    def store_to(self, dst):
+        # the accumulator becomes the value of dst
+        if dst.temp and self.forwardable(dst):
+            self.forwarded.add(dst)
+        elif dst.by_ref:
+            self.emit(Opcode.STOREI, dst.address)
+            # other parameters may be the same variable
+            self.acc = {operand for operand in self.acc if not (isinstance(operand, Var) and operand.by_ref)}
+        else:
+            self.emit(Opcode.STORE, self.address(dst, write=True))
+        self.acc.add(dst)
+
+    def forwardable(self, temp):
+        # whether the next instruction is the only reader and can take temp from the accumulator
+        instr = self.next
+        if instr is None or self.uses.get(temp) != 1 or temp not in instr.uses():
+            return False
+        op, args = instr.op, instr.args
+        if op in ("copy", "half", "write", "add", "mul", "div", "mod", "branch", "load", "addr"):
+            return True
+        if op == "sub":
+            return args[0] is temp
+        if op == "store":
+            return args[1] is temp or (not args[0].by_ref and isinstance(args[1], int))
+        if op == "storei":
+            return args[1] is temp
+        return False
+
+    # instructions
+
+    def select_copy(self, instr, following):
+        if instr.dst is not instr.args[0]:
+            self.load(instr.args[0])
+            self.store_to(instr.dst)
+
+    def select_add(self, instr, following):
+        a, b = instr.args
+        if isinstance(a, int) and isinstance(b, int):
+            self.load(a + b)
+        else:
+            self.accumulate(a, b)
+        self.store_to(instr.dst)
+
+    def select_sub(self, instr, following):
+        a, b = instr.args
+        if isinstance(a, int) and isinstance(b, int):
+            self.load(a - b)
+        else:
+            self.accumulate(a, b, add=False)
+        self.store_to(instr.dst)
+
+    def select_half(self, instr, following):
+        a = instr.args[0]
+        if isinstance(a, int):
+            self.load(a >> 1)
+        else:
+            self.load(a)
+            self.emit(Opcode.HALF)
+        self.store_to(instr.dst)
+
+    def select_mul(self, instr, following):
+        a, b = instr.args
+        if isinstance(a, int) and isinstance(b, int):
+            self.load(a * b)
+        elif isinstance(a, int) or isinstance(b, int):
+            constant, operand = (a, b) if isinstance(a, int) else (b, a)
+            self.multiply_constant(operand, constant)
+        else:
+            self.routine(a, b, self.multiply_routine)
+        self.store_to(instr.dst)
+
+    def multiply_constant(self, operand, constant):
+        if constant == 0:
+            self.load(0)
+        elif constant == 1:
+            self.load(operand)
+        elif constant == -1:
+            self.negate(operand)
+        else:
+            self.load(operand)
+            add, sub, address = self.in_memory(operand, SCRATCH)
+            for digit in naf(abs(constant))[1:]:
+                self.emit(Opcode.ADD, 0)
+                if digit == 1:
+                    self.emit(add, address)
+                elif digit == -1:
+                    self.emit(sub, address)
+            if constant < 0:
+                self.emit(Opcode.STORE, 2)
+                self.emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+                self.emit(Opcode.SUB, 2)
+
+    def select_div(self, instr, following):
+        a, b = instr.args
+        shift = power_of_two(abs(b)) if isinstance(b, int) else None
+        if isinstance(a, int) and isinstance(b, int):
+            self.load(evaluate("div", a, b))
+        elif isinstance(b, int) and b == 0:
+            self.load(0)
+        elif shift is not None:
+            # rounds down, for negative dividends too
+            if b < 0:
+                self.negate(a)
+            else:
+                self.load(a)
+            for _ in range(shift):
+                self.emit(Opcode.HALF)
+        else:
+            self.routine(a, b, self.divide_routine)
+        self.store_to(instr.dst)
+
+    def select_mod(self, instr, following):
+        a, b = instr.args
+        shift = power_of_two(b) if isinstance(b, int) else None
+        if isinstance(a, int) and isinstance(b, int):
+            self.load(evaluate("mod", a, b))
+        elif isinstance(b, int) and b in (0, 1, -1):
+            self.load(0)
+        elif shift is not None:
+            # a - (a >> k << k), never negative
+            self.load(a)
+            _, sub, address = self.in_memory(a, 2)
+            for _ in range(shift):
+                self.emit(Opcode.HALF)
+            for _ in range(shift):
+                self.emit(Opcode.ADD, 0)
+            self.emit(Opcode.STORE, SCRATCH)
+            self.emit(Opcode.LOADI if sub == Opcode.SUBI else Opcode.LOAD, address)
+            self.emit(Opcode.SUB, SCRATCH)
+        else:
+            self.routine(a, b, self.modulo_routine)
+        self.store_to(instr.dst)
+
+    def routine(self, a, b, body):
+        if b in self.acc and a not in self.acc:
+            self.load(b)
+            self.emit(Opcode.STORE, OPERAND_B)
+            self.load(a)
+            self.emit(Opcode.STORE, OPERAND_A)
+        else:
+            self.load(a)
+            self.emit(Opcode.STORE, OPERAND_A)
+            self.load(b)
+            self.emit(Opcode.STORE, OPERAND_B)
+        body()
+        self.acc = set()
+
+    def element_pointer(self, array, index):
+        # accumulator = address of array[index]
+        if array.by_ref or index in self.acc:
+            self.accumulate(index, array.offset)
+        else:
+            self.accumulate(array.offset, index)
+
+    def select_load(self, instr, following):
+        array, index = instr.args
+        if not array.by_ref and isinstance(index, int):
+            self.emit(Opcode.LOAD, array.element_address(index))
+        else:
+            self.element_pointer(array, index)
+            self.emit(Opcode.STORE, POINTER)
+            self.emit(Opcode.LOADI, POINTER)
+        self.store_to(instr.dst)
+
+    def select_store(self, instr, following):
+        array, index, value = instr.args
+        if not array.by_ref and isinstance(index, int):
+            self.load(value)
+            self.emit(Opcode.STORE, array.element_address(index))
+        else:
+            self.element_pointer(array, index)
+            self.emit(Opcode.STORE, POINTER)
+            self.load(value)
+            self.emit(Opcode.STOREI, POINTER)
+
+    def select_addr(self, instr, following):
+        array, index = instr.args
+        if not array.by_ref and isinstance(index, int):
+            self.load(array.element_address(index))
+        else:
+            self.element_pointer(array, index)
+        self.store_to(instr.dst)
+
+    def select_loadi(self, instr, following):
+        self.emit(Opcode.LOADI, self.address(instr.args[0]))
+        self.store_to(instr.dst)
+
+    def select_storei(self, instr, following):
+        pointer, value = instr.args[0], instr.args[1]
+        self.load(value)
+        self.emit(Opcode.STOREI, self.address(pointer))
+
+    def select_read(self, instr, following):
+        dst = instr.dst
+        after = self.next
+        if (dst.temp and self.uses.get(dst) == 1 and after is not None and after.op == "store"
+                and after.args[2] is dst):
+            # straight into the array cell
+            array, index = after.args[0], after.args[1]
+            if not array.by_ref and isinstance(index, int):
+                self.emit(Opcode.GET, array.element_address(index))
+            else:
+                self.element_pointer(array, index)
+                self.emit(Opcode.STORE, POINTER)
+                self.emit(Opcode.GET, 0)
+                self.emit(Opcode.STOREI, POINTER)
+            self.skip = True
+        elif dst.by_ref or dst.temp:
+            self.emit(Opcode.GET, 0)
+            self.store_to(dst)
+        else:
+            self.emit(Opcode.GET, self.address(dst))
+            self.acc.discard(dst)
+
+    def select_write(self, instr, following):
+        value = instr.args[0]
+        if isinstance(value, int) and value in self.pool:
+            self.emit(Opcode.PUT, self.pool[value])
+        elif isinstance(value, int) or value.by_ref or value in self.forwarded:
+            self.load(value)
+            self.emit(Opcode.PUT, 0)
+        else:
+            self.emit(Opcode.PUT, self.address(value))
+
+    def select_init(self, instr, following):
+        symbol = instr.args[0].symbol
+        self.load(symbol.offset)
+        self.emit(Opcode.STORE, symbol.offset_address)
+
+    def select_call(self, instr, following):
+        procedure = instr.args[0]
+        for argument, parameter in zip(instr.args[1:], procedure.parameters):
+            if isinstance(argument, Array):
+                self.load(argument.offset)
+            elif argument.by_ref:
+                # the address the parameter holds
+                self.emit(Opcode.LOAD, argument.address)
+            else:
+                self.load(argument.address)
+            self.emit(Opcode.STORE, parameter.address)
+        back = self.backend.new_label()
+        self.code.append(MachineInstruction(Opcode.SET, label=back))
+        self.emit(Opcode.STORE, procedure.address)
+        self.code.append(MachineInstruction(Opcode.JUMP, callee=procedure.name))
+        self.place(back)
+        self.acc = set()
+
+    def jump(self, target, following):
+        if target is not following:
+            self.emit_jump(Opcode.JUMP, self.labels[target])
+
+    def select_jump(self, instr, following):
+        self.jump(instr.args[0], following)
+
+    def select_branch(self, instr, following):
+        operation, a, b, if_true, if_false = instr.args
+        if isinstance(a, int) and isinstance(b, int):
+            self.jump(if_true if compare(operation, a, b) else if_false, following)
+            return
+        if if_true is if_false:
+            self.jump(if_true, following)
+            return
+        # the accumulator gets the difference of the operands
+        if (isinstance(a, int) and a == 0) or (b in self.acc and a not in self.acc):
+            a, b, operation = b, a, MIRRORED[operation]
+        self.accumulate(a, b, add=False)
+
+        if operation in ("<", ">", "="):
+            taken, other = if_true, if_false
+        else:
+            taken, other = if_false, if_true
+            operation = {"!=": "=", "<=": ">", ">=": "<"}[operation]
+        opcode = {"<": Opcode.JNEG, ">": Opcode.JPOS, "=": Opcode.JZERO}[operation]
+        if taken is following:
+            # jump away when the condition does not hold
+            for complement in (Opcode.JNEG, Opcode.JPOS, Opcode.JZERO):
+                if complement != opcode:
+                    self.emit_jump(complement, self.labels[other])
+        else:
+            self.emit_jump(opcode, self.labels[taken])
+            self.jump(other, following)
+
+    def select_exit(self, instr, following):
+        if self.function.is_main:
+            self.emit(Opcode.HALT)
+        else:
+            self.emit(Opcode.RTRN, self.function.procedure.address)
+
+    # routines, operands in OPERAND_A and OPERAND_B, result in the accumulator
+
+    def multiply_routine(self):
+        # shifts and adds over the bits of the smaller absolute value
+        a, b = OPERAND_A, OPERAND_B
+        x, y, product = 1, 2, 5
+        zero, a_positive, b_positive, ordered, loop, even, done, a_sign, negative, end = (
+            self.backend.new_label() for _ in range(10))
+        emit, jump, place = self.emit, self.emit_jump, self.place
+        emit(Opcode.LOAD, a)
+        jump(Opcode.JZERO, zero)
+        jump(Opcode.JPOS, a_positive)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, a)
+        place(a_positive)
+        emit(Opcode.STORE, x)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JZERO, zero)
+        jump(Opcode.JPOS, b_positive)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, b)
+        place(b_positive)
+        emit(Opcode.STORE, y)
+        emit(Opcode.SUB, x)
+        jump(Opcode.JPOS, ordered)
+        jump(Opcode.JZERO, ordered)
+        emit(Opcode.LOAD, x)
+        emit(Opcode.STORE, product)
+        emit(Opcode.LOAD, y)
+        emit(Opcode.STORE, x)
+        emit(Opcode.LOAD, product)
+        emit(Opcode.STORE, y)
+        place(ordered)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.STORE, product)
+        place(loop)
+        emit(Opcode.LOAD, x)
+        jump(Opcode.JZERO, done)
+        emit(Opcode.HALF)
+        emit(Opcode.ADD, 0)
+        emit(Opcode.SUB, x)
+        jump(Opcode.JZERO, even)
+        emit(Opcode.LOAD, product)
+        emit(Opcode.ADD, y)
+        emit(Opcode.STORE, product)
+        place(even)
+        emit(Opcode.LOAD, x)
+        emit(Opcode.HALF)
+        emit(Opcode.STORE, x)
+        emit(Opcode.LOAD, y)
+        emit(Opcode.ADD, 0)
+        emit(Opcode.STORE, y)
+        jump(Opcode.JUMP, loop)
+        place(done)
+        # negative when the signs differ
+        emit(Opcode.LOAD, a)
+        jump(Opcode.JPOS, a_sign)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JPOS, negative)
+        emit(Opcode.LOAD, product)
+        jump(Opcode.JUMP, end)
+        place(a_sign)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JNEG, negative)
+        emit(Opcode.LOAD, product)
+        jump(Opcode.JUMP, end)
+        place(negative)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, product)
+        jump(Opcode.JUMP, end)
+        place(zero)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        place(end)
+
+    def unsigned_division(self, quotient, zero):
+        # cell 1 = |a| mod |b|, quotient (when not None) = |a| div |b|;
+        # jumps to zero when a or b is 0
+        a, b = OPERAND_A, OPERAND_B
+        n, d, m = 1, 2, 5
+        b_positive, a_positive, double, halve, loop, done = (self.backend.new_label() for _ in range(6))
+        emit, jump, place = self.emit, self.emit_jump, self.place
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JZERO, zero)
+        jump(Opcode.JPOS, b_positive)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, b)
+        place(b_positive)
+        emit(Opcode.STORE, d)
+        emit(Opcode.STORE, m)
+        emit(Opcode.LOAD, a)
+        jump(Opcode.JZERO, zero)
+        jump(Opcode.JPOS, a_positive)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, a)
+        place(a_positive)
+        emit(Opcode.STORE, n)
+        # m = d * 2^j, the first one above n
+        place(double)
+        emit(Opcode.SUB, m)
+        jump(Opcode.JNEG, halve)
+        emit(Opcode.LOAD, m)
+        emit(Opcode.ADD, 0)
+        emit(Opcode.STORE, m)
+        emit(Opcode.LOAD, n)
+        jump(Opcode.JUMP, double)
+        place(halve)
+        if quotient is not None:
+            emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+            emit(Opcode.STORE, quotient)
+        # one quotient bit per halving of m, until m is d again
+        place(loop)
+        emit(Opcode.LOAD, m)
+        emit(Opcode.SUB, d)
+        jump(Opcode.JZERO, done)
+        emit(Opcode.LOAD, m)
+        emit(Opcode.HALF)
+        emit(Opcode.STORE, m)
+        if quotient is not None:
+            emit(Opcode.LOAD, quotient)
+            emit(Opcode.ADD, 0)
+            emit(Opcode.STORE, quotient)
+        emit(Opcode.LOAD, n)
+        emit(Opcode.SUB, m)
+        jump(Opcode.JNEG, loop)
+        emit(Opcode.STORE, n)
+        if quotient is not None:
+            emit(Opcode.LOAD, quotient)
+            emit(Opcode.ADD, ONE_CONSTANT_ADDR)
+            emit(Opcode.STORE, quotient)
+        jump(Opcode.JUMP, loop)
+        place(done)
+
+    def divide_routine(self):
+        a, b = OPERAND_A, OPERAND_B
+        quotient = self.backend.quotient
+        zero, a_positive, same, differ, exact, end = (self.backend.new_label() for _ in range(6))
+        emit, jump, place = self.emit, self.emit_jump, self.place
+        self.unsigned_division(quotient, zero)
+        emit(Opcode.LOAD, a)
+        jump(Opcode.JPOS, a_positive)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JNEG, same)
+        jump(Opcode.JUMP, differ)
+        place(a_positive)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JPOS, same)
+        place(differ)
+        # signs differ: -q, or -(q + 1) when there is a remainder
+        emit(Opcode.LOAD, 1)
+        jump(Opcode.JZERO, exact)
+        emit(Opcode.LOAD, quotient)
+        emit(Opcode.ADD, ONE_CONSTANT_ADDR)
+        emit(Opcode.STORE, quotient)
+        place(exact)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, quotient)
+        jump(Opcode.JUMP, end)
+        place(same)
+        emit(Opcode.LOAD, quotient)
+        jump(Opcode.JUMP, end)
+        place(zero)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        place(end)
+
+    def modulo_routine(self):
+        a, b = OPERAND_A, OPERAND_B
+        n, d = 1, 2
+        zero, a_positive, negate, positive, end = (self.backend.new_label() for _ in range(5))
+        emit, jump, place = self.emit, self.emit_jump, self.place
+        self.unsigned_division(None, zero)
+        emit(Opcode.LOAD, n)
+        jump(Opcode.JZERO, end)
+        emit(Opcode.LOAD, a)
+        jump(Opcode.JPOS, a_positive)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JNEG, negate)
+        emit(Opcode.LOAD, d)  # a < 0 < b
+        emit(Opcode.SUB, n)
+        jump(Opcode.JUMP, end)
+        place(a_positive)
+        emit(Opcode.LOAD, b)
+        jump(Opcode.JPOS, positive)
+        emit(Opcode.LOAD, n)  # b < 0 < a
+        emit(Opcode.SUB, d)
+        jump(Opcode.JUMP, end)
+        place(negate)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        emit(Opcode.SUB, n)
+        jump(Opcode.JUMP, end)
+        place(positive)
+        emit(Opcode.LOAD, n)
+        jump(Opcode.JUMP, end)
+        place(zero)
+        emit(Opcode.LOAD, ZERO_CONSTANT_ADDR)
+        place(end)
+
+class Backend(CodeGenerator):
+    # CodeGenerator's fragments, labels and linking for IR programs
+    def generate_ir(self, program, optimize=None):
+        # optimize(function, code), when given, may rewrite the selected code
+        # of every function before it is assembled (see peephole.py)
+        self.reset()
+        self.prologue()
+        self.next_cell = program.memory_size
+        self.quotient = self.allocate()  # scratch of the division routine
+        for function in program.functions:
+            self.begin_fragment(function.name)
+            code = Selector(self, function).select()
+            if optimize:
+                optimize(function, code)
+            self.assemble(code)
+            self.end_fragment()
+
+    def allocate(self):
+        cell = self.next_cell
+        self.next_cell += 1
+        return cell
+
+    def assemble(self, code):
+        positions = {}
+        index = len(self.instructions)
+        for item in code:
+            if isinstance(item, int):
+                positions[item] = index
+            else:
+                index += 1
+        for item in code:
+            if isinstance(item, int):
+                continue
+            if item.callee is not None:
+                self.add_call(item.opcode, item.callee)
+            elif item.label is None:
+                self.add_instruction(item.opcode, item.operand)
+            elif item.opcode == Opcode.SET:
+                self.add_return_address(positions[item.label] - len(self.instructions))
+            else:
+                self.add_instruction(item.opcode, positions[item.label] - len(self.instructions))
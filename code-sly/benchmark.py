@@ -0,0 +1,240 @@
+import os
+import sys
+import io
+import glob
+import time
+import contextlib
+import tracemalloc
+import json
+import tempfile
+import subprocess
+import parsecache
+from collections import deque
+from lexer import MyLexer, StreamLexer, lexers
+from parser import MyParser
+from resolver import Resolver
+from codegen import CodeGenerator
+from ast_nodes import count_nodes
+from synthetic import program_with_lines
+
+def control_flow_program(statements):
+    # straight line of IF/WHILE/FOR commands - every one of them needs labels
+    lines = ["PROGRAM IS", "  a, b", "BEGIN", "  READ a;", "  b := 0;"]
+    for k in range(statements):
+        if k % 3 == 0:
+            lines.append(f"  IF a > {k} THEN b := b + 1; ELSE b := b - 1; ENDIF")
+        elif k % 3 == 1:
+            lines.append(f"  WHILE b > {k} DO b := b - 1; ENDWHILE")
+        else:
+            lines.append(f"  FOR i FROM 1 TO a DO b := b + i; ENDFOR")
+    lines.append("  WRITE b;")
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+def time_codegen(root, repeat=3):
+    best = None
+    for _ in range(repeat):
+        codegen = CodeGenerator()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            codegen.generate(root)
+            code = codegen.get_code()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, code.count("\n") + 1, codegen.label_counter
+
+def bench_labels(sizes=(1000, 2000, 4000, 8000, 16000)):
+    print(f"{'statements':>10} {'labels':>8} {'instructions':>12} {'codegen [s]':>12} {'us/instr':>9}")
+    per_instruction = []
+    for size in sizes:
+        root = MyParser().parse(MyLexer().tokenize(control_flow_program(size)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            Resolver().resolve(root)
+        elapsed, instructions, labels = time_codegen(root)
+        per_instruction.append(elapsed / instructions)
+        print(f"{size:>10} {labels:>8} {instructions:>12} {elapsed:>12.4f} {elapsed / instructions * 1e6:>9.3f}")
+
+    # linear scaling keeps the cost of one instruction flat across sizes
+    growth = per_instruction[-1] / per_instruction[0]
+    print(f"per-instruction cost growth {sizes[0]} -> {sizes[-1]} statements: x{growth:.2f}")
+    return growth < 2.0
+
+def run_startup(command, runs, before=None, returncode=0):
+    times = []
+    for _ in range(runs):
+        if before:
+            before()
+        start = time.perf_counter()
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if process.returncode != returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+def clear_parse_tables():
+    for path in glob.glob(os.path.join(parsecache.CACHE_DIR, "*-parsetab-*")):
+        os.remove(path)
+
+def start_server(socket_path):
+    server = subprocess.Popen([sys.executable, "server.py", "--socket", socket_path])
+    while not os.path.exists(socket_path):
+        if server.poll() is not None:
+            raise RuntimeError("compile server exited")
+        time.sleep(0.01)
+    return server
+
+def bench_startup(runs=10):
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../tests/basic_tests/example1.imp")
+    output = os.devnull
+    compiler = [sys.executable, "compiler.py", source, output]
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "compiler.sock")
+        client = [sys.executable, "client.py", "--socket", socket_path, source, output]
+        # (name, command, run before each, exit status)
+        cases = [
+            ("python -c pass", [sys.executable, "-c", "pass"], None, 0),
+            ("compiler.py --help", [sys.executable, "compiler.py", "--help"], None, 0),
+            ("usage error", [sys.executable, "compiler.py", source], None, 2),
+            ("compile, cold tables", compiler, clear_parse_tables, 0),
+            ("compile, cached tables", compiler, None, 0),
+            ("compile -O0", compiler[:2] + ["-O0"] + compiler[2:], None, 0),
+            ("compile -O2", compiler[:2] + ["-O2"] + compiler[2:], None, 0),
+            ("client, warm server", client, None, 0),
+        ]
+        server = start_server(socket_path)
+        try:
+            print(f"{'case':<24} {'min [ms]':>9} {'mean [ms]':>10}")
+            for name, command, before, returncode in cases:
+                best, mean = run_startup(command, runs, before, returncode)
+                print(f"{name:<24} {best * 1000:>9.1f} {mean * 1000:>10.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+    return True
+
+def bench_lexer(megabytes=(1, 2, 4)):
+    print(f"{'lexer':<8} {'size [MB]':>9} {'tokens':>9} {'time [s]':>9} {'MB/s':>7} {'Mtok/s':>7}")
+    for size in megabytes:
+        statement = len(control_flow_program(1000)) / 1000
+        data = control_flow_program(int(size * 2**20 / statement))
+        for name, lexer_class in lexers.items():
+            start = time.perf_counter()
+            counter = deque(enumerate(lexer_class().tokenize(data), 1), maxlen=1)
+            elapsed = time.perf_counter() - start
+            tokens = counter[0][0]
+            print(f"{name:<8} {len(data) / 2**20:>9.1f} {tokens:>9} {elapsed:>9.3f} {len(data) / 2**20 / elapsed:>7.2f} {tokens / elapsed / 1e6:>7.2f}")
+    return True
+
+def bench_memory(sizes=(2000, 10000, 40000)):
+    print(f"{'lines':>8} {'nodes':>9} {'AST [MB]':>9} {'B/line':>7} {'B/node':>7}")
+    for size in sizes:
+        data = control_flow_program(size)
+        lines = data.count("\n")
+        tracemalloc.start()
+        root = MyParser().parse(StreamLexer().tokenize(data), data)
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        nodes = count_nodes(root)
+        print(f"{lines:>8} {nodes:>9} {retained / 2**20:>9.1f} {retained / lines:>7.0f} {retained / nodes:>7.0f}")
+        del root
+    return True
+
+def emit_joined(codegen, file):
+    file.write(codegen.get_code())
+
+def emit_streamed(codegen, file):
+    codegen.write_code(file)
+
+def bench_emit(sizes=(6000, 60000)):
+    # peak memory of writing out an already generated program
+    print(f"{'instructions':>12} {'method':<9} {'time [s]':>9} {'peak [MB]':>10} {'B/instr':>8}")
+    for size in sizes:
+        root = MyParser().parse(StreamLexer().tokenize(control_flow_program(size)))
+        codegen = CodeGenerator()
+        with contextlib.redirect_stdout(io.StringIO()):
+            Resolver().resolve(root)
+            codegen.generate(root)
+        instructions = sum(len(fragment) for fragment in codegen.fragments)
+        for name, emit in (("joined", emit_joined), ("streamed", emit_streamed)):
+            with open(os.devnull, 'w') as file:
+                tracemalloc.start()
+                start = time.perf_counter()
+                emit(codegen, file)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            print(f"{instructions:>12} {name:<9} {elapsed:>9.2f} {peak / 2**20:>10.1f} {peak / instructions:>8.1f}")
+    return True
+
+def run_measured(command):
+    # wall time and peak resident memory of one child process
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return elapsed, usage.ru_maxrss * 1024
+
+def bench_scale(sizes=(1000, 10000, 100000)):
+    # Synthetic programs with one procedure per 500 lines. Phase times come
+    # from --report-json; memory is measured on a separate plain run, since the
+    # instrumented one keeps every token alive to time the lexer on its own.
+    phases = ("lex", "parse", "resolve", "codegen", "emit")
+    print(f"{'lines':>8} {'tokens':>9} {'instructions':>12} " + " ".join(f"{phase + ' [s]':>11}" for phase in phases) +
+          f" {'us/line':>8} {'RSS [MB]':>9} {'KB/line':>8}")
+    per_line = []
+    first = None
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "program.imp")
+        output = os.path.join(directory, "program.mr")
+        report_file = os.path.join(directory, "report.json")
+        for size in sizes:
+            data = program_with_lines(size, procedures=size // 500, depth=3, arrays=2)
+            with open(source, 'w') as file:
+                file.write(data)
+            lines = data.count("\n")
+            run_measured([sys.executable, "compiler.py", "--report-json", report_file, source, output])
+            with open(report_file) as file:
+                report = {phase["name"]: phase for phase in json.load(file)["phases"]}
+            _, rss = run_measured([sys.executable, "compiler.py", source, output])
+            total = sum(phase["seconds"] for phase in report.values())
+            per_line.append(total / lines)
+            # memory that grows with the program, the interpreter itself excluded
+            if first is None:
+                first = lines, rss
+                marginal = ""
+            else:
+                marginal = f"{(rss - first[1]) / (lines - first[0]) / 1024:.2f}"
+            print(f"{lines:>8} {report['lex']['counts']['tokens']:>9} {report['emit']['counts']['instructions']:>12} " +
+                  " ".join(f"{report[phase]['seconds']:>11.3f}" for phase in phases) +
+                  f" {total / lines * 1e6:>8.1f} {rss / 2**20:>9.1f} {marginal:>8}")
+
+    # linear scaling keeps the cost of one line flat across sizes
+    growth = per_line[-1] / per_line[0]
+    print(f"per-line time growth {sizes[0]} -> {sizes[-1]} lines: x{growth:.2f}")
+    return growth < 2.0
+
+benchmarks = {
+    "labels": bench_labels,
+    "startup": bench_startup,
+    "lexer": bench_lexer,
+    "memory": bench_memory,
+    "emit": bench_emit,
+    "scale": bench_scale,
+}
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else None
+    if name not in benchmarks or (len(sys.argv) > 2 and name != "scale"):
+        print(f"Usage: python benchmark.py <{'|'.join(benchmarks)}>\n"
+              f"       python benchmark.py scale [lines ...]")
+        sys.exit(1)
+
+    sizes = [int(size) for size in sys.argv[2:]]
+    if not (benchmarks[name](sizes) if sizes else benchmarks[name]()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
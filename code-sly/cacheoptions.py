@@ -0,0 +1,21 @@
+import os
+
+# Command-line options of the compile cache. Kept apart from compilecache.py
+# so that a compiler started without --cache doesn't import the cache at all.
+
+DEFAULT_DIR = os.environ.get("IMP_COMPILER_CACHE") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "imp-compiler")
+DEFAULT_MAX_SIZE = 256  # MB
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache", action="store_true",
+                        help=f"reuse earlier results from the compile cache (default directory: {DEFAULT_DIR})")
+    parser.add_argument("--cache-dir", help="compile cache directory, implies --cache")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_SIZE,
+                        help=f"compile cache size cap in MB (default: {DEFAULT_MAX_SIZE})")
+
+def cache_settings(args):
+    # (directory, size) to build a CompileCache from, None when caching is off
+    if args.cache_dir is None and not args.cache:
+        return None
+    return args.cache_dir or DEFAULT_DIR, args.cache_size
@@ -0,0 +1,49 @@
+# Which arguments a call may write. Parameters are passed by reference, so
+# a call may change every variable and array it is handed - unless the
+# procedure, and whatever it calls in turn, never writes that parameter.
+# This program pass works out the parameters every procedure may write and
+# records them on each call (Instr.written); the IR passes then only forget
+# what a call may really change.
+
+def written_parameters(function, written):
+    # positions of the parameters function may write, given written: name
+    # -> positions for the procedures it calls
+    positions = {parameter: k for k, parameter in enumerate(function.parameters)}
+    result = set()
+    for block in function.blocks:
+        for instr in block.instrs:
+            if instr.op == "call":
+                arguments = instr.args[1:]
+                targets = [arguments[k] for k in written[instr.args[0].name]]
+            elif instr.op == "store":
+                targets = [instr.args[0]]
+            elif instr.op == "storei":
+                targets = [instr.args[-1]]
+            else:
+                targets = [instr.dst]
+            result.update(positions[target] for target in targets if target in positions)
+    return result
+
+def narrow_call_effects(program):
+    # returns how many calls were found to write fewer arguments than they
+    # are handed
+    procedures = [function for function in program.functions if not function.is_main]
+    written = {function.name: set() for function in procedures}
+    changed = True
+    while changed:
+        changed = False
+        for function in procedures:
+            positions = written_parameters(function, written)
+            if positions != written[function.name]:
+                written[function.name] = positions
+                changed = True
+    narrowed = 0
+    for function in program.functions:
+        for block in function.blocks:
+            for instr in block.instrs:
+                if instr.op == "call":
+                    positions = frozenset(written[instr.args[0].name])
+                    if instr.written != positions and len(positions) < len(instr.args) - 1:
+                        narrowed += 1
+                    instr.written = positions
+    return narrowed
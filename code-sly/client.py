@@ -0,0 +1,55 @@
+import sys
+import json
+import socket
+import contextlib
+from compiler import argument_parser, open_output
+from cacheoptions import cache_settings
+from server import DEFAULT_SOCKET
+
+# Drop-in replacement for compiler.py that hands the work to a running
+# server.py; without a server it compiles in-process like compiler.py.
+
+def request_compile(path, source, lexer, level="0", cache_settings=None):
+    # the server uses the client's cache options, not its own
+    request = {"source": source, "lexer": lexer, "level": level, "cache": cache_settings}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+def main():
+    parser = argument_parser()
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help=f"compile server socket (default: {DEFAULT_SOCKET})")
+    args = parser.parse_args()
+
+    try:
+        with open(args.input_file, 'r') as file:
+            data = file.read()
+    except FileNotFoundError:
+        print(f"Failed to open file: {args.input_file}")
+        return
+
+    # output_file "-" is stdout, as for compiler.py: the code goes there and
+    # everything else is printed to stderr
+    stdout = sys.stdout
+    to_stdout = args.output_file == "-"
+    with contextlib.redirect_stdout(sys.stderr) if to_stdout else contextlib.nullcontext():
+        try:
+            response = request_compile(args.socket, data, args.lexer, args.level, cache_settings(args))
+        except (OSError, ValueError):
+            # no server (or it went away) - do the work here
+            from compiler import Compiler
+            machine_code = Compiler(cache_settings(args)).compile(data, args.lexer, args.level)
+        else:
+            sys.stdout.write(response["output"])
+            machine_code = response["code"]
+
+    if machine_code is not None:
+        with open_output(stdout if to_stdout else args.output_file) as file:
+            file.write(machine_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import os
+import json
+import fcntl
+import marshal
+import hashlib
+import argparse
+from cacheoptions import DEFAULT_DIR, DEFAULT_MAX_SIZE
+
+# On-disk compile cache. Entries are content addressed: the key of a whole
+# program hashes its source, the compiler version and the options; the key of
+# a procedure fragment hashes the procedure's text and the layout it was
+# generated for. Files are touched on every hit and the least recently used
+# ones are evicted once the cache grows past its size cap.
+
+CACHE_FORMAT = 1
+STATS_FILE = "stats.json"
+
+# every module whose code can change the generated program
+COMPILER_MODULES = ("ast_nodes", "codegen", "compilecache", "instructions", "lexer", "linker", "parser", "resolver",
+                    "symbols",
+                    # the optimizing pipeline, -O1 and up
+                    "lowering", "ir", "ssa", "analysis", "optimizer", "controlflow", "constprop", "deadcode",
+                    "calls", "valuenum", "unroll", "licm", "strength", "pointers", "backend", "peephole")
+
+def compiler_version():
+    import sly
+    digest = hashlib.sha256(f"{CACHE_FORMAT} {sly.__version__}".encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in COMPILER_MODULES:
+        with open(os.path.join(directory, f"{module}.py"), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+class CompileCache:
+    def __init__(self, directory=DEFAULT_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size * 2**20
+        self.version = compiler_version()
+        self.stats = dict.fromkeys(("program_hits", "program_misses", "fragment_hits", "fragment_misses", "evictions"), 0)
+        self.flushed = dict(self.stats)
+
+    def key(self, *parts):
+        digest = hashlib.sha256(self.version.encode())
+        for part in parts:
+            digest.update(b"\0" + repr(part).encode())
+        return digest.hexdigest()
+
+    def program_key(self, source, options):
+        return self.key("program", source, sorted(options.items()))
+
+    def fragment_key(self, source, layout):
+        return self.key("fragment", source, layout)
+
+    def path(self, kind, key):
+        return os.path.join(self.directory, f"{kind}-{key}.marshal")
+
+    def load(self, kind, key):
+        path = self.path(kind, key)
+        try:
+            with open(path, 'rb') as file:
+                value = marshal.load(file)
+            os.utime(path)  # recently used
+        except (OSError, EOFError, ValueError, TypeError):
+            self.stats[f"{kind}_misses"] += 1
+            return None
+        self.stats[f"{kind}_hits"] += 1
+        return value
+
+    def store(self, kind, key, value):
+        path = self.path(kind, key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                marshal.dump(value, file)
+            os.replace(temp_path, path)  # readers never see a half-written entry
+        except OSError:
+            # read-only or full disk: compile without caching
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def load_program(self, key):
+        # (machine code, printed output) or None
+        return self.load("program", key)
+
+    def store_program(self, key, code, output):
+        self.store("program", key, (code, output))
+
+    def load_fragment(self, key):
+        # Fragment.to_bytes() of a procedure, or None
+        return self.load("fragment", key)
+
+    def store_fragment(self, key, data):
+        self.store("fragment", key, data)
+
+    def entries(self):
+        # (mtime, size, path) of every cache entry
+        result = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".marshal"):
+                        stat = entry.stat()
+                        result.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+        return result
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        # least recently used first, down to 90% so the next compile doesn't evict again
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats["evictions"] += 1
+
+    def flush(self):
+        # evicts and adds this process' new hits and misses to the totals on disk
+        self.evict()
+        delta = {name: self.stats[name] - self.flushed[name] for name in self.stats}
+        self.flushed = dict(self.stats)
+        if not any(delta.values()):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, STATS_FILE), 'a+') as file:
+                fcntl.flock(file, fcntl.LOCK_EX)  # batch workers share the file
+                file.seek(0)
+                try:
+                    totals = json.load(file)
+                except ValueError:
+                    totals = {}
+                for name, count in delta.items():
+                    totals[name] = totals.get(name, 0) + count
+                file.seek(0)
+                file.truncate()
+                json.dump(totals, file)
+        except OSError:
+            pass
+
+    def totals(self):
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+        try:
+            os.remove(os.path.join(self.directory, STATS_FILE))
+        except OSError:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or clear the compile cache.")
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR)
+    parser.add_argument("--clear", action="store_true", help="remove every entry and the statistics")
+    args = parser.parse_args()
+
+    cache = CompileCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        return
+    entries = cache.entries()
+    totals = cache.totals()
+    print(f"{args.cache_dir}: {len(entries)} entries, {sum(size for _, size, _ in entries) / 2**20:.1f} MB")
+    for kind in ("program", "fragment"):
+        hits, misses = totals.get(f"{kind}_hits", 0), totals.get(f"{kind}_misses", 0)
+        ratio = hits / (hits + misses) if hits + misses else 0
+        print(f"{kind:<9} {hits:>8} hits {misses:>8} misses  {ratio:>6.1%}")
+    print(f"evictions {totals.get('evictions', 0):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,366 @@
+import os
+import io
 import sys
-from lexer import MyLexer
-from parser import MyParser
-from codegen import CodeGenerator
+import time
+import argparse
+import contextlib
+from cacheoptions import add_cache_arguments, cache_settings
+
+# -O levels; optimizer.py has the pipelines of all but 0, and is only
+# imported to build at one of them
+LEVELS = ("0", "1", "2", "s")
+
+def argument_parser(batch=False):
+    if batch:
+        parser = argparse.ArgumentParser(
+            description="Compile .imp programs for the virtual machine.",
+            usage="%(prog)s [options] input_file output_file\n"
+                  "       %(prog)s [options] -o OUTPUT_DIR input [input ...]")
+        parser.add_argument("inputs", nargs="+", metavar="input",
+                            help="input_file output_file, or with -o any number of files and directories")
+        parser.add_argument("-o", "--output-dir",
+                            help="compile every input into OUTPUT_DIR/<name>.mr and print a summary")
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="worker processes for -o (default: number of CPUs)")
+        parser.add_argument("--watch", action="store_true",
+                            help="recompile input_file into output_file whenever it changes, reusing unchanged parts")
+        parser.add_argument("--emit-ir", action="store_true",
+                            help="write the intermediate representation to output_file instead of machine code")
+        parser.add_argument("--ssa", action="store_true", help="with --emit-ir, in static single assignment form")
+    else:
+        parser = argparse.ArgumentParser(description="Compile an .imp program for the virtual machine.")
+        parser.add_argument("input_file")
+        parser.add_argument("output_file")
+    parser.add_argument("--lexer", choices=["stream", "sly"], default="stream",
+                        help="tokenizer backend (default: stream)")
+    parser.add_argument("-O", dest="level", choices=LEVELS, default="0",
+                        help="optimization level: 0 is the plain code generator, s optimizes for size (default: 0)")
+    add_cache_arguments(parser)
+    if batch:
+        # phase and pass reports; the client has nowhere to print them
+        parser.add_argument("--time-passes", action="store_true",
+                            help="print the time and item counts of every compiler phase to stderr")
+        parser.add_argument("--mem-report", action="store_true",
+                            help="like --time-passes, with peak and retained traced memory per phase")
+        parser.add_argument("--report-json", metavar="FILE",
+                            help="write the phase report as JSON to FILE "
+                                 "(with memory figures when --mem-report is given)")
+        parser.add_argument("--pass-report", action="store_true",
+                            help="print the instructions every optimization pass changed and the VM cost it saved")
+    return parser
+
+class Compiler:
+    # Lexers, parser and code generator are built once and reused for every
+    # compile() call - the compile server keeps one of these warm.
+    # cache_settings is a (directory, size cap in MB) pair or None.
+    def __init__(self, cache_settings=None):
+        # imported here so that usage errors don't pay for building sly classes
+        from lexer import lexers
+        from parser import MyParser
+        from codegen import CodeGenerator
+
+        self.cache = None
+        if cache_settings:
+            from compilecache import CompileCache
+            self.cache = CompileCache(*cache_settings)
+        self.lexers = {name: lexer_class() for name, lexer_class in lexers.items()}
+        self.parser = MyParser()
+        self.codegen = CodeGenerator(self.cache)
+        self.backend = None  # Backend for optimized builds, made when first needed
+        self.generator = self.codegen  # whichever of the two holds the last program
+        self.passes = None  # PassManager of the last optimized build
+        self.diagnostics = []  # messages printed by the last compile()
+        self.phases = None  # PhaseReport filled in by every compile, see instrument.py
+
+    def report(self, message):
+        print(message)
+        self.diagnostics.append(message)
+
+    def phase(self, name):
+        if self.phases is None:
+            return contextlib.nullcontext()
+        return self.phases.phase(name)
+
+    def compile(self, data, lexer="stream", level="0"):
+        # Diagnostics are printed, as the command line always did; returns the
+        # machine code, or None when compilation failed.
+        if self.cache is None:
+            return self.compile_source(data, lexer, level)
+
+        key = self.cache.program_key(data, {"lexer": lexer, "level": level})
+        cached = self.cache.load_program(key)
+        if cached:
+            machine_code, output = cached
+            self.diagnostics = []
+        else:
+            # what gets printed is cached too, a hit looks just like a compile
+            capture = io.StringIO()
+            with contextlib.redirect_stdout(capture):
+                machine_code = self.compile_source(data, lexer, level)
+            output = capture.getvalue()
+            if machine_code is not None:
+                self.cache.store_program(key, machine_code, output)
+        sys.stdout.write(output)
+        self.cache.flush()
+        return machine_code
+
+    def compile_to(self, data, output, lexer="stream", level="0"):
+        # Like compile(), but the machine code goes to output (a path or an open
+        # file) as it is formatted; returns the instruction count or None.
+        if self.cache is not None:
+            # the cache stores whole programs, there is nothing to stream
+            machine_code = self.compile(data, lexer, level)
+            if machine_code is None:
+                return None
+            with open_output(output) as file:
+                file.write(machine_code)
+            return machine_code.count("\n") + 1
+        if not self.generate(data, lexer, level):
+            return None
+        with open_output(output) as file, self.phase("emit"):
+            instructions = self.generator.write_code(file)
+        if self.phases:
+            self.phases.count(instructions=instructions)
+        return instructions
+
+    def compile_source(self, data, lexer, level="0"):
+        if not self.generate(data, lexer, level):
+            return None
+        with self.phase("emit"):
+            return self.generator.get_code()
+
+    def generate(self, data, lexer, level="0"):
+        # runs the whole pipeline into self.generator; False after printing errors
+        root = self.parse(data, lexer)
+        return root is not None and self.build(root, level)
+
+    def parse(self, data, lexer):
+        # the AST of data, or None after printing errors
+        from ast_nodes import count_nodes
+
+        parser = self.parser
+        phases = self.phases
+        self.diagnostics = []
+        try:
+            # tokens are pulled by the parser one at a time
+            tokens = self.lexers[lexer].tokenize(data)
+            if phases:
+                # except when lexing is measured as a phase of its own
+                with phases.phase("lex"):
+                    tokens = list(tokens)
+                phases.count(tokens=len(tokens))
+                tokens = iter(tokens)
+            with self.phase("parse"):
+                root = parser.parse(tokens, data)
+            if root:
+                # root.print()
+                if phases:
+                    phases.count(nodes=count_nodes(root))
+                return root
+            else:
+                self.report("No AST generated.")
+        except Exception as e:
+            self.report(f"Parsing failed: {e}")
+        return None
+
+    def build(self, root, level="0"):
+        # resolves a parsed program and generates its code into self.generator,
+        # CodeGenerator at -O0 and Backend otherwise
+        phases = self.phases
+        self.passes = None
+        self.codegen.reset()
+        if not self.resolve(root):
+            return False
+        try:
+            if level == "0":
+                codegen = self.codegen
+                with self.phase("codegen"):
+                    codegen.generate(root)
+            else:
+                codegen = self.optimize(root, level)
+            if phases:
+                phases.count(instructions=sum(len(fragment) for fragment in codegen.fragments),
+                             labels=codegen.label_counter, fragments=len(codegen.fragments))
+        except Exception as e:
+            self.report(f"Code generation error: {e}")
+            return False
+        self.generator = codegen
+        return True
+
+    def lower(self, root, level):
+        # the IR of a resolved program, through the pass pipeline of level
+        from lowering import lower
+
+        phases = self.phases
+        with self.phase("lower"):
+            program = lower(root)
+        if phases:
+            phases.count(instructions=program.instruction_count(), functions=len(program.functions))
+        if level != "0":
+            from optimizer import PassManager
+            self.passes = PassManager(level)
+            with self.phase("optimize"):
+                self.passes.optimize(program)
+            if phases:
+                phases.count(instructions=program.instruction_count(), changed=self.passes.changed())
+        return program
+
+    def optimize(self, root, level):
+        # the code of the optimized program, in self.backend
+        from backend import Backend
+
+        program = self.lower(root, level)
+        if self.backend is None:
+            self.backend = Backend()
+        with self.phase("codegen"):
+            self.backend.generate_ir(program, self.passes.optimize_machine_code)
+        return self.backend
+
+    def resolve(self, root):
+        # False after printing the semantic errors
+        from resolver import Resolver, SemanticError
+
+        try:
+            with self.phase("resolve"):
+                Resolver().resolve(root)
+        except SemanticError as e:
+            for error in e.errors:
+                self.report(f"Error: {error}")
+            return False
+        except Exception as e:
+            self.report(f"Code generation error: {e}")
+            return False
+        if self.phases:
+            self.phases.count(memory_cells=root.memory_size)
+        return True
+
+    def emit_ir(self, data, output, lexer="stream", ssa=False, level="0"):
+        # Writes the IR of the program (see ir.py), after the passes of level,
+        # to output instead of its machine code; False after printing errors.
+        from ir import format_program
+
+        self.passes = None
+        root = self.parse(data, lexer)
+        if root is None or not self.resolve(root):
+            return False
+        try:
+            program = self.lower(root, level)
+        except Exception as e:
+            self.report(f"Code generation error: {e}")
+            return False
+        if ssa:
+            from ssa import to_ssa
+            with self.phase("ssa"):
+                for function in program.functions:
+                    to_ssa(function)
+        with open_output(output) as file:
+            file.write(format_program(program))
+        return True
+
+def open_output(output):
+    if isinstance(output, str):
+        return open(output, 'w')
+    return contextlib.nullcontext(output)
+
+# Batch mode: every worker process builds one Compiler and reuses it for all
+# the files it is given.
+worker_compiler = None
+
+def init_worker(cache_settings=None):
+    global worker_compiler
+    worker_compiler = Compiler(cache_settings)
+
+def compile_file(task):
+    input_file, output_file, lexer, level = task
+    start = time.perf_counter()
+    try:
+        with open(input_file, 'r') as file:
+            data = file.read()
+    except OSError as e:
+        return input_file, time.perf_counter() - start, 0, [f"Failed to open file: {e}"]
+    with contextlib.redirect_stdout(io.StringIO()):  # allocation log
+        instructions = worker_compiler.compile_to(data, output_file, lexer, level)
+    if instructions is None:
+        return input_file, time.perf_counter() - start, 0, worker_compiler.diagnostics
+    return input_file, time.perf_counter() - start, instructions, []
+
+def collect_inputs(paths):
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".imp")))
+        else:
+            inputs.append(path)
+    return inputs
+
+def compile_batch(inputs, output_dir, jobs, lexer, cache_settings=None, level="0"):
+    # returns the number of files that failed
+    tasks = []
+    outputs = set()
+    for input_file in inputs:
+        output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + ".mr")
+        if output_file in outputs:
+            raise ValueError(f"Two inputs would both be written to {output_file}")
+        outputs.add(output_file)
+        tasks.append((input_file, output_file, lexer, level))
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    if jobs <= 1 or len(tasks) <= 1:
+        init_worker(cache_settings)
+        results = list(map(compile_file, tasks))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(jobs, len(tasks)), initializer=init_worker, initargs=(cache_settings,)) as pool:
+            results = list(pool.map(compile_file, tasks))
+    elapsed = time.perf_counter() - start
+
+    width = max(len(input_file) for input_file in inputs)
+    print(f"{'file':<{width}} {'time [ms]':>9} {'instructions':>12}  errors")
+    failed = 0
+    for input_file, seconds, instructions, errors in results:
+        failed += bool(errors)
+        print(f"{input_file:<{width}} {seconds * 1000:>9.1f} {instructions:>12}  {'; '.join(errors)}")
+    total = sum(result[1] for result in results)
+    print(f"{len(results)} files, {failed} failed, {sum(result[2] for result in results)} instructions, "
+          f"{total:.2f} s compile time, {elapsed:.2f} s wall time on {max(1, min(jobs, len(tasks)))} workers")
+    return failed
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python main.py <input_file> <output_file>")
-        return
+    parser = argument_parser(batch=True)
+    args = parser.parse_args()
+    if args.watch and (args.output_dir is not None or args.inputs[-1] == "-"):
+        parser.error("--watch needs input_file and output_file")
+    if args.ssa and not args.emit_ir:
+        parser.error("--ssa only applies to --emit-ir")
+    if args.emit_ir and (args.output_dir is not None or args.watch):
+        parser.error("--emit-ir needs input_file and output_file")
+    if args.pass_report and args.level == "0":
+        parser.error("--pass-report needs -O1, -O2 or -Os")
+    if args.output_dir is not None:
+        if args.time_passes or args.mem_report or args.report_json or args.pass_report:
+            parser.error("phase reports are only available for a single input file")
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        inputs = collect_inputs(args.inputs)
+        if not inputs:
+            parser.error("no .imp files found")
+        try:
+            failed = compile_batch(inputs, args.output_dir, args.jobs, args.lexer, cache_settings(args), args.level)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(1 if failed else 0)
+    if len(args.inputs) != 2:
+        parser.error("expected input_file output_file, or -o OUTPUT_DIR with any number of inputs")
+    input_file, output_file = args.inputs
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    if args.watch:
+        from incremental import watch
+        try:
+            watch(input_file, output_file, args.lexer, args.level)
+        except KeyboardInterrupt:
+            pass
+        return
 
     try:
         with open(input_file, 'r') as file:
@@ -18,30 +369,33 @@ def main():
         print(f"Failed to open file: {input_file}")
         return
 
-    lexer = MyLexer()
-    parser = MyParser()
-    try:
-        tokens = list(lexer.tokenize(data))
-        # print("Tokens:")
-        # for token in tokens:
-        #     print(token)
-        root = parser.parse(iter(tokens))
-        if root:
-            # root.print()
-            try:
-                codegen = CodeGenerator()
-                codegen.generate(root)
-            except Exception as e:
-                error_line = getattr(parser, 'error_line', 0) or 'unknown'
-                print(f"Code generation error: {e}")
-                return
-            machine_code = codegen.get_code()
-            with open(output_file, 'w') as file:
-                file.write(machine_code)
-        else:
-            print("No AST generated.")
-    except Exception as e:
-        print(f"Parsing failed: {e}")
+    compiler = Compiler(cache_settings(args))
+    if args.time_passes or args.mem_report or args.report_json:
+        from instrument import PhaseReport
+        compiler.phases = PhaseReport(memory=args.mem_report)
+    compile_to = compiler.compile_to
+    if args.emit_ir:
+        def compile_to(data, output, lexer, level):
+            return compiler.emit_ir(data, output, lexer, args.ssa, level)
+    if output_file == "-":
+        # the code goes to stdout, everything else is printed to stderr
+        stdout = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            compile_to(data, stdout, args.lexer, args.level)
+    else:
+        compile_to(data, output_file, args.lexer, args.level)
+
+    if args.pass_report and compiler.passes:
+        print(compiler.passes.table(), file=sys.stderr)
+
+    if compiler.phases:
+        compiler.phases.stop()
+        if args.time_passes or args.mem_report:
+            print(compiler.phases.table(), file=sys.stderr)
+        if args.report_json:
+            sections = {"optimization": compiler.passes.as_dict()} if compiler.passes else {}
+            with open(args.report_json, 'w') as file:
+                file.write(compiler.phases.to_json(**sections))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,191 @@
+from ir import Instr, BINARY, compare, evaluate
+from analysis import predecessors, reverse_postorder
+
+# Constant propagation over an IR function, flow-sensitive and conditional:
+# a forward data-flow analysis of the variables holding a known constant at
+# every point, in which a branch whose outcome is known only lets its state
+# through to the successor it takes. Blocks are visited optimistically - a
+# predecessor nobody has reached yet constrains nothing - so a variable set
+# to the same constant on every path into a loop stays known inside it.
+#
+# Procedure parameters are passed by reference and two of them may name the
+# same variable, so writing one forgets what was known about all of them. A
+# call may write its arguments (those calls.py hasn't ruled out).
+#
+# Afterwards every use of a known variable becomes the constant and every
+# branch that can only go one way becomes a jump. simplify_algebra then folds
+# what is left.
+
+def meet(states):
+    # what every incoming state agrees on
+    result = dict(states[0])
+    for state in states[1:]:
+        for var in [var for var, value in result.items() if state.get(var, value + 1) != value]:
+            del result[var]
+    return result
+
+def value_of(state, operand):
+    # the constant an operand is known to hold, or None
+    if isinstance(operand, int):
+        return operand
+    return state.get(operand)
+
+def forget_by_ref(state):
+    for var in [var for var in state if var.by_ref]:
+        del state[var]
+
+def transfer(state, instr):
+    # state after instr
+    op = instr.op
+    if op == "call":
+        for arg in instr.defs():
+            state.pop(arg, None)
+            if arg.by_ref:
+                forget_by_ref(state)
+        return
+    dst = instr.dst
+    if dst is None:
+        return
+    if dst.by_ref:
+        forget_by_ref(state)
+    value = known_value(state, instr)
+    if value is None:
+        state.pop(dst, None)
+    else:
+        state[dst] = value
+
+def known_value(state, instr):
+    # the constant instr computes, or None
+    op, args = instr.op, instr.args
+    if op != "copy" and op != "half" and op not in BINARY:
+        return None
+    values = [value_of(state, arg) for arg in args]
+    if None not in values:
+        return evaluate(op, *values)
+    if op in ("sub", "mod") and args[0] is args[1]:
+        return 0
+    if len(values) == 2:
+        a, b = values
+        if op == "mul" and 0 in values:
+            return 0
+        if op in ("div", "mod") and (a == 0 or b == 0):
+            return 0
+        if op == "mod" and b in (1, -1):
+            return 0
+    return None
+
+def taken(state, terminator):
+    # successors control can reach from a block ending in terminator
+    if terminator is None:
+        return []
+    if terminator.op == "branch":
+        operation, a, b, if_true, if_false = terminator.args
+        a, b = value_of(state, a), value_of(state, b)
+        if a is not None and b is not None:
+            return [if_true if compare(operation, a, b) else if_false]
+    return terminator.targets()
+
+def analyze(function):
+    # block -> state at its start, for the blocks control can reach
+    order = reverse_postorder(function)
+    preds = predecessors(function)
+    entry = function.entry
+    state_in, state_out = {}, {}
+    edges = set()  # (predecessor, successor) pairs control can take
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            if block is entry:
+                state = {}
+            else:
+                incoming = [state_out[pred] for pred in preds[block] if (pred, block) in edges]
+                if not incoming:
+                    continue
+                state = meet(incoming)
+            state_in[block] = dict(state)
+            for instr in block.instrs:
+                transfer(state, instr)
+            for successor in taken(state, block.terminator):
+                if (block, successor) not in edges:
+                    edges.add((block, successor))
+                    changed = True
+            if state_out.get(block) != state:
+                state_out[block] = state
+                changed = True
+    return state_in
+
+def propagate_constants(function):
+    changed = 0
+    for block, state in analyze(function).items():
+        for instr in block.instrs:
+            mapping = {operand: state[operand] for operand in instr.uses() if operand in state}
+            if mapping and instr.replace_uses(mapping):
+                changed += 1
+            if instr is block.terminator and instr.op == "branch":
+                targets = taken(state, instr)
+                if len(targets) == 1:
+                    block.instrs[-1] = Instr("jump", None, targets)
+                    changed += 1
+            else:
+                transfer(state, instr)
+    return changed
+
+def simplified(instr):
+    # (op, args) of a cheaper equivalent of instr, or None
+    op, args = instr.op, instr.args
+    if op == "half" and isinstance(args[0], int):
+        return "copy", [evaluate(op, args[0])]
+    if op not in BINARY:
+        return None
+    a, b = args
+    if isinstance(a, int) and isinstance(b, int):
+        return "copy", [evaluate(op, a, b)]
+    if op == "add":
+        if b == 0:
+            return "copy", [a]
+        if a == 0:
+            return "copy", [b]
+    elif op == "sub":
+        if b == 0:
+            return "copy", [a]
+        if a is b:
+            return "copy", [0]
+    elif op == "mul":
+        if a == 0 or b == 0:
+            return "copy", [0]
+        if b == 1:
+            return "copy", [a]
+        if a == 1:
+            return "copy", [b]
+        if b == -1:
+            return "sub", [0, a]
+        if a == -1:
+            return "sub", [0, b]
+    elif op == "div":
+        # x / 0 is 0, and so is 0 / x
+        if a == 0 or b == 0:
+            return "copy", [0]
+        if b == 1:
+            return "copy", [a]
+        if b == -1:
+            return "sub", [0, a]
+    elif op == "mod":
+        if a == 0 or b in (0, 1, -1) or a is b:
+            return "copy", [0]
+    return None
+
+def simplify_algebra(function):
+    # constant operands folded, identities like x * 1, x + 0, x - x applied
+    # and copies of a variable to itself dropped
+    changed = 0
+    for block in function.blocks:
+        for instr in block.instrs:
+            replacement = simplified(instr)
+            if replacement is not None:
+                instr.op, instr.args = replacement
+                changed += 1
+        kept = [instr for instr in block.instrs if not (instr.op == "copy" and instr.dst is instr.args[0])]
+        changed += len(block.instrs) - len(kept)
+        block.instrs = kept
+    return changed
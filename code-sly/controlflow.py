@@ -0,0 +1,87 @@
+from ir import Instr, compare
+from analysis import predecessors, remove_unreachable
+
+# CFG clean-up over an IR function: branches whose outcome is known become
+# jumps, jumps to blocks holding nothing but a jump go straight to the final
+# target, blocks only the entry can't reach are dropped and a block that is
+# the single successor of a jump and has no other predecessor is merged into
+# it. Other passes leave the pieces behind; this one tidies up after them.
+
+def fold_branches(function):
+    changed = 0
+    for block in function.blocks:
+        terminator = block.terminator
+        if terminator is None or terminator.op != "branch":
+            continue
+        operation, a, b, if_true, if_false = terminator.args
+        if if_true is if_false:
+            target = if_true
+        elif isinstance(a, int) and isinstance(b, int):
+            target = if_true if compare(operation, a, b) else if_false
+        elif a is b:
+            target = if_true if compare(operation, 0, 0) else if_false
+        else:
+            continue
+        block.instrs[-1] = Instr("jump", None, [target])
+        changed += 1
+    return changed
+
+def thread_jumps(function):
+    forward = {block: block.terminator.args[0] for block in function.blocks[1:]
+               if len(block.instrs) == 1 and block.instrs[0].op == "jump"}
+    resolved = {}
+
+    def final(block):
+        chain = []
+        while block in forward and block not in chain:
+            if block in resolved:
+                block = resolved[block]
+                break
+            chain.append(block)
+            block = forward[block]
+        for link in chain:
+            resolved[link] = block
+        return block
+
+    changed = 0
+    for block in function.blocks:
+        terminator = block.terminator
+        if terminator is None:
+            continue
+        positions = (0,) if terminator.op == "jump" else (3, 4) if terminator.op == "branch" else ()
+        for position in positions:
+            target = final(terminator.args[position])
+            if target is not terminator.args[position]:
+                terminator.args[position] = target
+                changed += 1
+    return changed
+
+def merge_blocks(function):
+    preds = predecessors(function)
+    entry = function.entry
+    merged = set()
+    for block in function.blocks:
+        if block in merged:
+            continue
+        while True:
+            terminator = block.terminator
+            if terminator is None or terminator.op != "jump":
+                break
+            successor = terminator.args[0]
+            if successor is entry or successor is block or preds[successor] != [block]:
+                break
+            block.instrs[-1:] = successor.instrs
+            merged.add(successor)
+            for following in successor.successors():
+                preds[following] = [block if pred is successor else pred for pred in preds[following]]
+    function.blocks = [block for block in function.blocks if block not in merged]
+    return len(merged)
+
+def simplify_cfg(function):
+    changed = 0
+    while True:
+        step = fold_branches(function) + thread_jumps(function)
+        step += remove_unreachable(function) + merge_blocks(function)
+        if not step:
+            return changed
+        changed += step
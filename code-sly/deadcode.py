@@ -0,0 +1,98 @@
+from analysis import predecessors, upward_exposed
+
+# Dead code over the IR. remove_dead_code is liveness-based: an instruction
+# without side effects whose result no path reads again goes, and so does
+# everything only it kept alive. What stays live at the exit of a procedure:
+# its by-reference parameters, which are the caller's variables, and locals a
+# later call may read before writing them - every procedure variable has one
+# cell for all calls. Writes to by-reference parameters are never removed,
+# another parameter may name the same variable.
+#
+# It also drops the `init` of every array: the instruction fills the offset
+# cell that CodeGenerator reads, and the backend addresses arrays by their
+# constant offsets (or the parameter cell) without it.
+#
+# remove_unused_procedures drops the procedures no call chain from the main
+# program reaches.
+
+def exit_live(function):
+    if function.is_main:
+        return set()
+    return {var for var in function.variables if var.by_ref} | upward_exposed(function)
+
+def removable(instr):
+    return (instr.dst is not None and not instr.has_side_effects()
+            and not instr.dst.by_ref and instr.op != "phi")
+
+def liveness(function, live_at_exit):
+    # block -> variables live at its end
+    preds = predecessors(function)
+    uses, kills = {}, {}
+    for block in function.blocks:
+        used, killed = set(), set()
+        for instr in reversed(block.instrs):
+            if instr.dst is not None:
+                used.discard(instr.dst)
+                killed.add(instr.dst)
+            used.update(instr.uses())
+        uses[block], kills[block] = used, killed
+    live_in = {block: set(uses[block]) for block in function.blocks}
+    live_out = {block: set() for block in function.blocks}
+    worklist = list(function.blocks)
+    pending = set(worklist)
+    while worklist:
+        block = worklist.pop()
+        pending.discard(block)
+        out = set(live_at_exit) if block.terminator is not None and block.terminator.op == "exit" else set()
+        for successor in block.successors():
+            out |= live_in[successor]
+        live_out[block] = out
+        new = uses[block] | (out - kills[block])
+        if new != live_in[block]:
+            live_in[block] = new
+            for pred in preds[block]:
+                if pred not in pending:
+                    pending.add(pred)
+                    worklist.append(pred)
+    return live_out
+
+def remove_dead_code(function):
+    removed = 0
+    for block in function.blocks:
+        kept = [instr for instr in block.instrs if instr.op != "init"]
+        removed += len(block.instrs) - len(kept)
+        block.instrs = kept
+    live_at_exit = exit_live(function)
+    while True:
+        live_out = liveness(function, live_at_exit)
+        step = 0
+        for block in function.blocks:
+            live = set(live_out[block])
+            kept = []
+            for instr in reversed(block.instrs):
+                if removable(instr) and instr.dst not in live:
+                    step += 1
+                    continue
+                if instr.dst is not None:
+                    live.discard(instr.dst)
+                live.update(instr.uses())
+                kept.append(instr)
+            kept.reverse()
+            block.instrs = kept
+        if not step:
+            return removed
+        removed += step
+
+def remove_unused_procedures(program):
+    called = set()
+    stack = [program.main]
+    while stack:
+        function = stack.pop()
+        for block in function.blocks:
+            for instr in block.instrs:
+                if instr.op == "call" and instr.args[0].name not in called:
+                    called.add(instr.args[0].name)
+                    stack.append(program.function(instr.args[0].name))
+    unused = [function for function in program.functions if not function.is_main and function.name not in called]
+    program.functions = [function for function in program.functions if function not in unused]
+    return sum(function.instruction_count() for function in unused)
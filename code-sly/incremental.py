@@ -0,0 +1,207 @@
+import io
+import os
+import sys
+import time
+import contextlib
+from ast_nodes import ProgramNode, ProceduresNode, MainNode, shift_lines
+from compiler import Compiler, open_output
+
+# Incremental recompilation for --watch. The source is kept as a list of
+# units, one per procedure plus the main program, each with the text span it
+# was parsed from. After an edit only the units the changed text touches are
+# lexed and parsed again; the others keep their AST (moved down or up when
+# the edit added or removed lines). Resolution always covers the whole program
+# since addresses depend on every declaration before them, but the code of a
+# procedure whose text and layout are unchanged comes from the previous
+# compile, see FragmentMemory.
+
+class Unit:
+    __slots__ = ("start", "end", "node")
+
+    def __init__(self, start, end, node):
+        self.start = start  # span of the source text, units tile the whole file
+        self.end = end
+        self.node = node  # ProcedureNode or MainNode
+
+class FragmentMemory:
+    # Stands in for CompileCache in the code generator: fragments of the last
+    # compile, looked up by the same text and layout as the on-disk cache.
+    def __init__(self):
+        self.fragments = {}
+        self.kept = {}
+        self.hits = 0
+
+    def fragment_key(self, source, layout):
+        return source, repr(layout)
+
+    def load_fragment(self, key):
+        data = self.fragments.get(key)
+        if data is not None:
+            self.kept[key] = data
+            self.hits += 1
+        return data
+
+    def store_fragment(self, key, data):
+        self.kept[key] = data
+
+    def flush(self):
+        # fragments no longer in the program are dropped
+        self.fragments = self.kept
+        self.kept = {}
+
+def common_prefix(a, b, block=4096):
+    # length of the common prefix, compared a block at a time
+    size = min(len(a), len(b))
+    start = 0
+    while start < size and a[start:start + block] == b[start:start + block]:
+        start += block
+    start = min(start, size)
+    while start < size and a[start] == b[start]:
+        start += 1
+    return start
+
+def at_line_start(text, index):
+    return index == 0 or index == len(text) or text[index - 1] == "\n"
+
+class IncrementalCompiler:
+    def __init__(self, compiler=None, lexer="stream", level="0"):
+        self.compiler = compiler or Compiler()
+        self.lexer = self.compiler.lexers[lexer]
+        self.level = level
+        self.fragments = self.compiler.codegen.cache = FragmentMemory()
+        self.text = None  # source of the last successful parse
+        self.units = []
+        self.parsed = 0  # units parsed by the last update()
+        self.partial = None  # parser of the units before the main program, built on first use
+
+    def update(self, text):
+        # Compiles a new version of the source into self.compiler.generator;
+        # False after printing errors, like Compiler.generate.
+        compiler = self.compiler
+        compiler.diagnostics = []
+        try:
+            units = self.parse(text)
+        except Exception as e:
+            compiler.report(f"Parsing failed: {e}")
+            return False
+        self.text, self.units = text, units
+
+        procedures = [unit.node for unit in units if not isinstance(unit.node, MainNode)]
+        main = units[-1].node
+        procedures_node = None
+        if procedures:
+            procedures_node = ProceduresNode(procedures[0].lineno, procedures[0].column)
+            procedures_node.procedures = procedures
+        root = ProgramNode(procedures_node, main, units[0].node.lineno, units[0].node.column)
+        self.fragments.hits = 0
+        with contextlib.redirect_stdout(io.StringIO()):  # allocation log
+            generated = compiler.build(root, self.level)
+        self.fragments.flush()
+        for message in compiler.diagnostics:
+            print(message)
+        return generated
+
+    def parse(self, text):
+        # the new list of units; raises on syntax errors
+        old, units = self.text, self.units
+        if old is None:
+            return self.parse_region(text, 0, len(text), False)
+
+        prefix = common_prefix(old, text)
+        suffix = min(common_prefix(old[::-1], text[::-1]), min(len(old), len(text)) - prefix)
+        edit_end = len(old) - suffix
+        # units touching the edit, a unit ending right where it starts included
+        first = next(k for k, unit in enumerate(units) if unit.end >= prefix)
+        last = max(k for k, unit in enumerate(units) if unit.start <= edit_end)
+        delta = len(text) - len(old)
+        start, end = units[first].start, units[last].end + delta
+        if not (at_line_start(text, start) and at_line_start(text, end)):
+            # a boundary in the middle of a line may be inside a comment now
+            return self.parse_region(text, 0, len(text), False)
+
+        suffix_units = units[last + 1:]
+        partial = bool(suffix_units)
+        try:
+            region = self.parse_region(text, start, end, partial)
+        except Exception:
+            if not partial and first == 0:
+                raise
+            # the real error message, with the whole file as context
+            return self.parse_region(text, 0, len(text), False)
+        if region and isinstance(region[-1].node, MainNode) == partial:
+            # the main program moved in or out of the edited text
+            return self.parse_region(text, 0, len(text), False)
+
+        lines = text.count("\n", start, end) - old.count("\n", start, units[last].end)
+        for unit in suffix_units:
+            unit.start += delta
+            unit.end += delta
+            if lines:
+                shift_lines(unit.node, lines)
+        units = units[:first] + region + suffix_units
+        if not region:
+            # whole units were deleted, what is left of their text joins a neighbour
+            if first:
+                units[first - 1].end = end
+            else:
+                units[0].start = start
+        return units
+
+    def parse_region(self, text, start, end, partial):
+        # parses text[start:end], which holds whole units, into units
+        starts = []
+        tokens = self.unit_starts(self.lexer.tokenize(text[:end], text.count("\n", 0, start) + 1, start), starts)
+        if partial:
+            # procedures only, None when there are none
+            root = self.partial_parser().parse(tokens, text)
+            nodes = root.procedures if root else []
+        else:
+            root = self.compiler.parser.parse(tokens, text)
+            if not root:
+                raise Exception("No AST generated.")
+            nodes = (root.procedures.procedures if root.procedures else []) + [root.main]
+        self.parsed = len(nodes)
+        starts[0:1] = [start]
+        return [Unit(unit_start, unit_end, node)
+                for unit_start, unit_end, node in zip(starts, starts[1:] + [end], nodes)]
+
+    def partial_parser(self):
+        if self.partial is None:
+            from parser import PartialParser
+            self.partial = PartialParser()
+        return self.partial
+
+    @staticmethod
+    def unit_starts(tokens, starts):
+        # passes the tokens on, noting where every procedure and the main program begin
+        for token in tokens:
+            if token.type == "PROCEDURE" or token.type == "PROGRAM":
+                starts.append(token.index)
+            yield token
+
+    def write(self, output):
+        with open_output(output) as file:
+            return self.compiler.generator.write_code(file)
+
+def watch(input_file, output_file, lexer="stream", level="0", interval=0.1):
+    # recompiles input_file whenever it changes, until interrupted
+    incremental = IncrementalCompiler(lexer=lexer, level=level)
+    seen = None
+    while True:
+        try:
+            stat = os.stat(input_file)
+            if (stat.st_mtime_ns, stat.st_size) != seen:
+                seen = stat.st_mtime_ns, stat.st_size
+                with open(input_file, 'r') as file:
+                    data = file.read()
+                start = time.perf_counter()
+                if incremental.update(data):
+                    instructions = incremental.write(output_file)
+                    print(f"{time.strftime('%H:%M:%S')} {output_file}: {instructions} instructions in "
+                          f"{(time.perf_counter() - start) * 1000:.1f} ms ({incremental.parsed} of "
+                          f"{len(incremental.units)} units parsed, {incremental.fragments.hits} procedures reused)")
+                sys.stdout.flush()
+        except OSError as e:
+            print(f"Failed to open file: {e}")
+            seen = None
+        time.sleep(interval)
@@ -0,0 +1,79 @@
+from array import array
+from enum import IntEnum
+
+# Same numbering as enum Instructions in maszyna_wirtualna/instructions.hh
+class Opcode(IntEnum):
+    GET = 0
+    PUT = 1
+    LOAD = 2
+    STORE = 3
+    LOADI = 4
+    STOREI = 5
+    ADD = 6
+    SUB = 7
+    ADDI = 8
+    SUBI = 9
+    SET = 10
+    HALF = 11
+    JUMP = 12
+    JPOS = 13
+    JZERO = 14
+    JNEG = 15
+    RTRN = 16
+    HALT = 17
+
+NO_OPERAND = frozenset({Opcode.HALF, Opcode.HALT})
+JUMPS = frozenset({Opcode.JUMP, Opcode.JPOS, Opcode.JZERO, Opcode.JNEG})
+
+# cycles the virtual machine charges per instruction
+COSTS = {Opcode.GET: 100, Opcode.PUT: 100, Opcode.LOAD: 10, Opcode.STORE: 10, Opcode.LOADI: 20,
+         Opcode.STOREI: 20, Opcode.ADD: 10, Opcode.SUB: 10, Opcode.ADDI: 20, Opcode.SUBI: 12, Opcode.SET: 50,
+         Opcode.HALF: 5, Opcode.JUMP: 1, Opcode.JPOS: 1, Opcode.JZERO: 1, Opcode.JNEG: 1, Opcode.RTRN: 10,
+         Opcode.HALT: 0}
+
+# Instruction text is only built when the program is written out; until then
+# instructions live in two parallel machine-word arrays.
+class InstructionStream:
+    __slots__ = ("opcodes", "operands")
+
+    def __init__(self):
+        self.opcodes = array('B')
+        self.operands = array('q')
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        return Opcode(self.opcodes[index]), self.operands[index]
+
+    def __iter__(self):
+        for opcode, operand in zip(self.opcodes, self.operands):
+            yield Opcode(opcode), operand
+
+    def append(self, opcode, operand=0):
+        try:
+            self.operands.append(operand)
+        except OverflowError:
+            raise Exception(f"Constant {operand} does not fit in a machine word")
+        self.opcodes.append(opcode)
+
+    def set_operand(self, index, operand):
+        self.operands[index] = operand
+
+    def extend_from_bytes(self, opcodes, operands):
+        self.opcodes.frombytes(opcodes)
+        self.operands.frombytes(operands)
+
+    def format(self, index):
+        opcode = Opcode(self.opcodes[index])
+        if opcode in NO_OPERAND:
+            return opcode.name
+        return f"{opcode.name} {self.operands[index]}"
+
+    def lines(self):
+        names = [opcode.name for opcode in Opcode]
+        for opcode, operand in zip(self.opcodes, self.operands):
+            if opcode in NO_OPERAND:
+                yield names[opcode]
+            else:
+                yield f"{names[opcode]} {operand}"
@@ -0,0 +1,73 @@
+import time
+import json
+import tracemalloc
+import contextlib
+
+# Per-phase measurements for --time-passes / --mem-report. Each phase records
+# its wall time, item counts and, when memory is traced, the peak and the
+# retained traced memory at its end.
+
+class Phase:
+    __slots__ = ("name", "seconds", "peak", "retained", "counts")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.peak = None
+        self.retained = None
+        self.counts = {}
+
+class PhaseReport:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.phases = []
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        phase = Phase(name)
+        self.phases.append(phase)
+        if self.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.seconds = time.perf_counter() - start
+            if self.memory:
+                phase.retained, phase.peak = tracemalloc.get_traced_memory()
+
+    def count(self, **counts):
+        # adds item counts to the phase that ran last
+        self.phases[-1].counts.update(counts)
+
+    def stop(self):
+        if self.memory:
+            tracemalloc.stop()
+
+    def as_dict(self):
+        phases = [{"name": phase.name, "seconds": phase.seconds, "counts": phase.counts} for phase in self.phases]
+        if self.memory:
+            for entry, phase in zip(phases, self.phases):
+                entry["peak_bytes"] = phase.peak
+                entry["retained_bytes"] = phase.retained
+        return {"phases": phases, "total_seconds": sum(phase.seconds for phase in self.phases)}
+
+    def to_json(self, **sections):
+        # sections: further top-level entries, like the pass report
+        return json.dumps({**self.as_dict(), **sections}, indent=2)
+
+    def table(self):
+        header = f"{'phase':<8} {'time [ms]':>10}"
+        if self.memory:
+            header += f" {'peak [MB]':>10} {'retained [MB]':>14}"
+        lines = [header + "  counts"]
+        for phase in self.phases:
+            line = f"{phase.name:<8} {phase.seconds * 1000:>10.2f}"
+            if self.memory:
+                line += f" {phase.peak / 2**20:>10.2f} {phase.retained / 2**20:>14.2f}"
+            counts = " ".join(f"{name}={count}" for name, count in phase.counts.items())
+            lines.append(f"{line}  {counts}")
+        lines.append(f"{'total':<8} {sum(phase.seconds for phase in self.phases) * 1000:>10.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,310 @@
+# Middle-end representation between the resolved AST and the machine code.
+# Every function (procedure or main program) is a list of basic blocks of
+# three-address instructions over virtual variables; the last instruction of
+# a block is its terminator and names the successor blocks.
+#
+# Operands are Vars or plain ints (constants). Arrays appear only in the
+# instructions that address them:
+#
+#   copy    dst = a                 read    read dst
+#   add     dst = a + b  (sub, mul, div, mod alike)
+#   half    dst = a >> 1            write   write a
+#   load    dst = array[index]      store   array[index] = value
+#   addr    dst = &array[index]     call    call procedure(arguments...)
+#   loadi   dst = *pointer          storei  *pointer = value
+#   init    array offset cell setup, as declarations do it
+#
+#   jump    target                  branch  if a <cmp> b then target else other
+#   exit    return from a procedure, halt in main
+#
+# loadi and storei keep the array they point into as their last argument, so
+# analyses know which cells they may touch.
+
+BINARY = ("add", "sub", "mul", "div", "mod")
+SYMBOLS = {"add": "+", "sub": "-", "mul": "*", "div": "/", "mod": "%"}
+COMMUTATIVE = frozenset(("add", "mul"))
+TERMINATORS = frozenset(("jump", "branch", "exit"))
+
+# a < b is b > a and so on
+MIRRORED = {"<": ">", ">": "<", "<=": ">=", ">=": "<=", "=": "=", "!=": "!="}
+NEGATED = {"<": ">=", ">=": "<", ">": "<=", "<=": ">", "=": "!=", "!=": "="}
+
+def compare(operation, a, b):
+    if operation == "<":
+        return a < b
+    if operation == ">":
+        return a > b
+    if operation == "<=":
+        return a <= b
+    if operation == ">=":
+        return a >= b
+    if operation == "=":
+        return a == b
+    return a != b
+
+def evaluate(op, a, b=None):
+    # constant folding with the language's semantics: division rounds down,
+    # the remainder takes the sign of the divisor and both are 0 for b = 0
+    if op == "add":
+        return a + b
+    if op == "sub":
+        return a - b
+    if op == "mul":
+        return a * b
+    if op == "div":
+        return a // b if b else 0
+    if op == "mod":
+        return a % b if b else 0
+    if op == "half":
+        return a >> 1
+    return a  # copy
+
+class Var:
+    # A scalar cell. Program variables keep the address the resolver gave
+    # them; temporaries get one from the backend. A by_ref variable is a
+    # procedure parameter whose cell holds the address of the real one.
+    __slots__ = ("name", "address", "by_ref", "temp")
+
+    def __init__(self, name, address=None, by_ref=False, temp=False):
+        self.name = name
+        self.address = address
+        self.by_ref = by_ref
+        self.temp = temp
+
+    def __repr__(self):
+        return self.name
+
+class Array:
+    # An array local to the function has cell [0] at the constant `offset`;
+    # for an array parameter, `offset` is the Var of the cell holding it.
+    __slots__ = ("name", "symbol", "offset")
+
+    def __init__(self, name, symbol, offset):
+        self.name = name
+        self.symbol = symbol
+        self.offset = offset
+
+    @property
+    def by_ref(self):
+        return isinstance(self.offset, Var)
+
+    def element_address(self, index):
+        return self.offset + index
+
+    def __repr__(self):
+        return self.name
+
+class Instr:
+    __slots__ = ("op", "dst", "args", "written")
+
+    def __init__(self, op, dst=None, args=(), written=None):
+        self.op = op
+        self.dst = dst
+        self.args = list(args)
+        # of a call: positions (in args[1:]) of the arguments the callee may
+        # write, None until calls.py has looked - then any of them
+        self.written = written
+
+    def uses(self):
+        # variables whose value the instruction reads
+        op = self.op
+        args = self.args
+        if op in ("load", "store", "addr"):
+            result = [arg for arg in args[1:] if isinstance(arg, Var)]
+            if args[0].by_ref:
+                result.append(args[0].offset)
+            return result
+        if op in ("loadi", "storei"):
+            return [arg for arg in args[:-1] if isinstance(arg, Var)]
+        if op == "call":
+            # arguments are passed by reference, the callee may read them
+            result = []
+            for arg in args[1:]:
+                if isinstance(arg, Var):
+                    result.append(arg)
+                elif arg.by_ref:
+                    result.append(arg.offset)
+            return result
+        if op == "branch":
+            return [arg for arg in args[1:3] if isinstance(arg, Var)]
+        if op in ("jump", "init"):
+            return []
+        return [arg for arg in args if isinstance(arg, Var)]
+
+    def defs(self):
+        # variables the instruction may write
+        if self.dst is not None:
+            return [self.dst]
+        if self.op == "call":
+            return [arg for arg in self.writes() if isinstance(arg, Var)]
+        return []
+
+    def writes(self):
+        # of a call: the arguments, variables and arrays, it may write
+        arguments = self.args[1:]
+        if self.written is None:
+            return arguments
+        return [arguments[k] for k in sorted(self.written)]
+
+    def operands(self):
+        # positions of value operands (Var or int) in args
+        op = self.op
+        if op in ("copy", "half", "write") or op in BINARY:
+            return range(len(self.args))
+        if op in ("load", "addr"):
+            return (1,)
+        if op == "store":
+            return (1, 2)
+        if op == "loadi":
+            return (0,)
+        if op == "storei":
+            return (0, 1)
+        if op == "branch":
+            return (1, 2)
+        return ()
+
+    def replace_uses(self, mapping):
+        # substitutes value operands found in mapping (Var -> Var or int)
+        changed = False
+        for position in self.operands():
+            arg = self.args[position]
+            if isinstance(arg, Var) and arg in mapping:
+                self.args[position] = mapping[arg]
+                changed = True
+        return changed
+
+    def targets(self):
+        if self.op == "jump":
+            return self.args
+        if self.op == "branch":
+            return self.args[3:]
+        return []
+
+    def has_side_effects(self):
+        # instructions that must stay even when nothing reads their result
+        return self.op in ("store", "storei", "read", "write", "call", "init") or self.op in TERMINATORS
+
+    def __repr__(self):
+        return format_instruction(self)
+
+class Block:
+    __slots__ = ("name", "instrs")
+
+    def __init__(self, name):
+        self.name = name
+        self.instrs = []
+
+    @property
+    def terminator(self):
+        return self.instrs[-1] if self.instrs and self.instrs[-1].op in TERMINATORS else None
+
+    @property
+    def body(self):
+        # the instructions before the terminator
+        return self.instrs[:-1] if self.terminator else self.instrs
+
+    def successors(self):
+        terminator = self.terminator
+        return terminator.targets() if terminator else []
+
+    def __repr__(self):
+        return self.name
+
+class Function:
+    # `blocks` are in layout order, the first one is the entry
+    def __init__(self, name, procedure=None, source=None):
+        self.name = name
+        self.procedure = procedure  # ProcedureSymbol, None for the main program
+        self.source = source  # procedure text, for fragment cache keys
+        self.blocks = []
+        self.parameters = []  # Vars and Arrays in declaration order
+        self.variables = []  # every Var of the function
+        self.arrays = []
+        self.block_counter = 0
+        self.temp_counter = 0
+
+    @property
+    def is_main(self):
+        return self.procedure is None
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def new_block(self):
+        block = Block(f"b{self.block_counter}")
+        self.block_counter += 1
+        return block
+
+    def new_temp(self):
+        self.temp_counter += 1
+        var = Var(f"%{self.temp_counter}", temp=True)
+        self.variables.append(var)
+        return var
+
+    def instruction_count(self):
+        return sum(len(block.instrs) for block in self.blocks)
+
+class Program:
+    def __init__(self, memory_size):
+        self.functions = []  # procedures in declaration order, then main
+        self.memory_size = memory_size  # first cell the resolver left free
+
+    @property
+    def main(self):
+        return self.functions[-1]
+
+    def function(self, name):
+        return next(function for function in self.functions if function.name == name)
+
+    def instruction_count(self):
+        return sum(function.instruction_count() for function in self.functions)
+
+def format_instruction(instr):
+    op, dst, args = instr.op, instr.dst, instr.args
+    if op == "copy":
+        return f"{dst} = {args[0]}"
+    if op in BINARY:
+        return f"{dst} = {args[0]} {SYMBOLS[op]} {args[1]}"
+    if op == "half":
+        return f"{dst} = half {args[0]}"
+    if op == "load":
+        return f"{dst} = {args[0]}[{args[1]}]"
+    if op == "store":
+        return f"{args[0]}[{args[1]}] = {args[2]}"
+    if op == "addr":
+        return f"{dst} = &{args[0]}[{args[1]}]"
+    if op == "loadi":
+        return f"{dst} = *{args[0]}  ({args[1]})"
+    if op == "storei":
+        return f"*{args[0]} = {args[1]}  ({args[2]})"
+    if op == "read":
+        return f"read {dst}"
+    if op == "write":
+        return f"write {args[0]}"
+    if op == "call":
+        return f"call {args[0].name}({', '.join(map(str, args[1:]))})"
+    if op == "init":
+        return f"init {args[0]}"
+    if op == "jump":
+        return f"jump {args[0]}"
+    if op == "branch":
+        return f"if {args[1]} {args[0]} {args[2]} then {args[3]} else {args[4]}"
+    if op == "exit":
+        return "exit"
+    if op == "phi":
+        return f"{dst} = phi({', '.join(f'{block}: {value}' for block, value in args)})"
+    return f"{op} {dst} {args}"
+
+def format_function(function):
+    parameters = ", ".join(f"{parameter}[]" if isinstance(parameter, Array) else f"&{parameter}"
+                           for parameter in function.parameters)
+    name = "main" if function.is_main else function.name
+    lines = [f"function {name}({parameters}):"]
+    for block in function.blocks:
+        lines.append(f"  {block.name}:")
+        lines.extend(f"    {format_instruction(instr)}" for instr in block.instrs)
+    return "\n".join(lines)
+
+def format_program(program):
+    return "\n\n".join(format_function(function) for function in program.functions) + "\n"
@@ -1,4 +1,6 @@
+import re
 from sly import Lexer
+from sly.lex import Token
 
 class MyLexer(Lexer):
     tokens = { PROGRAM, PROCEDURE, IS, BEGIN, END, ASSIGN, IF, THEN, T, ELSE, ENDIF, WHILE, DO, ENDWHILE, REPEAT, UNTIL, FOR, FROM, TO, DOWNTO, ENDFOR, WRITE, READ, NEQ, GEQ, LEQ, PIDENTIFIER, NUM }
@@ -61,6 +63,84 @@ class MyLexer(Lexer):
         t.value = int(t.value)
         return t
 
+class StreamLexer:
+    # Same tokens as MyLexer, produced lazily by one scanner regex. Words are
+    # matched whole and classified by a dict lookup instead of trying every
+    # keyword pattern in turn.
+    tokens = MyLexer.tokens
+    keywords = { name: name for name in ('PROGRAM', 'PROCEDURE', 'IS', 'BEGIN', 'END', 'IF', 'THEN', 'T', 'ELSE', 'ENDIF', 'WHILE', 'DO', 'ENDWHILE', 'REPEAT', 'UNTIL', 'FOR', 'FROM', 'TO', 'DOWNTO', 'ENDFOR', 'WRITE', 'READ') }
+    # MyLexer's pattern order, used to split words like "TT" the way it does
+    keyword_order = ('PROGRAM', 'PROCEDURE', 'IS', 'BEGIN', 'ENDFOR', 'ENDWHILE', 'ENDIF', 'DOWNTO', 'IF', 'THEN', 'ELSE', 'END', 'WHILE', 'DO', 'REPEAT', 'UNTIL', 'FOR', 'FROM', 'WRITE', 'READ', 'TO', 'T')
+    operators = { ':=': 'ASSIGN', '!=': 'NEQ', '>=': 'GEQ', '<=': 'LEQ' }
+    # leading blanks are folded into every match, so they cost no extra step
+    scanner = re.compile(r'[ \t]*(?:(?P<name>[_a-z]+)|(?P<op>:=|!=|>=|<=)|(?P<literal>[-+*/%=><\[\]():,;])'
+                         r'|(?P<num>[0-9]+)|(?P<word>[A-Z]+)|(?P<newline>\n+)|(?P<comment>\#.*)|(?P<error>.)|$)')
+
+    def __init__(self):
+        self.lineno = 1
+
+    def error(self, index, text):
+        print('Line %d: Bad character %r' % (self.lineno, text[index]))
+
+    def tokenize(self, text, lineno=1, index=0):
+        self.lineno = lineno
+        keywords = self.keywords
+        operators = self.operators
+        for m in self.scanner.finditer(text, index):
+            kind = m.lastgroup
+            if kind is None or kind == 'comment':
+                continue
+            if kind == 'newline':
+                self.lineno += m.end() - m.start(kind)
+                continue
+            if kind == 'error':
+                self.error(m.start(kind), text)
+                continue
+
+            tok = Token()
+            tok.lineno = self.lineno
+            tok.index = m.start(kind)
+            tok.end = m.end()
+            value = m.group(kind)
+            if kind == 'name':
+                tok.type = 'PIDENTIFIER'
+                tok.value = value
+            elif kind == 'literal':
+                tok.type = tok.value = value
+            elif kind == 'num':
+                tok.type = 'NUM'
+                tok.value = int(value)
+            elif kind == 'op':
+                tok.type = operators[value]
+                tok.value = value
+            elif value in keywords:
+                tok.type = tok.value = keywords[value]
+            else:
+                yield from self.split_word(text, tok.index, tok.end)
+                continue
+            yield tok
+
+    def split_word(self, text, index, end):
+        # an unknown upper-case word: take keywords off its front, reporting
+        # characters that don't start one
+        while index < end:
+            keyword = next((k for k in self.keyword_order if text.startswith(k, index)), None)
+            if keyword is None:
+                self.error(index, text)
+                index += 1
+                continue
+            tok = Token()
+            tok.type = tok.value = keyword
+            tok.lineno = self.lineno
+            tok.index = index
+            tok.end = index = index + len(keyword)
+            yield tok
+
+lexers = {
+    'sly': MyLexer,
+    'stream': StreamLexer,
+}
+
 def main():
     import sys
     if len(sys.argv) != 2:
@@ -0,0 +1,246 @@
+from collections import Counter
+from ir import Instr, Var
+from analysis import (predecessors, reverse_postorder, dominators, dominator_numbering, find_loops,
+                      innermost_loops)
+from deadcode import exit_live, liveness
+from valuenum import array_class
+
+# Loop-invariant code motion over an IR function. An instruction of a loop
+# computing the same value on every iteration moves to a preheader, a block
+# control passes once on its way into the loop. It moves when:
+#
+#   - it has no side effects, and its operands are defined outside the loop
+#     or by instructions that move too; an array read also needs the loop to
+#     store to no array it may read, nor call anything that may;
+#   - its destination is not a parameter and is written nowhere else in the
+#     loop, and no iteration reads it before writing it;
+#   - it runs on every iteration, or its destination is dead after the loop.
+#
+# A loop tested at the top (WHILE, FOR) is rotated first: a copy of the
+# header test guards the preheader, so a loop that runs zero times doesn't
+# run the moved code either. A loop tested at the bottom (REPEAT) runs its
+# header at least once and gets a plain preheader.
+#
+# Inner loops go first. What leaves them lands in their preheader, a block
+# of the enclosing loop, and may leave that one in the next round; a loop
+# only looks at its own blocks, so nesting depth costs no more than length.
+
+MOVABLE = frozenset(("copy", "half", "add", "sub", "mul", "div", "mod", "load", "addr", "loadi"))
+
+def live_in(block, live_out):
+    live = set(live_out[block])
+    for instr in reversed(block.instrs):
+        if instr.dst is not None:
+            live.discard(instr.dst)
+        live.update(instr.uses())
+    return live
+
+class LoopSummary:
+    # what the instructions of a loop may write, what they read and where
+    # it is left, built from its own blocks and the summaries of the loops
+    # directly inside
+    def __init__(self, loop, inner, innermost):
+        self.defined = Counter()
+        self.used = Counter()
+        self.by_ref = False  # whether a parameter may be written
+        self.arrays = set()  # array classes (valuenum.array_class) that may be written
+        self.exits = []  # (inside, outside) edges
+        for block in loop.own:
+            for instr in block.instrs:
+                for var in instr.defs():
+                    self.defined[var] += 1
+                    self.by_ref |= var.by_ref
+                self.used.update(instr.uses())
+                if instr.op == "store":
+                    self.arrays.add(array_class(instr.args[0]))
+                elif instr.op == "storei":
+                    self.arrays.add(array_class(instr.args[-1]))
+                elif instr.op == "call":
+                    self.arrays.update(array_class(arg) for arg in instr.writes() if not isinstance(arg, Var))
+            self.exits.extend((block, successor) for successor in block.successors()
+                              if not loop.contains(successor, innermost))
+        for child in loop.children:
+            summary = inner[child]
+            self.defined.update(summary.defined)
+            self.used.update(summary.used)
+            self.by_ref |= summary.by_ref
+            self.arrays |= summary.arrays
+            self.exits.extend(edge for edge in summary.exits if not loop.contains(edge[1], innermost))
+
+    def invariant(self, operand, moved):
+        if not isinstance(operand, Var) or operand in moved:
+            return True
+        return not self.defined[operand] and not (operand.by_ref and self.by_ref)
+
+def tested_at_top(loop, innermost):
+    # the successor inside the loop of a header that tests and leaves, or None
+    header = loop.header
+    terminator = header.terminator
+    if terminator is None or terminator.op != "branch":
+        return None
+    inside = [target for target in terminator.targets() if loop.contains(target, innermost)]
+    if len(inside) != 1 or inside[0] is header:
+        return None
+    if any(instr.has_side_effects() or not instr.dst.temp for instr in header.body):
+        return None
+    return inside[0]
+
+class Context:
+    # the analyses of one round, shared by its loops
+    def __init__(self, function, loops):
+        self.order = reverse_postorder(function)
+        self.number = {block: k for k, block in enumerate(self.order)}
+        self.pre, self.post = dominator_numbering(dominators(function, self.order))
+        self.preds = predecessors(function)
+        self.live_out = liveness(function, exit_live(function))
+        self.innermost = innermost_loops(loops)
+
+    def dominates(self, a, b):
+        return self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+def invariants(loop, summary, context):
+    # the instructions of loop's own blocks that can move to its preheader,
+    # in order
+    header = loop.header
+    live_out = context.live_out
+    # what an iteration may read before writing; a loop tested at the top
+    # reads the rest only once the guard has let it in, or after the loop
+    body = tested_at_top(loop, context.innermost)
+    live_at_header = live_in(header if body is None else body, live_out)
+    exiting = {block for block, _ in summary.exits}
+    live_after = set().union(*(live_out[block] for block in exiting))
+    # blocks that must run on every iteration: the latches, and the blocks
+    # leaving the loop other than a header tested at the top
+    every = loop.latches + [block for block in exiting if block is not header]
+    blocks = sorted(loop.own, key=context.number.get)
+    moved, found = set(), []
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            always = None
+            for instr in block.body:
+                dst = instr.dst
+                if (instr.op not in MOVABLE or instr in found or dst.by_ref or summary.defined[dst] != 1
+                        or dst in live_at_header):
+                    continue
+                if not all(summary.invariant(instr.args[position], moved) for position in instr.operands()):
+                    continue
+                if instr.op in ("load", "loadi"):
+                    array = instr.args[0] if instr.op == "load" else instr.args[-1]
+                    if array_class(array) in summary.arrays:
+                        continue
+                if dst in live_after:
+                    if always is None:
+                        always = all(context.dominates(block, other) for other in every)
+                    if not always:
+                        continue
+                moved.add(dst)
+                found.append(instr)
+                changed = True
+    position = {instr: k for k, instr in enumerate(instr for block in blocks for instr in block.instrs)}
+    found.sort(key=position.get)
+    return found
+
+def retarget(block, old, new):
+    terminator = block.terminator
+    positions = (0,) if terminator.op == "jump" else (3, 4)
+    for k in positions:
+        if terminator.args[k] is old:
+            terminator.args[k] = new
+
+def preheader(function, loop, context):
+    # the block control passes on every way into loop, made when there is
+    # none: the only predecessor outside the loop, if it jumps straight in
+    header = loop.header
+    innermost, preds = context.innermost, context.preds
+    outside = [pred for pred in preds[header] if not loop.contains(pred, innermost)]
+    if len(outside) == 1 and outside[0].successors() == [header]:
+        return outside[0]
+    block = function.new_block()
+    block.instrs = [Instr("jump", None, [header])]
+    function.blocks.insert(function.blocks.index(header), block)
+    for pred in outside:
+        retarget(pred, header, block)
+    preds[block] = outside
+    preds[header] = [block] + [pred for pred in preds[header] if pred not in outside]
+    return block
+
+def hoist(function, loop, moved, context):
+    # moves the instructions moved into a new preheader of loop
+    header = loop.header
+    innermost, preds = context.innermost, context.preds
+    outside = [pred for pred in preds[header] if not loop.contains(pred, innermost)]
+    body = tested_at_top(loop, innermost)
+    preheader = function.new_block()
+    blocks = function.blocks
+    index = blocks.index(header)
+    from_header = [instr for instr in moved if instr in header.instrs]
+    for block in loop.own:
+        block.instrs = [instr for instr in block.instrs if instr not in moved]
+    if body is None:
+        preheader.instrs = moved + [Instr("jump", None, [header])]
+        entry = preheader
+        blocks.insert(index, preheader)
+    else:
+        # guard: the invariant part of the header test, computed once for
+        # the guard and the loop, then the rest of it over fresh temporaries
+        guard = function.new_block()
+        guard.instrs = list(from_header)
+        renamed = {}
+        for instr in header.instrs:
+            copy = Instr(instr.op, instr.dst, instr.args)
+            copy.replace_uses(renamed)
+            if instr is header.terminator:
+                copy.args[3:] = [preheader if target is body else target for target in copy.args[3:]]
+                for target in copy.targets():
+                    if target is not preheader:
+                        preds[target].append(guard)
+            else:
+                copy.dst = renamed[instr.dst] = function.new_temp()
+            guard.instrs.append(copy)
+        preheader.instrs = [instr for instr in moved if instr not in from_header] + [Instr("jump", None, [body])]
+        entry = guard
+        # the header now closes the loop: lay it out after the loop's last block
+        del blocks[index]
+        last = max(k for k, block in enumerate(blocks) if loop.contains(block, innermost))
+        blocks.insert(last + 1, header)
+        blocks[index:index] = [guard, preheader]
+    for pred in outside:
+        retarget(pred, header, entry)
+
+def over_loops(function, transform):
+    # runs transform(function, loop, summary, context) over every loop of
+    # function, inner loops first, and again over the loops around one it
+    # changed (with fresh analyses) until none changes; returns the sum of
+    # what transform returned, the number of instructions it changed
+    total = 0
+    while True:
+        loops = find_loops(function)
+        if not loops:
+            return total
+        context = Context(function, loops)
+        summaries = {}
+        changed = set()  # loops changed this round, and the loops around them
+        for loop in reversed(loops):
+            summary = summaries[loop] = LoopSummary(loop, summaries, context.innermost)
+            if loop in changed or loop.header is function.entry:
+                continue
+            count = transform(function, loop, summary, context)
+            if not count:
+                continue
+            total += count
+            while loop is not None:
+                changed.add(loop)
+                loop = loop.parent
+        if not changed:
+            return total
+
+def hoist_loop(function, loop, summary, context):
+    moved = invariants(loop, summary, context)
+    if moved:
+        hoist(function, loop, moved, context)
+    return len(moved)
+
+def hoist_invariants(function):
+    return over_loops(function, hoist_loop)
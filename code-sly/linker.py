@@ -0,0 +1,82 @@
+from array import array
+from instructions import InstructionStream
+
+# Code is generated as one relocatable fragment per procedure (plus the
+# prologue and main). Jumps inside a fragment are relative and need no fixing;
+# the two kinds of operand that depend on where fragments end up are recorded
+# as relocations and patched by link():
+#
+#   (index, ABSOLUTE, None)  operand is an index inside the fragment and
+#                            becomes an absolute instruction address
+#                            (return addresses stored before a call)
+#   (index, CALL, name)      operand becomes the relative jump from index to
+#                            the first instruction of fragment `name`
+
+ABSOLUTE = 0
+CALL = 1
+
+MAIN = "%main"  # fragment name of the main program, never a procedure name
+
+class Fragment:
+    __slots__ = ("name", "code", "relocations")
+
+    def __init__(self, name, code=None, relocations=None):
+        self.name = name
+        self.code = code if code is not None else InstructionStream()
+        self.relocations = relocations if relocations is not None else []
+
+    def __len__(self):
+        return len(self.code)
+
+    def to_bytes(self):
+        # marshal-friendly form, see from_bytes
+        return self.code.opcodes.tobytes(), self.code.operands.tobytes(), self.relocations
+
+    @classmethod
+    def from_bytes(cls, name, data):
+        opcodes, operands, relocations = data
+        code = InstructionStream()
+        code.extend_from_bytes(opcodes, operands)
+        return cls(name, code, [tuple(relocation) for relocation in relocations])
+
+class LinkError(Exception):
+    pass
+
+def layout(fragments):
+    # first instruction of every fragment, laid out one after another in order
+    entries = {}
+    base = 0
+    for fragment in fragments:
+        if fragment.name in entries:
+            raise LinkError(f"Fragment \"{fragment.name}\" defined twice")
+        entries[fragment.name] = base
+        base += len(fragment)
+    return entries
+
+def relocate(fragments):
+    # Yields the code of each fragment in order, patched for its final place.
+    # Only one patched copy of the operands is alive at a time.
+    entries = layout(fragments)
+    for fragment in fragments:
+        base = entries[fragment.name]
+        code = fragment.code
+        if fragment.relocations:
+            code = InstructionStream()
+            code.opcodes = fragment.code.opcodes
+            code.operands = array('q', fragment.code.operands)
+            for index, kind, target in fragment.relocations:
+                if kind == ABSOLUTE:
+                    code.operands[index] += base
+                elif target in entries:
+                    code.operands[index] = entries[target] - (base + index)
+                else:
+                    raise LinkError(f"Call to undefined fragment \"{target}\"")
+        yield code
+
+def link(fragments):
+    # the whole patched program as a single InstructionStream
+    program = InstructionStream()
+    for code in relocate(fragments):
+        program.opcodes.extend(code.opcodes)
+        program.operands.extend(code.operands)
+    return program
@@ -0,0 +1,224 @@
+from ast_nodes import *
+from linker import MAIN
+from ir import Var, Array, Instr, Function, Program
+
+OPERATIONS = {"+": "add", "-": "sub", "*": "mul", "/": "div", "%": "mod"}
+
+# Builds the IR of a resolved program (see ir.py). Expressions become
+# three-address instructions over fresh temporaries, conditions become branch
+# terminators and every compound command opens the blocks it needs:
+#
+#   IF      current -> then [-> else] -> join
+#   WHILE   current -> header (condition) -> body -> header, exit
+#   REPEAT  current -> body (condition at its end) -> body, exit
+#   FOR     current (iterator and bound set) -> header -> body (step) -> header, exit
+#
+# A procedure call is a single instruction; what it does to its arguments is
+# left to the analyses.
+class Lowering(NodeWalker):
+    prefix = "lower_"
+
+    def lower(self, root):
+        self.program = Program(root.memory_size)
+        self.walk(root)
+        return self.program
+
+    def begin_function(self, name, procedure=None, source=None):
+        self.function = Function(name, procedure, source)
+        self.values = {}  # Symbol -> Var or Array
+        self.names = set()
+        self.block = None
+        self.start(self.function.new_block())
+
+    def end_function(self):
+        self.terminate(Instr("exit"))
+        self.program.functions.append(self.function)
+
+    def start(self, block):
+        self.function.blocks.append(block)
+        self.block = block
+
+    def emit(self, op, dst=None, *args):
+        self.block.instrs.append(Instr(op, dst, args))
+
+    def terminate(self, terminator):
+        self.block.instrs.append(terminator)
+
+    def jump(self, target):
+        self.terminate(Instr("jump", None, [target]))
+
+    def unique_name(self, name):
+        # shadowing iterators reuse names inside one function
+        unique, suffix = name, 1
+        while unique in self.names:
+            suffix += 1
+            unique = f"{name}#{suffix}"
+        self.names.add(unique)
+        return unique
+
+    def value_of(self, symbol):
+        # the Var or Array standing for a symbol in the current function
+        value = self.values.get(symbol)
+        if value is None:
+            name = self.unique_name(symbol.name)
+            if symbol.is_array:
+                if symbol.by_ref:
+                    offset = Var(f"{name}:offset", symbol.address)
+                    self.function.variables.append(offset)
+                else:
+                    offset = symbol.offset
+                value = Array(name, symbol, offset)
+                self.function.arrays.append(value)
+            else:
+                value = Var(name, symbol.address, symbol.by_ref)
+                self.function.variables.append(value)
+            self.values[symbol] = value
+        return value
+
+    def lower_ProgramNode(self, node):
+        if node.procedures:
+            yield node.procedures
+        self.begin_function(MAIN)
+        yield node.main
+        self.end_function()
+
+    def lower_ProceduresNode(self, node):
+        yield from node.procedures
+
+    def lower_ProcedureNode(self, node):
+        self.begin_function(node.symbol.name, node.symbol, node.source)
+        self.function.parameters = [self.value_of(arg.symbol) for arg in node.procedure_head.arguments_declaration.args]
+        if node.declarations:
+            self.declarations(node.declarations)
+        yield node.commands
+        self.end_function()
+
+    def lower_MainNode(self, node):
+        if node.declarations:
+            self.declarations(node.declarations)
+        yield node.commands
+
+    def declarations(self, node):
+        for var in node.variables:
+            value = self.value_of(var.symbol)
+            if var.is_array_range:
+                self.emit("init", None, value)
+
+    def lower_CommandsNode(self, node):
+        yield from node.commands
+
+    def lower_AssignNode(self, node):
+        target = node.identifier
+        if target.symbol.is_array:
+            index = self.operand(target.index)
+            value = self.operand(node.expression)
+            self.emit("store", None, self.value_of(target.symbol), index, value)
+        else:
+            self.expression(node.expression, self.value_of(target.symbol))
+
+    def lower_IfNode(self, node):
+        then_block = self.function.new_block()
+        else_block = self.function.new_block() if node.else_commands else None
+        join = self.function.new_block()
+        self.branch(node.condition, then_block, else_block or join)
+        self.start(then_block)
+        yield node.then_commands
+        self.jump(join)
+        if else_block:
+            self.start(else_block)
+            yield node.else_commands
+            self.jump(join)
+        self.start(join)
+
+    def lower_WhileNode(self, node):
+        header = self.function.new_block()
+        body = self.function.new_block()
+        after = self.function.new_block()
+        self.jump(header)
+        self.start(header)
+        self.branch(node.condition, body, after)
+        self.start(body)
+        yield node.commands
+        self.jump(header)
+        self.start(after)
+
+    def lower_RepeatUntilNode(self, node):
+        body = self.function.new_block()
+        after = self.function.new_block()
+        self.jump(body)
+        self.start(body)
+        yield node.commands
+        self.branch(node.condition, after, body)
+        self.start(after)
+
+    def lower_ForToNode(self, node):
+        return self.lower_for(node, "<=", "add")
+
+    def lower_ForDownToNode(self, node):
+        return self.lower_for(node, ">=", "sub")
+
+    def lower_for(self, node, comparison, step):
+        iterator = self.value_of(node.pidentifier.symbol)
+        bound = Var(self.unique_name(f"{iterator.name}:end"), node.bound_address)
+        self.function.variables.append(bound)
+        self.emit("copy", iterator, self.operand(node.from_value))
+        self.emit("copy", bound, self.operand(node.to_value))
+
+        header = self.function.new_block()
+        body = self.function.new_block()
+        after = self.function.new_block()
+        self.jump(header)
+        self.start(header)
+        self.terminate(Instr("branch", None, [comparison, iterator, bound, body, after]))
+        self.start(body)
+        yield node.commands
+        self.emit(step, iterator, iterator, 1)
+        self.jump(header)
+        self.start(after)
+
+    def lower_ProcedureCallNode(self, node):
+        arguments = [self.value_of(argument.symbol) for argument in node.arguments.arguments]
+        self.emit("call", None, node.symbol, *arguments)
+
+    def lower_WriteNode(self, node):
+        self.emit("write", None, self.operand(node.value))
+
+    def lower_ReadNode(self, node):
+        target = node.identifier
+        if target.symbol.is_array:
+            index = self.operand(target.index)
+            value = self.function.new_temp()
+            self.emit("read", value)
+            self.emit("store", None, self.value_of(target.symbol), index, value)
+        else:
+            self.emit("read", self.value_of(target.symbol))
+
+    def branch(self, condition, if_true, if_false):
+        left = self.operand(condition.left_value)
+        right = self.operand(condition.right_value)
+        self.terminate(Instr("branch", None, [condition.operation, left, right, if_true, if_false]))
+
+    def operand(self, node):
+        # an int, a Var, or a temporary holding the value of the expression
+        if isinstance(node, ValueNode):
+            return node.value
+        if isinstance(node, IdentifierNode) and not node.symbol.is_array:
+            return self.value_of(node.symbol)
+        return self.expression(node)
+
+    def expression(self, node, dst=None):
+        # computes node into dst, a new temporary when None
+        if isinstance(node, BinaryExpressionNode):
+            left = self.operand(node.left)
+            right = self.operand(node.right)
+            op, args = OPERATIONS[node.operation], (left, right)
+        elif isinstance(node, IdentifierNode) and node.symbol.is_array:
+            op, args = "load", (self.value_of(node.symbol), self.operand(node.index))
+        else:
+            op, args = "copy", (self.operand(node),)
+        dst = dst or self.function.new_temp()
+        self.emit(op, dst, *args)
+        return dst
+
+def lower(root):
+    return Lowering().lower(root)
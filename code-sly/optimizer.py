@@ -0,0 +1,141 @@
+import time
+from analysis import estimated_cost
+from controlflow import simplify_cfg
+from constprop import propagate_constants, simplify_algebra
+from valuenum import number_values
+from unroll import unroll_loops
+from licm import hoist_invariants
+from strength import reduce_strength
+from pointers import increment_pointers
+from deadcode import remove_dead_code, remove_unused_procedures
+from calls import narrow_call_effects
+from peephole import (machine_cost, thread_jumps, remove_unreachable, remove_fallthrough_jumps,
+                      remove_redundant_memory)
+
+# Optimization levels. -O0 is CodeGenerator, exactly as it always was. The
+# other levels lower the program to the IR (see ir.py), run a pipeline of IR
+# passes over every function, select machine code with backend.py and run the
+# machine-code passes over each function before it is assembled. -Os leaves
+# out the passes that buy speed with code size.
+#
+# Every pass returns how many instructions it changed. The manager adds up,
+# per pass, the changes, the time spent and the estimated VM cost saved: for
+# IR passes analysis.estimated_cost of the function before and after, for
+# machine passes peephole.machine_cost. Both count one execution of the
+# function, loops weighted, callees not included.
+
+IR_PASSES = {
+    "constant-propagation": propagate_constants,
+    "algebraic-simplification": simplify_algebra,
+    "simplify-cfg": simplify_cfg,
+    "value-numbering": number_values,
+    "loop-unrolling": unroll_loops,
+    "loop-invariant-code-motion": hoist_invariants,
+    "strength-reduction": reduce_strength,
+    "pointer-increments": increment_pointers,
+    "dead-code": remove_dead_code,
+}
+
+# passes over the whole program rather than one function at a time
+PROGRAM_PASSES = {
+    "unused-procedures": remove_unused_procedures,
+    "call-effects": narrow_call_effects,
+}
+
+MACHINE_PASSES = {
+    "thread-jumps": thread_jumps,
+    "unreachable-code": remove_unreachable,
+    "fallthrough-jumps": remove_fallthrough_jumps,
+    "redundant-memory": remove_redundant_memory,
+}
+
+SCALAR_PIPELINE = ("unused-procedures", "call-effects", "constant-propagation", "algebraic-simplification",
+                   "simplify-cfg", "value-numbering", "constant-propagation", "algebraic-simplification", "dead-code")
+LOOP_PIPELINE = ("unused-procedures", "call-effects", "constant-propagation", "algebraic-simplification",
+                 "simplify-cfg", "loop-unrolling", "value-numbering", "constant-propagation",
+                 "algebraic-simplification", "loop-invariant-code-motion", "strength-reduction", "pointer-increments",
+                 "constant-propagation", "algebraic-simplification", "simplify-cfg", "value-numbering", "dead-code")
+MACHINE_PIPELINE = ("thread-jumps", "unreachable-code", "fallthrough-jumps", "redundant-memory")
+
+# passes that add instructions to make the loops cheaper
+CODE_GROWING = frozenset(("loop-unrolling", "strength-reduction", "pointer-increments"))
+
+# level -> (IR passes, machine passes), each run in this order
+PIPELINES = {
+    "1": (SCALAR_PIPELINE, MACHINE_PIPELINE),
+    "2": (LOOP_PIPELINE, MACHINE_PIPELINE),
+    "s": (tuple(name for name in LOOP_PIPELINE if name not in CODE_GROWING), MACHINE_PIPELINE),
+}
+
+class PassStats:
+    __slots__ = ("name", "runs", "changed", "saved", "seconds")
+
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.changed = 0  # instructions
+        self.saved = 0  # estimated VM cycles
+        self.seconds = 0.0
+
+class PassManager:
+    def __init__(self, level):
+        if level not in PIPELINES:
+            raise ValueError(f"No pass pipeline for -O{level}")
+        self.level = level
+        self.ir_passes, self.machine_passes = PIPELINES[level]
+        self.stats = {name: PassStats(name) for name in self.ir_passes + self.machine_passes}
+        self.costs = {}  # function -> its estimated cost, while no pass changes it
+
+    def run(self, name, cost, action, key=None):
+        # action() runs the pass, cost() estimates the cost of what it changes;
+        # the last estimate is kept under key
+        stats = self.stats[name]
+        start = time.perf_counter()
+        before = self.costs.get(key) if key is not None else None
+        if before is None:
+            before = cost()
+        changed = action()
+        after = cost() if changed else before
+        stats.saved += before - after
+        if key is not None:
+            self.costs[key] = after
+        stats.seconds += time.perf_counter() - start
+        stats.runs += 1
+        stats.changed += changed
+        return changed
+
+    def optimize(self, program):
+        # the IR passes, over every function of program; a program pass can
+        # only save cost in the main program, what it removes never runs
+        for name in self.ir_passes:
+            if name in PROGRAM_PASSES:
+                run_pass = PROGRAM_PASSES[name]
+                if self.run(name, lambda: estimated_cost(program.main), lambda: run_pass(program)):
+                    self.costs.clear()
+                continue
+            run_pass = IR_PASSES[name]
+            for function in program.functions:
+                self.run(name, lambda: estimated_cost(function), lambda: run_pass(function), function)
+
+    def optimize_machine_code(self, function, code):
+        # the machine passes, over the code selected for function
+        for name in self.machine_passes:
+            run_pass = MACHINE_PASSES[name]
+            self.run(name, lambda: machine_cost(code), lambda: run_pass(code))
+
+    def changed(self):
+        return sum(stats.changed for stats in self.stats.values())
+
+    def as_dict(self):
+        return {"level": self.level,
+                "passes": [{"name": stats.name, "runs": stats.runs, "changed": stats.changed,
+                            "cost_saved": stats.saved, "seconds": stats.seconds} for stats in self.stats.values()]}
+
+    def table(self):
+        width = max(len(name) for name in self.stats)
+        lines = [f"{'pass':<{width}} {'changed':>8} {'cost saved':>11} {'time [ms]':>10}"]
+        for stats in self.stats.values():
+            lines.append(f"{stats.name:<{width}} {stats.changed:>8} {stats.saved:>11} {stats.seconds * 1000:>10.2f}")
+        lines.append(f"{'total':<{width}} {self.changed():>8} {sum(s.saved for s in self.stats.values()):>11} "
+                     f"{sum(s.seconds for s in self.stats.values()) * 1000:>10.2f}")
+        return "\n".join(lines)
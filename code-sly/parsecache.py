@@ -0,0 +1,51 @@
+import os
+import glob
+import marshal
+import hashlib
+
+CACHE_FORMAT = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+class CachedTables:
+    # the parts of sly's LRTable that Parser.parse actually reads
+    def __init__(self, lr_action, lr_goto, defaulted_states):
+        self.lr_action = lr_action
+        self.lr_goto = lr_goto
+        self.defaulted_states = defaulted_states
+
+def grammar_hash(grammar, tokens, version):
+    # precedence decides conflicts, so the tables depend on it as well
+    text = "\n".join(f"{production} {production.prec}" for production in grammar.Productions)
+    text += "\n" + " ".join(f"{term}={assoc},{level}" for term, (assoc, level) in sorted(grammar.Precedence.items()))
+    text += "\n" + " ".join(sorted(tokens)) + f"\n{version}\n{CACHE_FORMAT}"
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def cache_path(name, key):
+    return os.path.join(CACHE_DIR, f"{name}-parsetab-{key}.marshal")
+
+def load_tables(name, key):
+    try:
+        with open(cache_path(name, key), 'rb') as file:
+            lr_action, lr_goto, defaulted_states = marshal.load(file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return CachedTables(lr_action, lr_goto, defaulted_states)
+
+def save_tables(name, key, lrtable):
+    data = (lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    path = cache_path(name, key)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            marshal.dump(data, file)
+        os.replace(temp_path, path)  # readers never see a half-written file
+        for stale in glob.glob(cache_path(name, "*")):
+            if stale != path:
+                os.remove(stale)
+    except OSError:
+        # read-only checkout: just rebuild the tables next time
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
@@ -1,14 +1,57 @@
+import sly
 from sly import Parser
+from sly.yacc import YaccError
 from lexer import MyLexer
 from ast_nodes import *
+import parsecache
 
 class MyParser(Parser):
     tokens = MyLexer.tokens
 
+    @classmethod
+    def _build(cls, definitions):
+        # Same steps as sly's Parser._build, except that the LALR tables are
+        # loaded from parsecache when the grammar has not changed.
+        rules = cls._Parser__collect_rules(definitions)
+        if not cls._Parser__validate_specification():
+            raise YaccError('Invalid parser specification')
+        cls._Parser__build_grammar(rules)
+
+        key = parsecache.grammar_hash(cls._grammar, cls.tokens, sly.__version__)
+        cls._lrtable = parsecache.load_tables(cls.__name__, key)
+        if cls._lrtable is None:
+            if not cls._Parser__build_lrtables():
+                raise YaccError('Can\'t build parsing tables')
+            parsecache.save_tables(cls.__name__, key, cls._lrtable)
+
     def __init__(self):
         super().__init__()
         self.lineno = 1
         self.error_line = None
+        self.text = None
+
+    def parse(self, tokens, text=None):
+        # With the source text at hand nodes get a column, not only a line.
+        self.text = text
+        try:
+            return super().parse(tokens)
+        finally:
+            # nodes keep their own positions, sly's copies would only pin memory
+            self._line_positions.clear()
+            self._index_positions.clear()
+
+    def position(self, p, n=0):
+        # (lineno, column) where symbol n of the production starts
+        symbol = p._slice[n]
+        if self.text is None:
+            return symbol.lineno, 0
+        return symbol.lineno, symbol.index - self.text.rfind("\n", 0, symbol.index)
+
+    def source(self, p):
+        # source text the production was reduced from
+        if self.text is None:
+            return None
+        return self.text[p.index:p.end]
 
     def error(self, token):
         if token:
@@ -20,7 +63,7 @@ class MyParser(Parser):
     @_('procedures main')
     def program_all(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        program_node = ProgramNode(p[0], p[1])
+        program_node = ProgramNode(p[0], p[1], *self.position(p, 0 if p[0] else 1))
         return program_node    
 
     @_('procedures procedure')
@@ -32,7 +75,7 @@ class MyParser(Parser):
     @_('procedure')
     def procedures(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        procedures_node = ProceduresNode()
+        procedures_node = ProceduresNode(*self.position(p))
         procedures_node.add_procedure(p.procedure)
         return procedures_node
 
@@ -44,12 +87,12 @@ class MyParser(Parser):
     @_('PROCEDURE proc_head IS declarations BEGIN commands END')
     def procedure(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ProcedureNode(p[1], p[3], p[5])
+        return ProcedureNode(p[1], p[3], p[5], *self.position(p), self.source(p))
 
     @_('PROCEDURE proc_head IS BEGIN commands END')
     def procedure(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ProcedureNode(p[1], None, p[4])
+        return ProcedureNode(p[1], None, p[4], *self.position(p), self.source(p))
 
     @_('')
     def procedures(self, p):
@@ -58,12 +101,12 @@ class MyParser(Parser):
     @_('PROGRAM IS declarations BEGIN commands END')
     def main(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return MainNode(p[2], p[4])
+        return MainNode(p[2], p[4], *self.position(p))
 
     @_('PROGRAM IS BEGIN commands END')
     def main(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return MainNode(None, p[3])
+        return MainNode(None, p[3], *self.position(p))
 
     @_('commands command')
     def commands(self, p):
@@ -74,49 +117,49 @@ class MyParser(Parser):
     @_('command')
     def commands(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        commands_node = CommandsNode()
+        commands_node = CommandsNode(*self.position(p))
         commands_node.add_command(p.command)
         return commands_node
 
     @_('command')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return CommandNode()
+        return CommandNode(*self.position(p))
 
     @_('identifier ASSIGN expression ";"')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return AssignNode(p[0], p[2])
+        return AssignNode(p[0], p[2], *self.position(p))
 
     @_('IF condition THEN commands ELSE commands ENDIF')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return IfNode(p[1], p[3], p[5])
+        return IfNode(p[1], p[3], p[5], *self.position(p))
 
     @_('IF condition THEN commands ENDIF')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return IfNode(p[1], p[3], None)
+        return IfNode(p[1], p[3], None, *self.position(p))
 
     @_('WHILE condition DO commands ENDWHILE')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return WhileNode(p[1], p[3])
+        return WhileNode(p[1], p[3], *self.position(p))
 
     @_('REPEAT commands UNTIL condition ";"')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return RepeatUntilNode(p[3], p[1])
+        return RepeatUntilNode(p[3], p[1], *self.position(p))
 
     @_('FOR PIDENTIFIER FROM value TO value DO commands ENDFOR')
     def command(self, p):
-        node = ForToNode(p[1], p[3], p[5], p[7])
+        node = ForToNode(p[1], p[3], p[5], p[7], *self.position(p))
         self.error_line = getattr(p, 'lineno', 0)
         return node
 
     @_('FOR PIDENTIFIER FROM value DOWNTO value DO commands ENDFOR')
     def command(self, p):
-        node = ForDownToNode(p[1], p[3], p[5], p[7])
+        node = ForDownToNode(p[1], p[3], p[5], p[7], *self.position(p))
         self.error_line = getattr(p, 'lineno', 0)
         return node
 
@@ -128,86 +171,86 @@ class MyParser(Parser):
     @_('READ identifier ";"')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ReadNode(p[1])
+        return ReadNode(p[1], *self.position(p))
 
     @_('WRITE value ";"')
     def command(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return WriteNode(p[1])
+        return WriteNode(p[1], *self.position(p))
 
     @_('PIDENTIFIER "(" args_decl ")"')
     def proc_head(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ProcedureHeadNode(p[0], p[2])
+        return ProcedureHeadNode(p[0], p[2], *self.position(p))
 
     @_('PIDENTIFIER "(" args ")"')
     def proc_call(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ProcedureCallNode(p[0], p[2])
+        return ProcedureCallNode(p[0], p[2], *self.position(p))
 
     @_('declarations "," PIDENTIFIER')
     def declarations(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        p.declarations.add_variable_declaration(p[2])
+        p.declarations.add_variable_declaration(p[2], *self.position(p, 2))
         return p.declarations
 
     @_('declarations "," PIDENTIFIER "[" NUM ":" NUM "]"')
     def declarations(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        p.declarations.add_array_declaration(p[2], p[4], p[6])
+        p.declarations.add_array_declaration(p[2], p[4], p[6], *self.position(p, 2))
         return p.declarations
 
     @_('PIDENTIFIER')
     def declarations(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        declarations_node = DeclarationsNode()
-        declarations_node.add_variable_declaration(p[0])
+        declarations_node = DeclarationsNode(*self.position(p))
+        declarations_node.add_variable_declaration(p[0], *self.position(p))
         return declarations_node
 
     @_('PIDENTIFIER "[" NUM ":" NUM "]"')
     def declarations(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        declarations_node = DeclarationsNode()
-        declarations_node.add_array_declaration(p[0], p[2], p[4])
+        declarations_node = DeclarationsNode(*self.position(p))
+        declarations_node.add_array_declaration(p[0], p[2], p[4], *self.position(p))
         return declarations_node
 
     @_('args_decl "," PIDENTIFIER')
     def args_decl(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        p.args_decl.add_variable_argument(p[2])
+        p.args_decl.add_variable_argument(p[2], *self.position(p, 2))
         return p.args_decl
 
     @_('args_decl "," T PIDENTIFIER')
     def args_decl(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        p.args_decl.add_array_argument(p[3])
+        p.args_decl.add_array_argument(p[3], *self.position(p, 2))
         return p.args_decl
 
     @_('PIDENTIFIER')
     def args_decl(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        args_decl_node = ArgumentsDeclarationNode()
-        args_decl_node.add_variable_argument(p[0])
+        args_decl_node = ArgumentsDeclarationNode(*self.position(p))
+        args_decl_node.add_variable_argument(p[0], *self.position(p))
         return args_decl_node
 
     @_('T PIDENTIFIER')
     def args_decl(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        args_decl_node = ArgumentsDeclarationNode()
-        args_decl_node.add_array_argument(p[1])
+        args_decl_node = ArgumentsDeclarationNode(*self.position(p))
+        args_decl_node.add_array_argument(p[1], *self.position(p))
         return args_decl_node
 
     @_('args "," PIDENTIFIER')
     def args(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        p.args.add_argument(IdentifierNode(p[2]))
+        p.args.add_argument(IdentifierNode(p[2], None, *self.position(p, 2)))
         return p.args
 
     @_('PIDENTIFIER')
     def args(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        args_node = ProcedureCallArguments()
-        args_node.add_argument(IdentifierNode(p[0]))
+        args_node = ProcedureCallArguments(*self.position(p))
+        args_node.add_argument(IdentifierNode(p[0], None, *self.position(p)))
         return args_node
 
     @_('value "+" value',
@@ -217,7 +260,7 @@ class MyParser(Parser):
        'value "%" value')
     def expression(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return BinaryExpressionNode(p[0], p[2], p[1])
+        return BinaryExpressionNode(p[0], p[2], p[1], *self.position(p))
 
     @_('value "=" value',
        'value NEQ value',
@@ -227,7 +270,7 @@ class MyParser(Parser):
        'value LEQ value')
     def condition(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ConditionNode(p[0], p[2], p[1])
+        return ConditionNode(p[0], p[2], p[1], *self.position(p))
 
     @_('value')
     def expression(self, p):
@@ -237,7 +280,7 @@ class MyParser(Parser):
     @_('NUM')
     def value(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return ValueNode(p[0])
+        return ValueNode(p[0], *self.position(p))
 
     @_('identifier')
     def value(self, p):
@@ -247,15 +290,27 @@ class MyParser(Parser):
     @_('PIDENTIFIER')
     def identifier(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return IdentifierNode(p[0])
+        return IdentifierNode(p[0], None, *self.position(p))
 
     @_('PIDENTIFIER "[" PIDENTIFIER "]"')
     def identifier(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        return IdentifierNode(p[0], IdentifierNode(p[2]))
+        return IdentifierNode(p[0], IdentifierNode(p[2], None, *self.position(p, 2)), *self.position(p))
 
     @_('PIDENTIFIER "[" NUM "]"')
     def identifier(self, p):
         self.error_line = getattr(p, 'lineno', 0)
-        node = IdentifierNode(p[0], ValueNode(p[2]), lineno=p.lineno)
-        return node
\ No newline at end of file
+        node = IdentifierNode(p[0], ValueNode(p[2], *self.position(p, 2)), *self.position(p))
+        return node
+
+class PartialParser(MyParser):
+    # Procedures without the main program, for --watch to parse the ones an
+    # edit touched. A grammar of its own, MyParser's rules less those of the
+    # main program, so that MyParser keeps its tables.
+    tokens = MyParser.tokens - {"PROGRAM"}
+    start = "procedures"
+
+    @classmethod
+    def _build(cls, definitions):
+        inherited = [(name, value) for name, value in vars(MyParser).items() if name not in ("program_all", "main")]
+        super()._build(inherited + definitions)
@@ -0,0 +1,108 @@
+from instructions import Opcode, JUMPS, COSTS
+from analysis import LOOP_WEIGHT, MAX_DEPTH
+
+# Passes over the code backend.py selects for one function, before its labels
+# are resolved: a list of MachineInstructions and int labels. A SET with a
+# label loads a return address, which makes that label a jump target too.
+# Every pass edits the list in place and returns how many instructions it
+# changed.
+
+ENDS = frozenset({Opcode.JUMP, Opcode.HALT, Opcode.RTRN})  # control never falls through
+
+def is_label(item):
+    return isinstance(item, int)
+
+def is_jump(item):
+    return not is_label(item) and item.opcode in JUMPS and item.label is not None
+
+def label_positions(code):
+    return {item: k for k, item in enumerate(code) if is_label(item)}
+
+def target_instruction(code, position):
+    # the first instruction at or after position
+    while position < len(code) and is_label(code[position]):
+        position += 1
+    return code[position] if position < len(code) else None
+
+def machine_cost(code):
+    # VM cycles of one pass through the code, every backward jump taken to
+    # close a loop assumed to run LOOP_WEIGHT times
+    positions = label_positions(code)
+    nesting = [0] * (len(code) + 1)
+    for k, item in enumerate(code):
+        if is_jump(item) and positions[item.label] <= k:
+            nesting[positions[item.label]] += 1
+            nesting[k + 1] -= 1
+    total = depth = 0
+    for k, item in enumerate(code):
+        depth += nesting[k]
+        if not is_label(item):
+            total += COSTS[item.opcode] * LOOP_WEIGHT ** min(depth, MAX_DEPTH)
+    return total
+
+def thread_jumps(code):
+    # a jump to a JUMP, or to a jump on the same condition, goes to its target
+    positions = label_positions(code)
+    changed = 0
+    for item in code:
+        if not is_jump(item):
+            continue
+        seen = {item.label}
+        while True:
+            target = target_instruction(code, positions[item.label])
+            if (target is None or not is_jump(target) or target.opcode not in (Opcode.JUMP, item.opcode)
+                    or target.label in seen):
+                break
+            seen.add(target.label)
+            item.label = target.label
+            changed += 1
+    return changed
+
+def remove_unreachable(code):
+    # instructions after an unconditional transfer, up to the next label in use
+    referenced = {item.label for item in code if not is_label(item) and item.label is not None}
+    kept = []
+    reachable = True
+    for item in code:
+        if is_label(item):
+            reachable = reachable or item in referenced
+            kept.append(item)
+        elif reachable:
+            kept.append(item)
+            if item.opcode in ENDS:
+                reachable = False
+    removed = len(code) - len(kept)
+    code[:] = kept
+    return removed
+
+def remove_fallthrough_jumps(code):
+    # jumps to the instruction that follows them anyway
+    removed = 0
+    k = 0
+    while k < len(code):
+        item = code[k]
+        if is_jump(item):
+            following = k + 1
+            while following < len(code) and is_label(code[following]) and code[following] != item.label:
+                following += 1
+            if following < len(code) and is_label(code[following]):
+                del code[k]
+                removed += 1
+                continue
+        k += 1
+    return removed
+
+def remove_redundant_memory(code):
+    # LOAD x right after STORE x, or STORE x right after LOAD x or STORE x
+    kept = []
+    for item in code:
+        previous = kept[-1] if kept else None
+        if (previous is not None and not is_label(previous) and not is_label(item) and item.label is None
+                and previous.label is None and previous.operand == item.operand
+                and ((item.opcode == Opcode.LOAD and previous.opcode == Opcode.STORE)
+                     or (item.opcode == Opcode.STORE and previous.opcode in (Opcode.LOAD, Opcode.STORE)))):
+            continue
+        kept.append(item)
+    removed = len(code) - len(kept)
+    code[:] = kept
+    return removed
@@ -0,0 +1,141 @@
+from ir import Instr, Var
+from licm import over_loops, live_in, preheader
+from strength import insert_around
+
+# Pointer increments for array accesses indexed by an induction variable.
+# A variable the loop only ever steps, i = i + x or i = i - x with x an
+# integer or a value the loop doesn't change, indexes the cell &A[i], and
+# that address steps along with it by the same x. The loop gets a pointer
+# of its own per array, set to &A[i] in the preheader and stepped after
+# every step of i, and A[i] becomes a read or write through it (loadi,
+# storei), which saves the index arithmetic of every access - when the
+# accesses save more (ACCESS_SAVED each) than the pointer steps cost.
+#
+# When i is read nowhere else in the loop but by the tests against a bound
+# the loop doesn't change, and is dead once the loop is left, the tests
+# compare the pointer with &A[bound] instead (the address is i plus the
+# same offset, so every comparison keeps its outcome) and i is no longer
+# stepped at all.
+
+ACCESS_SAVED = 30
+STEP_COST = 30
+
+def stride(instr, summary):
+    # (op, amount) instr steps its destination by, or None
+    op, dst = instr.op, instr.dst
+    if op not in ("add", "sub"):
+        return None
+    a, b = instr.args
+    if op == "add" and b is dst:
+        a, b = b, a
+    if a is not dst or b is dst:
+        return None
+    if isinstance(b, Var) and not summary.invariant(b, ()):
+        return None
+    return op, b
+
+def access(instr, induction):
+    # (induction variable, array) of an access instr makes through its
+    # index, or None
+    if instr.op in ("load", "store") and instr.args[1] in induction:
+        return instr.args[1], instr.args[0]
+    return None
+
+def tests(loop, var, summary):
+    # the branches of loop comparing var with a bound the loop doesn't change
+    found = []
+    for block in loop.own:
+        terminator = block.terminator
+        if terminator is None or terminator.op != "branch":
+            continue
+        a, b = terminator.args[1:3]
+        if var in (a, b) and a is not b and summary.invariant(b if a is var else a, ()):
+            found.append(terminator)
+    return found
+
+def replaceable(var, summary, context, accesses, branches):
+    # whether the tests can compare a pointer instead and var go away: it is
+    # read by nothing else, and by nothing after the loop
+    uses = summary.used[var] - summary.defined[var] - accesses - len(branches)
+    if uses or not branches:
+        return False
+    for _, target in summary.exits:
+        if target not in context.live_out or var in live_in(target, context.live_out):
+            return False
+    return True
+
+def point_loop(function, loop, summary, context):
+    # returns how many accesses became reads or writes through a pointer
+    steps = {}  # variable -> [(step instruction, op, amount)]
+    for block in loop.own:
+        for instr in block.body:
+            found = stride(instr, summary)
+            if found is not None:
+                steps.setdefault(instr.dst, []).append((instr,) + found)
+    induction = {var: found for var, found in steps.items()
+                 if not var.by_ref and len(found) == summary.defined[var]}
+    groups = {}  # (variable, array) -> [access]
+    for block in loop.own:
+        for instr in block.body:
+            key = access(instr, induction)
+            if key is not None:
+                groups.setdefault(key, []).append(instr)
+    chosen = []
+    replaced = {}  # variable -> its tests, for the variables that go away
+    for var, found in induction.items():
+        keys = [key for key in groups if key[0] is var]
+        if not keys:
+            continue
+        accesses = sum(len(groups[key]) for key in keys)
+        branches = tests(loop, var, summary)
+        if replaceable(var, summary, context, accesses, branches):
+            # the steps of var give way to those of the pointers
+            if ACCESS_SAVED * accesses > STEP_COST * len(found) * (len(keys) - 1):
+                chosen.extend(keys)
+                replaced[var] = branches
+            continue
+        chosen.extend(key for key in keys if ACCESS_SAVED * len(groups[key]) > STEP_COST * len(found))
+    if not chosen:
+        return 0
+    entry = preheader(function, loop, context)
+    init = []
+    after = {}  # step instruction -> the pointer steps following it
+    pointers = {}
+    for key in chosen:
+        var, array = key
+        pointers[key] = pointer = Var(f"{array}[{var}]:addr")
+        function.variables.append(pointer)
+        init.append(Instr("addr", pointer, [array, var]))
+        for instr, op, amount in induction[var]:
+            after.setdefault(instr, []).append(Instr(op, pointer, [pointer, amount]))
+        for instr in groups[key]:
+            if instr.op == "load":
+                instr.op, instr.args = "loadi", [pointer, array]
+            else:
+                instr.op, instr.args = "storei", [pointer, instr.args[2], array]
+    for var, branches in replaced.items():
+        var, array = next(key for key in chosen if key[0] is var)
+        pointer = pointers[var, array]
+        bounds = {}
+        for branch in branches:
+            position = 2 if branch.args[1] is var else 1
+            bound = branch.args[position]
+            if bound not in bounds:
+                if isinstance(bound, int) and not array.by_ref:
+                    bounds[bound] = array.element_address(bound)
+                else:
+                    bounds[bound] = Var(f"{array}[{bound}]:addr")
+                    function.variables.append(bounds[bound])
+                    init.append(Instr("addr", bounds[bound], [array, bound]))
+            branch.args[3 - position] = pointer
+            branch.args[position] = bounds[bound]
+    insert_around(loop.own, {}, after)
+    removed = {instr for var in replaced for instr, _, _ in induction[var]}
+    if removed:
+        for block in loop.own:
+            block.instrs = [instr for instr in block.instrs if instr not in removed]
+    entry.instrs[-1:-1] = init
+    return sum(len(groups[key]) for key in chosen)
+
+def increment_pointers(function):
+    return over_loops(function, point_loop)
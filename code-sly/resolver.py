@@ -0,0 +1,196 @@
+from ast_nodes import *
+from symbols import *
+from codegen import COMPILER_RESERVED
+
+class SemanticError(Exception):
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+# Walks the tree once before code generation: declares and allocates every
+# variable, attaches the resolved symbol to each identifier and collects all
+# semantic errors, so CodeGenerator only has to emit instructions.
+class Resolver(NodeWalker):
+    prefix = "resolve_"
+
+    def __init__(self):
+        self.memory_counter = COMPILER_RESERVED + 1
+        self.symbols = SymbolTable()
+        self.procedure = None  # procedure being resolved, None in main
+        self.errors = []
+
+    def error(self, node, message):
+        lineno = getattr(node, 'lineno', 0)
+        if lineno:
+            message = f"line {lineno}: {message}"
+        self.errors.append(message)
+
+    def resolve(self, node):
+        # scoped constructs are generators yielding their nested nodes
+        self.walk(node)
+
+    def allocate(self, size=1):
+        address = self.memory_counter
+        self.memory_counter += size
+        return address
+
+    def resolve_ProgramNode(self, node):
+        if node.procedures:
+            yield node.procedures
+        yield node.main
+        node.memory_size = self.memory_counter
+        if self.errors:
+            raise SemanticError(self.errors)
+
+    def resolve_ProceduresNode(self, node):
+        yield from node.procedures
+
+    def resolve_ProcedureNode(self, node):
+        name = node.procedure_head.procedure_name
+        if self.symbols.lookup_procedure(name):
+            self.error(node, f"Procedure \"{name}()\" already declared")
+        self.procedure = node.symbol = ProcedureSymbol(name, self.allocate())
+
+        self.symbols.enter_scope()
+        self.resolve(node.procedure_head)
+        if node.declarations:
+            self.resolve(node.declarations)
+        yield node.commands
+        self.symbols.exit_scope()
+
+        # declared only now, so a procedure can never call itself
+        self.symbols.declare_procedure(self.procedure)
+        self.procedure = None
+
+    def resolve_ProcedureHeadNode(self, node):
+        for arg in node.arguments_declaration.args:
+            if self.symbols.declared_in_scope(arg.argument_name):
+                self.error(arg, f"Identifier \"{arg.argument_name}\" already declared as argument")
+            kind = ARRAY if arg.is_array else VARIABLE
+            # the cell holds the address of a variable or the offset of an array
+            arg.symbol = self.symbols.declare(Symbol(arg.argument_name, kind, self.allocate(), by_ref=True))
+            self.procedure.parameters.append(arg.symbol)
+
+    def resolve_MainNode(self, node):
+        self.symbols.enter_scope()
+        if node.declarations:
+            self.resolve(node.declarations)
+        yield node.commands
+        self.symbols.exit_scope()
+
+    def resolve_DeclarationsNode(self, node):
+        for var in node.variables:
+            if self.symbols.declared_in_scope(var.name):
+                if self.symbols.lookup(var.name).by_ref:
+                    self.error(var, f"Identifier \"{var.name}\" already declared as argument")
+                else:
+                    self.error(var, f"Identifier \"{var.name}\" already declared")
+            if var.is_array_range:
+                if var.start > var.end:
+                    self.error(var, f"Array '{var.name}' has empty range [{var.start}:{var.end}]")
+                size = max(var.end - var.start + 1, 1)
+                var.symbol = Symbol(var.name, ARRAY, self.allocate(size + 1), var.start, size)
+                print(f"Array '{var.name}' allocated at memory location {var.symbol.address} with size {size} start {var.start} end {var.end} offset {var.symbol.offset} (offset location {var.symbol.offset_address})")
+            else:
+                var.symbol = Symbol(var.name, VARIABLE, self.allocate())
+                print(f"Variable '{var.name}' allocated at memory location {var.symbol.address}")
+            self.symbols.declare(var.symbol)
+
+    def resolve_CommandsNode(self, node):
+        yield from node.commands
+
+    def resolve_AssignNode(self, node):
+        self.resolve(node.expression)
+        self.resolve_target(node.identifier)
+
+    def resolve_ReadNode(self, node):
+        self.resolve_target(node.identifier)
+
+    def resolve_WriteNode(self, node):
+        self.resolve(node.value)
+
+    def resolve_IfNode(self, node):
+        self.resolve(node.condition)
+        yield node.then_commands
+        if node.else_commands:
+            yield node.else_commands
+
+    def resolve_WhileNode(self, node):
+        self.resolve(node.condition)
+        yield node.commands
+
+    def resolve_RepeatUntilNode(self, node):
+        yield node.commands
+        self.resolve(node.condition)
+
+    def resolve_ForToNode(self, node):
+        return self.resolve_for(node)
+
+    def resolve_ForDownToNode(self, node):
+        return self.resolve_for(node)
+
+    def resolve_for(self, node):
+        # bounds are evaluated once, before the iterator comes into scope
+        self.resolve(node.from_value)
+        self.resolve(node.to_value)
+        iterator = Symbol(node.pidentifier.name, ITERATOR, self.allocate())
+        node.bound_address = self.allocate()
+        print(f"Iterator '{iterator.name}' allocated at memory location {iterator.address}")
+
+        self.symbols.enter_scope()
+        node.pidentifier.symbol = self.symbols.declare(iterator)
+        yield node.commands
+        self.symbols.exit_scope()
+
+    def resolve_ProcedureCallNode(self, node):
+        procedure = node.symbol = self.symbols.lookup_procedure(node.procedure_name)
+        if procedure is None:
+            if self.procedure and self.procedure.name == node.procedure_name:
+                self.error(node, f"Recursive call to procedure \"{node.procedure_name}()\"")
+            else:
+                self.error(node, f"Procedure \"{node.procedure_name}()\" undeclared")
+            return
+        arguments = node.arguments.arguments
+        if len(arguments) != len(procedure.parameters):
+            self.error(node, f"Procedure {procedure.name}() takes {len(procedure.parameters)} arguments, {len(arguments)} given")
+            return
+
+        for indexo, (argument, parameter) in enumerate(zip(arguments, procedure.parameters)):
+            symbol = argument.symbol = self.symbols.lookup(argument.name)
+            if symbol is None:
+                self.error(argument, f"Identifier \"{argument.name}\" undeclared")
+            elif symbol.kind == ITERATOR:
+                self.error(argument, f"Iterator \"{argument.name}\" can't be procedure argument")
+            elif symbol.is_array and not parameter.is_array:
+                self.error(argument, f"Procedure {procedure.name}() - argument on {indexo} position should not be array")
+            elif parameter.is_array and not symbol.is_array:
+                self.error(argument, f"Procedure {procedure.name}() - argument on {indexo} position should be array")
+
+    def resolve_BinaryExpressionNode(self, node):
+        self.resolve(node.left)
+        self.resolve(node.right)
+
+    def resolve_ConditionNode(self, node):
+        self.resolve(node.left_value)
+        self.resolve(node.right_value)
+
+    def resolve_ValueNode(self, node):
+        pass
+
+    def resolve_IdentifierNode(self, node):
+        symbol = node.symbol = self.symbols.lookup(node.name)
+        if symbol is None:
+            self.error(node, f"\"{node.name}\" Undeclared")
+            return
+        if symbol.is_array and not node.index:
+            self.error(node, f"Array '{node.name}' must be accessed with an index")
+        elif not symbol.is_array and node.index:
+            self.error(node, f"Variable '{node.name}' is not an array")
+        elif isinstance(node.index, IdentifierNode):
+            self.resolve(node.index)
+
+    def resolve_target(self, node):
+        self.resolve(node)
+        if node.symbol and node.symbol.kind == ITERATOR:
+            self.error(node, f"\"{node.name}\" can't be modified")
@@ -0,0 +1,107 @@
+import os
+import io
+import sys
+import json
+import argparse
+import contextlib
+from cacheoptions import add_cache_arguments, cache_settings
+
+# Compile server: keeps a warm Compiler and answers JSON-lines requests, one
+# JSON object per line in each direction.
+#
+#   request:  {"id": 1, "source": "PROGRAM IS ...", "lexer": "stream", "level": "0", "cache": null}
+#   response: {"id": 1, "ok": true, "code": "SET 0\n...", "output": "..."}
+#
+# "cache" is a [directory, size cap in MB] pair, or null to compile without
+# the compile cache; without it the server's own --cache options apply.
+# "output" is everything compiler.py would have printed for that program
+# (allocation log and diagnostics), "code" is null when compilation failed.
+# {"op": "shutdown"} stops the server.
+
+DEFAULT_SOCKET = os.environ.get("IMP_COMPILER_SOCKET") or os.path.join(
+    os.environ.get("TMPDIR", "/tmp"), f"imp-compiler-{os.getuid()}.sock")
+
+class CompileServer:
+    def __init__(self, cache_settings=None):
+        from compiler import Compiler
+        self.compiler = Compiler(cache_settings)
+        self.cache_settings = cache_settings
+        self.caches = {cache_settings and tuple(cache_settings): self.compiler.cache}  # settings -> CompileCache
+        self.running = True
+
+    def use_cache(self, settings):
+        # points the compiler at the cache of settings, opened on first use
+        settings = settings and tuple(settings)
+        if settings not in self.caches:
+            from compilecache import CompileCache
+            self.caches[settings] = CompileCache(*settings)
+        self.compiler.cache = self.compiler.codegen.cache = self.caches[settings]
+
+    def handle(self, request):
+        if request.get("op", "compile") == "shutdown":
+            self.running = False
+            return {"id": request.get("id"), "ok": True}
+        self.use_cache(request.get("cache", self.cache_settings))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = self.compiler.compile(request["source"], request.get("lexer", "stream"), request.get("level", "0"))
+        return {"id": request.get("id"), "ok": code is not None, "code": code, "output": output.getvalue()}
+
+    def handle_line(self, line):
+        try:
+            response = self.handle(json.loads(line))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            response = {"id": None, "ok": False, "code": None, "output": f"Bad request: {e}\n"}
+        return json.dumps(response) + "\n"
+
+def serve_stdio(server):
+    for line in sys.stdin:
+        if line.strip():
+            sys.stdout.write(server.handle_line(line))
+            sys.stdout.flush()
+        if not server.running:
+            break
+
+def serve_socket(server, path):
+    import socketserver  # not needed by client.py, which imports this module
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(server.handle_line(line).encode())
+                    self.wfile.flush()
+                if not server.running:
+                    break
+
+    if os.path.exists(path):
+        os.remove(path)  # left behind by a server that didn't shut down cleanly
+    # one request at a time: the compiler instance is shared
+    with socketserver.UnixStreamServer(path, Handler) as unix_server:
+        try:
+            while server.running:
+                unix_server.handle_request()
+        finally:
+            os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve compile requests from a warm compiler.")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument("--socket", default=DEFAULT_SOCKET,
+                           help=f"Unix socket to listen on (default: {DEFAULT_SOCKET})")
+    transport.add_argument("--stdio", action="store_true",
+                           help="read requests from stdin and write responses to stdout")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    server = CompileServer(cache_settings(args))
+    if args.stdio:
+        serve_stdio(server)
+    else:
+        try:
+            serve_socket(server, args.socket)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
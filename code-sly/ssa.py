@@ -0,0 +1,140 @@
+from ir import Var, Instr
+from analysis import (predecessors, reverse_postorder, remove_unreachable, dominators, dominator_tree,
+                      dominance_frontiers, upward_exposed)
+
+# Optional static single assignment form of an IR function. Only variables
+# that live in nothing but their own cell are renamed: not by-reference
+# parameters, not variables handed to a call (the callee reads and writes
+# them in memory) and, in procedures, not variables a call may read before
+# writing them - their cell carries the value over from the previous call.
+# The entry version of a variable is the variable itself; every definition
+# gets a fresh temporary named after it.
+
+def promotable(function):
+    excluded = set()
+    for block in function.blocks:
+        for instr in block.instrs:
+            if instr.op == "call":
+                excluded.update(arg for arg in instr.args[1:] if isinstance(arg, Var))
+    if not function.is_main:
+        excluded |= upward_exposed(function)
+    return [var for var in function.variables
+            if not var.by_ref and var not in excluded and not var.name.endswith(":offset")]
+
+def to_ssa(function):
+    remove_unreachable(function)
+    order = reverse_postorder(function)
+    idom = dominators(function, order)
+    frontiers = dominance_frontiers(function, idom)
+    preds = predecessors(function)
+    candidates = set(promotable(function))
+
+    # phis only for variables read in some block before that block writes them
+    global_names = set()
+    definitions = {}
+    for block in order:
+        killed = set()
+        for instr in block.instrs:
+            global_names.update(var for var in instr.uses() if var in candidates and var not in killed)
+            if instr.dst in candidates:
+                killed.add(instr.dst)
+                definitions.setdefault(instr.dst, set()).add(block)
+
+    phis = {block: {} for block in order}  # block -> {var: phi}
+    for var in global_names:
+        worklist = list(definitions.get(var, ()))
+        placed = set()
+        while worklist:
+            block = worklist.pop()
+            for frontier in frontiers[block]:
+                if frontier not in placed:
+                    placed.add(frontier)
+                    phis[frontier][var] = Instr("phi", var, [(pred, var) for pred in preds[frontier]])
+                    worklist.append(frontier)
+    for block in order:
+        block.instrs[0:0] = phis[block].values()
+
+    # renaming, a walk over the dominator tree
+    counters = {}
+    current = {var: [var] for var in candidates}
+
+    def new_version(var):
+        counters[var] = counters.get(var, 0) + 1
+        version = Var(f"{var.name}.{counters[var]}", temp=True)
+        function.variables.append(version)
+        return version
+
+    children = dominator_tree(idom)
+    stack = [(function.entry, None)]
+    while stack:
+        block, pushed = stack.pop()
+        if pushed is not None:
+            # leaving the subtree of block
+            for var in pushed:
+                current[var].pop()
+            continue
+        pushed = []
+        for instr in block.instrs:
+            if instr.op != "phi":
+                instr.replace_uses({var: current[var][-1] for var in instr.uses() if var in current})
+            if instr.dst in current:
+                original = instr.dst
+                instr.dst = new_version(original)
+                current[original].append(instr.dst)
+                pushed.append(original)
+        for successor in block.successors():
+            for phi_var, phi in phis[successor].items():
+                phi.args = [(pred, current[phi_var][-1] if pred is block else value) for pred, value in phi.args]
+        stack.append((block, pushed))
+        stack.extend((child, None) for child in children[block])
+    return function
+
+def split_critical_edges(function):
+    preds = predecessors(function)
+    for block in list(function.blocks):
+        targets = block.successors()
+        if len(targets) < 2:
+            continue
+        terminator = block.terminator
+        for position, target in enumerate(terminator.args):
+            if target in targets and len(preds[target]) > 1 and target.instrs and target.instrs[0].op == "phi":
+                edge = function.new_block()
+                edge.instrs.append(Instr("jump", None, [target]))
+                function.blocks.insert(function.blocks.index(target), edge)
+                terminator.args[position] = edge
+                for instr in target.instrs:
+                    if instr.op == "phi":
+                        instr.args = [(edge if pred is block else pred, value) for pred, value in instr.args]
+                preds[target] = [edge if pred is block else pred for pred in preds[target]]
+
+def sequentialize(copies, function):
+    # a parallel copy {dst: src} as copy instructions, breaking cycles with a temporary
+    pending = {dst: src for dst, src in copies.items() if dst is not src}
+    result = []
+    while pending:
+        sources = {src for src in pending.values() if isinstance(src, Var)}
+        ready = [dst for dst in pending if dst not in sources]
+        if ready:
+            for dst in ready:
+                result.append(Instr("copy", dst, [pending.pop(dst)]))
+            continue
+        # only cycles are left: save one destination and read it from there
+        dst = next(iter(pending))
+        saved = function.new_temp()
+        result.append(Instr("copy", saved, [dst]))
+        pending = {target: saved if src is dst else src for target, src in pending.items()}
+    return result
+
+def from_ssa(function):
+    # replaces every phi by copies at the end of its predecessors
+    split_critical_edges(function)
+    copies = {}  # predecessor -> {dst: value}
+    for block in function.blocks:
+        while block.instrs and block.instrs[0].op == "phi":
+            phi = block.instrs.pop(0)
+            for pred, value in phi.args:
+                copies.setdefault(pred, {})[phi.dst] = value
+    for pred, parallel in copies.items():
+        position = len(pred.instrs) - 1 if pred.terminator else len(pred.instrs)
+        pred.instrs[position:position] = sequentialize(parallel, function)
+    return function
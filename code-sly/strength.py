@@ -0,0 +1,122 @@
+from ir import Instr, Var
+from analysis import instruction_cost
+from licm import over_loops, preheader
+
+# Strength reduction of multiplications in loops. A basic induction variable
+# of a loop is one the loop only ever steps by constants: i = i + c or
+# i = i - c. A product of one with a value the loop doesn't change, i * k,
+# then changes by c * k at each step, and a square i * i by 2ci + c*c,
+# which itself changes by 2c*c. The product gets a variable of its own, set
+# in the preheader and stepped along with every step of i, and the
+# multiplication becomes a copy of it - when the multiplication costs more
+# (analysis.instruction_cost) than the copy and the additions stepping it.
+#
+# A loop is only searched in its own blocks: LICM has already moved products
+# of an outer induction variable out of the inner loops. Linear index
+# expressions reduce the same way, i * k + b only keeps its addition.
+
+ADD_COST = 30
+COPY_COST = 20
+
+def step(instr):
+    # the constant instr steps its destination by, or None
+    op, dst, args = instr.op, instr.dst, instr.args
+    if op == "add":
+        if args[0] is dst and isinstance(args[1], int):
+            return args[1]
+        if args[1] is dst and isinstance(args[0], int):
+            return args[0]
+    elif op == "sub" and args[0] is dst and isinstance(args[1], int):
+        return -args[1]
+    return None
+
+def reduction(instr, induction, summary):
+    # (induction variable, factor) of a product instr can step, the factor
+    # being the variable itself for a square, or None
+    if instr.op != "mul":
+        return None
+    a, b = instr.args
+    if a is b:
+        steps = induction.get(a)
+        if steps is None or len({c for _, c in steps}) != 1:
+            return None
+        return a, a
+    if b in induction:
+        a, b = b, a
+    if a not in induction or not summary.invariant(b, ()):
+        return None
+    return a, b
+
+def insert_around(blocks, before, after):
+    # puts the instructions before[instr] and after[instr] around instr
+    for block in blocks:
+        instrs = []
+        for instr in block.instrs:
+            instrs.extend(before.get(instr, ()))
+            instrs.append(instr)
+            instrs.extend(after.get(instr, ()))
+        block.instrs = instrs
+
+def reduce_loop(function, loop, summary, context):
+    # returns how many multiplications became copies
+    steps = {}  # variable -> [(step instruction, constant)]
+    for block in loop.own:
+        for instr in block.body:
+            c = step(instr)
+            if c is not None:
+                steps.setdefault(instr.dst, []).append((instr, c))
+    induction = {var: found for var, found in steps.items()
+                 if not var.by_ref and len(found) == summary.defined[var]}
+    if not induction:
+        return 0
+    before, after = {}, {}  # instruction -> instructions to put next to it
+    reduced = {}  # (variable, factor) -> variable holding their product
+    init = []
+    count = 0
+    for block in loop.own:
+        for instr in block.body:
+            key = reduction(instr, induction, summary)
+            if key is None:
+                continue
+            var, factor = key
+            updates = len(induction[var]) * (2 if factor is var else 1)
+            if key not in reduced and instruction_cost(instr) <= COPY_COST + ADD_COST * updates:
+                continue
+            if key not in reduced:
+                reduced[key] = product = Var(f"{var}*{factor}")
+                function.variables.append(product)
+                init.append(Instr("mul", product, [var, factor]))
+                if factor is var:
+                    difference = Var(f"{var}*{var}:step")
+                    function.variables.append(difference)
+                    c = induction[var][0][1]
+                    init.append(Instr("mul", difference, [var, 2 * c]))
+                    init.append(Instr("add", difference, [difference, c * c]))
+                    for update, _ in induction[var]:
+                        before.setdefault(update, []).extend([Instr("add", product, [product, difference]),
+                                                              Instr("add", difference, [difference, 2 * c * c])])
+                else:
+                    scaled = {}
+                    for update, c in induction[var]:
+                        if isinstance(factor, int):
+                            change = Instr("add", product, [product, c * factor])
+                        elif c in (1, -1):
+                            change = Instr("add" if c == 1 else "sub", product, [product, factor])
+                        else:
+                            if c not in scaled:
+                                scaled[c] = Var(f"{factor}*{c}")
+                                function.variables.append(scaled[c])
+                                init.append(Instr("mul", scaled[c], [factor, c]))
+                            change = Instr("add", product, [product, scaled[c]])
+                        after.setdefault(update, []).append(change)
+            instr.op, instr.args = "copy", [reduced[key]]
+            count += 1
+    if not count:
+        return 0
+    insert_around(loop.own, before, after)
+    entry = preheader(function, loop, context)
+    entry.instrs[-1:-1] = init
+    return count
+
+def reduce_strength(function):
+    return over_loops(function, reduce_loop)
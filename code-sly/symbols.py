@@ -0,0 +1,83 @@
+VARIABLE = "variable"
+ARRAY = "array"
+ITERATOR = "iterator"
+
+class Symbol:
+    __slots__ = ("name", "kind", "address", "start", "size", "by_ref", "depth")
+
+    def __init__(self, name, kind, address, start=0, size=1, by_ref=False):
+        self.name = name
+        self.kind = kind
+        self.address = address  # by_ref: cell holding the address (scalar) or offset (array)
+        self.start = start
+        self.size = size
+        self.by_ref = by_ref
+        self.depth = 0
+
+    @property
+    def is_array(self):
+        return self.kind == ARRAY
+
+    @property
+    def offset(self):
+        # address of cell [0]; cell [i] lives at offset + i
+        return self.address - self.start
+
+    @property
+    def offset_address(self):
+        # cell holding the offset at runtime
+        if self.by_ref:
+            return self.address
+        return self.address + self.size
+
+    def element_address(self, index):
+        return self.offset + index
+
+
+class ProcedureSymbol:
+    __slots__ = ("name", "address", "parameters")
+
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address  # cell holding the return address
+        self.parameters = []
+
+
+class SymbolTable:
+    # One dict maps every visible name to its symbol; each scope keeps an undo
+    # log so leaving it restores whatever the inner declarations shadowed.
+    def __init__(self):
+        self.symbols = {}
+        self.procedures = {}
+        self.scopes = [[]]
+
+    def enter_scope(self):
+        self.scopes.append([])
+
+    def exit_scope(self):
+        for name, shadowed in reversed(self.scopes.pop()):
+            if shadowed is None:
+                del self.symbols[name]
+            else:
+                self.symbols[name] = shadowed
+
+    def declare(self, symbol):
+        shadowed = self.symbols.get(symbol.name)
+        symbol.depth = len(self.scopes)
+        self.scopes[-1].append((symbol.name, shadowed))
+        self.symbols[symbol.name] = symbol
+        return symbol
+
+    def declared_in_scope(self, name):
+        symbol = self.symbols.get(name)
+        return symbol is not None and symbol.depth == len(self.scopes)
+
+    def lookup(self, name):
+        return self.symbols.get(name)
+
+    def declare_procedure(self, procedure):
+        self.procedures[procedure.name] = procedure
+        return procedure
+
+    def lookup_procedure(self, name):
+        return self.procedures.get(name)
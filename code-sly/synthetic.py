@@ -0,0 +1,214 @@
+import sys
+import random
+import argparse
+
+# Generator of large, valid .imp programs for scalability benchmarks. The
+# shape is chosen with the number of procedures, the maximum nesting depth of
+# IF/WHILE/REPEAT/FOR commands, the number of arrays declared in every block
+# and the number of statements.
+#
+# Generated programs also run to completion on the virtual machine without
+# input: loops have small constant trip counts, every array index stays in
+# the window [WINDOW_START:WINDOW_END] that all arrays cover, procedures only
+# call earlier ones (at most once per body, outside loops) and products are
+# reduced right away so values stay small.
+
+WINDOW_START = 5
+WINDOW_END = 14
+SCALARS = 4  # local variables of every block
+TRIP_COUNT = 3
+
+def letters(number):
+    # identifiers can't contain digits: 0 -> a, 25 -> z, 26 -> ba, ...
+    name = ""
+    while True:
+        name = chr(ord("a") + number % 26) + name
+        number //= 26
+        if number == 0:
+            return name
+
+class Block:
+    # names visible in a procedure or in the main program
+    def __init__(self, scalars, arrays, counters):
+        self.scalars = scalars  # assignable variables
+        self.arrays = arrays
+        self.counters = counters  # WHILE/REPEAT counter of every nesting level
+        self.iterators = []  # (name, first, last) of the enclosing FOR loops
+
+class ProgramGenerator:
+    def __init__(self, procedures=0, depth=2, arrays=1, seed=0):
+        self.procedures = procedures
+        self.depth = depth
+        self.arrays = arrays
+        self.random = random.Random(seed)
+
+    def program(self, statements):
+        # statements are spread evenly over the procedures and the main program
+        per_block = max(1, statements // (self.procedures + 1))
+        lines = []
+        for number in range(self.procedures):
+            lines.extend(self.procedure(number, per_block))
+        lines.extend(self.main(per_block))
+        return "\n".join(lines) + "\n"
+
+    def declarations(self):
+        scalars = [f"v{letters(k)}" for k in range(SCALARS)]
+        counters = [f"w{letters(k)}" for k in range(self.depth)]
+        arrays = [f"t{letters(k)}" for k in range(self.arrays)]
+        declared = scalars + counters + [
+            f"{name}[{WINDOW_START - self.random.randint(0, 5)}:{WINDOW_END + self.random.randint(0, 5)}]"
+            for name in arrays]
+        return scalars, counters, arrays, "  " + ", ".join(declared)
+
+    def procedure(self, number, statements):
+        scalars, counters, arrays, declarations = self.declarations()
+        parameters = ["x", "y"]
+        if self.arrays:
+            parameters.insert(0, "T s")
+            arrays = ["s"] + arrays
+        block = Block(scalars + ["x", "y"], arrays, counters)
+        body = self.initialize(block, scalars)
+        body.extend(self.commands(block, statements, 0))
+        if number:
+            self.insert(body, self.call(block, self.random.randrange(number)))
+        body.append(["  x := " + self.value(block) + " + " + self.value(block) + ";"])
+        return [f"PROCEDURE p{letters(number)}({', '.join(parameters)}) IS", declarations, "BEGIN",
+                *(line for statement in body for line in statement), "END"]
+
+    def main(self, statements):
+        scalars, counters, arrays, declarations = self.declarations()
+        block = Block(scalars, arrays, counters)
+        body = self.initialize(block, scalars)
+        for array in arrays:
+            body.append([f"  FOR ia FROM {WINDOW_START} TO {WINDOW_END} DO", f"    {array}[ia] := ia;", "  ENDFOR"])
+        commands = self.commands(block, statements, 0)
+        for number in range(self.procedures):
+            self.insert(commands, self.call(block, number))
+        body.extend(commands)
+        body.extend([f"  WRITE {name};"] for name in scalars)
+        return ["PROGRAM IS", declarations, "BEGIN", *(line for statement in body for line in statement), "END"]
+
+    def initialize(self, block, scalars):
+        return [[f"  {name} := {self.random.randint(0, 99)};"] for name in scalars]
+
+    def insert(self, commands, command):
+        commands.insert(self.random.randint(0, len(commands)), command)
+
+    def call(self, block, number):
+        arguments = [self.random.choice(block.scalars) for _ in range(2)]
+        if self.arrays:
+            arguments.insert(0, self.random.choice(block.arrays))
+        return [f"  p{letters(number)}({', '.join(arguments)});"]
+
+    def commands(self, block, statements, level):
+        # list of commands, each a list of lines, with `statements` statements in total
+        result = []
+        while statements > 0:
+            if level < self.depth and statements > 2 and self.random.random() < 0.3:
+                size = self.random.randint(2, min(statements, 8))
+                result.append(self.compound(block, size - 1, level))
+            else:
+                size = 1
+                result.append(self.simple(block, level))
+            statements -= size
+        return result
+
+    def body(self, block, statements, level):
+        return [line for command in self.commands(block, statements, level + 1) for line in command]
+
+    def compound(self, block, statements, level):
+        indent = "  " * (level + 1)
+        kind = self.random.choice(("if", "while", "repeat", "for"))
+        if kind == "if":
+            then = self.random.randint(1, statements)
+            lines = [f"{indent}IF {self.condition(block)} THEN", *self.body(block, then, level)]
+            if then < statements:
+                lines.extend([f"{indent}ELSE", *self.body(block, statements - then, level)])
+            return lines + [f"{indent}ENDIF"]
+        if kind == "for":
+            iterator = f"i{letters(level + 1)}"
+            first = self.random.randint(WINDOW_START, WINDOW_END - TRIP_COUNT + 1)
+            last = first + TRIP_COUNT - 1
+            block.iterators.append((iterator, first, last))
+            if self.random.random() < 0.5:
+                head = f"{indent}FOR {iterator} FROM {first} TO {last} DO"
+            else:
+                head = f"{indent}FOR {iterator} FROM {last} DOWNTO {first} DO"
+            lines = [head, *self.body(block, statements, level), f"{indent}ENDFOR"]
+            block.iterators.pop()
+            return lines
+        counter = block.counters[level]
+        step = f"{indent}  {counter} := {counter} - 1;"
+        if kind == "while":
+            return [f"{indent}{counter} := {TRIP_COUNT};", f"{indent}WHILE {counter} > 0 DO",
+                    *self.body(block, statements, level), step, f"{indent}ENDWHILE"]
+        return [f"{indent}{counter} := {TRIP_COUNT};", f"{indent}REPEAT",
+                *self.body(block, statements, level), step, f"{indent}UNTIL {counter} = 0;"]
+
+    def simple(self, block, level):
+        indent = "  " * (level + 1)
+        choice = self.random.random()
+        if block.arrays and choice < 0.25:
+            return [f"{indent}{self.element(block)} := {self.expression(block)};"]
+        if choice < 0.35:
+            return [f"{indent}WRITE {self.value(block)};"]
+        target = self.random.choice(block.scalars)
+        if choice < 0.45:
+            # products are reduced at once so values never outgrow the machine
+            return [f"{indent}{target} := {self.value(block)} * {self.random.randint(2, 9)};",
+                    f"{indent}{target} := {target} % {self.random.randint(100, 999)};"]
+        return [f"{indent}{target} := {self.expression(block)};"]
+
+    def element(self, block):
+        array = self.random.choice(block.arrays)
+        if block.iterators and self.random.random() < 0.7:
+            return f"{array}[{self.random.choice(block.iterators)[0]}]"
+        return f"{array}[{self.random.randint(WINDOW_START, WINDOW_END)}]"
+
+    def value(self, block):
+        choice = self.random.random()
+        if choice < 0.2:
+            return str(self.random.randint(0, 99))
+        if block.iterators and choice < 0.35:
+            return self.random.choice(block.iterators)[0]
+        if block.arrays and choice < 0.5:
+            return self.element(block)
+        return self.random.choice(block.scalars)
+
+    def expression(self, block):
+        if self.random.random() < 0.3:
+            return self.value(block)
+        return f"{self.value(block)} {self.random.choice('+-/%')} {self.value(block)}"
+
+    def condition(self, block):
+        operator = self.random.choice(("=", "!=", "<", ">", "<=", ">="))
+        return f"{self.value(block)} {operator} {self.value(block)}"
+
+def synthetic_program(statements, procedures=0, depth=2, arrays=1, seed=0):
+    return ProgramGenerator(procedures, depth, arrays, seed).program(statements)
+
+def program_with_lines(lines, procedures=0, depth=2, arrays=1, seed=0):
+    # about `lines` lines; the lines per statement ratio is measured on a
+    # sample with as many statements per procedure
+    sample = min(lines, 2000)
+    sample_procedures = procedures * sample // lines
+    ratio = synthetic_program(sample, sample_procedures, depth, arrays, seed).count("\n") / sample
+    return synthetic_program(max(1, round(lines / ratio)), procedures, depth, arrays, seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a synthetic .imp program.")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--statements", type=int, default=100, help="number of statements (default: 100)")
+    size.add_argument("--lines", type=int, help="approximate number of lines instead of --statements")
+    parser.add_argument("--procedures", type=int, default=0, help="number of procedures (default: 0)")
+    parser.add_argument("--depth", type=int, default=2, help="maximum nesting depth of commands (default: 2)")
+    parser.add_argument("--arrays", type=int, default=1, help="arrays declared in every block (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.lines is not None:
+        sys.stdout.write(program_with_lines(args.lines, args.procedures, args.depth, args.arrays, args.seed))
+    else:
+        sys.stdout.write(synthetic_program(args.statements, args.procedures, args.depth, args.arrays, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,26 @@ import subprocess
 import re
 import pytest
 import os
+import io
+import glob
+import json
+import time
+import contextlib
+import copy
+from lexer import MyLexer, StreamLexer
+from parser import MyParser
+import parsecache
+from compilecache import CompileCache, COMPILER_MODULES
+from resolver import Resolver
+from codegen import CodeGenerator
+from linker import link
+from synthetic import synthetic_program
+from compiler import Compiler
+from incremental import IncrementalCompiler
+from lowering import lower
+from ssa import to_ssa, from_ssa
+from backend import Backend
+from ir import format_program
 
 def strip_ansi_codes(text):
     return re.sub(r'\x1b\[[0-9;]*m', '', text)
@@ -79,3 +99,577 @@ def test_program(test_case, capsys):
             print("Complexity cost: " + complexity + "; including i/o: " + io)
         else:
             print("Complexity not found")
+
+@pytest.mark.parametrize("input_file", sorted(glob.glob("../tests/*/*.imp")))
+def test_stream_lexer_matches_sly_lexer(input_file):
+    with open(input_file) as file:
+        data = file.read()
+    def token_stream(lexer):
+        return [(t.type, t.value, t.lineno, t.index, t.end) for t in lexer.tokenize(data)]
+    assert token_stream(StreamLexer()) == token_stream(MyLexer())
+
+@pytest.mark.parametrize("level", ["0", "2"])
+def test_deeply_nested_program(level, tmp_path):
+    # nesting far beyond Python's recursion limit
+    depth = 3000
+    lines = ["PROGRAM IS", "  a, b", "BEGIN", "  READ a;", "  b := 0;"]
+    lines += ["  IF a > 0 THEN b := b + 1;"] * depth
+    lines += ["  ENDIF"] * depth
+    lines += ["  WRITE b;", "END"]
+    input_file = tmp_path / "nested.imp"
+    output_file = tmp_path / "nested.mr"
+    input_file.write_text("\n".join(lines) + "\n")
+
+    subprocess.run(["python", "compiler.py", f"-O{level}", input_file, output_file], check=True, capture_output=True)
+    process = subprocess.run(["../maszyna_wirtualna/maszyna-wirtualna", output_file], input="1\n", text=True, capture_output=True)
+    assert [int(value) for value in re.findall(r">\s*(-?\d+)", process.stdout)] == [depth]
+
+def test_ast_nodes_carry_positions():
+    with open("../tests/advanced_tests/example_adv_2.imp") as file:
+        data = file.read()
+    lines = data.split("\n")
+    root = MyParser().parse(StreamLexer().tokenize(data), data)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        assert not hasattr(node, "__dict__")
+        assert node.lineno > 0 and node.column > 0
+        assert not lines[node.lineno - 1][node.column - 1].isspace()
+        for name in ("procedures", "main", "procedure_head", "arguments_declaration", "args", "declarations",
+                     "variables", "commands", "then_commands", "else_commands", "condition", "left_value",
+                     "right_value", "identifier", "index", "expression", "left", "right", "value", "arguments",
+                     "pidentifier", "from_value", "to_value"):
+            child = getattr(node, name, None)
+            if isinstance(child, list):
+                stack.extend(child)
+            elif hasattr(child, "lineno"):
+                stack.append(child)
+
+def compile_with_cli(input_file, output_file):
+    subprocess.run(["python", "compiler.py", input_file, output_file], check=True, capture_output=True)
+    with open(output_file) as file:
+        return file.read()
+
+def test_server_stdio_matches_cli(tmp_path):
+    input_files = ["../tests/basic_tests/example1.imp", "../tests/advanced_tests/example_adv_2.imp"]
+    requests = [{"id": k, "source": open(input_file).read()} for k, input_file in enumerate(input_files)]
+    requests.append({"id": "bad", "source": open("../tests/errors/error4.imp").read()})
+    process = subprocess.run(["python", "server.py", "--stdio"], check=True, capture_output=True, text=True,
+                             input="".join(json.dumps(request) + "\n" for request in requests))
+    responses = [json.loads(line) for line in process.stdout.splitlines()]
+
+    assert [response["id"] for response in responses] == [0, 1, "bad"]
+    for input_file, response in zip(input_files, responses):
+        assert response["ok"]
+        assert response["code"] == compile_with_cli(input_file, tmp_path / "cli.mr")
+    assert not responses[2]["ok"] and responses[2]["code"] is None
+    assert "is not an array" in responses[2]["output"]
+
+def test_client_uses_server(tmp_path):
+    socket_path = str(tmp_path / "compiler.sock")
+    input_file = "../tests/basic_tests/example2.imp"
+    server = subprocess.Popen(["python", "server.py", "--socket", socket_path])
+    try:
+        while not os.path.exists(socket_path):
+            assert server.poll() is None
+            time.sleep(0.01)
+        for attempt in range(2):  # the second compile reuses the warm parser and code generator
+            output_file = tmp_path / f"client{attempt}.mr"
+            subprocess.run(["python", "client.py", "--socket", socket_path, input_file, output_file], check=True, capture_output=True)
+            assert output_file.read_text() == compile_with_cli(input_file, tmp_path / "cli.mr")
+        # the client's cache options apply to the server's compile
+        for attempt in range(2):
+            subprocess.run(["python", "client.py", "--socket", socket_path, "--cache-dir", tmp_path / "cache",
+                            input_file, tmp_path / "cached.mr"], check=True, capture_output=True)
+        assert (tmp_path / "cached.mr").read_text() == compile_with_cli(input_file, tmp_path / "cli.mr")
+        totals = CompileCache(tmp_path / "cache").totals()
+        assert totals["program_misses"] == 1 and totals["program_hits"] == 1
+    finally:
+        server.terminate()
+        server.wait()
+
+def test_startup_imports():
+    # a usage error, -O0 and the client never load the optimizing pipeline,
+    # nor the compile cache without --cache
+    script = "import sys, compiler, client; print(*sys.modules)"
+    process = subprocess.run(["python", "-c", script], check=True, capture_output=True, text=True)
+    assert not {"optimizer", "lowering", "backend", "compilecache"} & set(process.stdout.split())
+
+def test_client_to_stdout(tmp_path):
+    # without a server the client compiles in-process; "-" is stdout, as for compiler.py
+    input_file = os.path.abspath("../tests/basic_tests/example2.imp")
+    process = subprocess.run(["python", os.path.abspath("client.py"), "--socket", tmp_path / "none.sock", input_file, "-"],
+                             cwd=tmp_path, capture_output=True, text=True, check=True)
+    assert process.stdout == compile_with_cli(input_file, tmp_path / "cli.mr")
+    assert not (tmp_path / "-").exists()
+    # nor does it take the report options it couldn't print
+    process = subprocess.run(["python", "client.py", "--pass-report", "-O2", input_file, "-"], capture_output=True, text=True)
+    assert process.returncode == 2 and "unrecognized arguments: --pass-report" in process.stderr
+
+def test_batch_compile(tmp_path):
+    inputs = sorted(glob.glob("../tests/basic_tests/*.imp"))
+    process = subprocess.run(["python", "compiler.py", "-j", "2", "-o", tmp_path / "out", "../tests/basic_tests",
+                              "../tests/errors/error4.imp"], capture_output=True, text=True)
+    assert process.returncode == 1  # error4.imp does not compile
+    assert f"{len(inputs) + 1} files, 1 failed" in process.stdout
+    assert "is not an array" in process.stdout
+    for input_file in inputs:
+        name = os.path.basename(input_file).replace(".imp", ".mr")
+        assert (tmp_path / "out" / name).read_text() == compile_with_cli(input_file, tmp_path / name)
+
+def test_compile_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    source = tmp_path / "program.imp"
+    with open("../tests/advanced_tests/example_adv_2.imp") as file:
+        data = file.read()
+
+    def compile_cached():
+        process = subprocess.run(["python", "compiler.py", "--cache-dir", cache_dir, source, tmp_path / "cached.mr"],
+                                 check=True, capture_output=True, text=True)
+        uncached = subprocess.run(["python", "compiler.py", source, tmp_path / "plain.mr"],
+                                  check=True, capture_output=True, text=True)
+        assert process.stdout == uncached.stdout
+        assert (tmp_path / "cached.mr").read_text() == (tmp_path / "plain.mr").read_text()
+        return CompileCache(cache_dir).totals()
+
+    source.write_text(data)
+    assert compile_cached()["program_misses"] == 1
+    assert compile_cached()["program_hits"] == 1
+    # a new main program reuses the code generated for the procedures
+    source.write_text(data.rstrip().removesuffix("END") + "  WRITE 5;\nEND\n")
+    totals = compile_cached()
+    assert totals["program_misses"] == 2 and totals["fragment_hits"] > 0
+
+def test_compile_cache_version_modules():
+    # every module of the optimizing pipeline is hashed into the version
+    script = ("import os, sys, optimizer, backend, lowering, ssa; print(*(name for name, module in sys.modules.items()"
+              " if os.path.dirname(getattr(module, '__file__', None) or '') == os.getcwd()))")
+    process = subprocess.run(["python", "-c", script], capture_output=True, text=True, cwd=os.getcwd())
+    modules = set(process.stdout.split())
+    assert "optimizer" in modules and modules <= set(COMPILER_MODULES)
+
+def test_parse_table_hash_precedence():
+    # precedence changes the tables without changing the productions
+    grammar = copy.copy(MyParser._grammar)
+    key = parsecache.grammar_hash(grammar, MyParser.tokens, "")
+    grammar.Precedence = {"+": ("left", 1)}
+    assert parsecache.grammar_hash(grammar, MyParser.tokens, "") != key
+
+def test_compile_cache_eviction(tmp_path):
+    cache = CompileCache(tmp_path, max_size=3000 / 2**20)
+    for k in range(5):
+        cache.store_fragment(str(k), (bytes(1000), b"", []))
+        os.utime(cache.path("fragment", str(k)), (k, k))
+    assert cache.load_fragment("0")  # now the most recently used
+    cache.evict()
+    assert [key for key in "01234" if os.path.exists(cache.path("fragment", key))] == ["0", "4"]
+
+def test_linker_relocates_reordered_procedures(tmp_path, capsys):
+    case = test_cases["advanced"][2]  # example_adv_2: procedures calling procedures
+    with open(case["input_file"]) as file:
+        data = file.read()
+    root = MyParser().parse(StreamLexer().tokenize(data), data)
+    Resolver().resolve(root)
+    codegen = CodeGenerator()
+    codegen.generate(root)
+    start, *procedures, main = codegen.fragments
+    assert len(procedures) > 1
+    output_file = tmp_path / "reordered.mr"
+    output_file.write_text("\n".join(link([start, main] + procedures[::-1]).lines()))
+
+    process = subprocess.run(["../maszyna_wirtualna/maszyna-wirtualna", output_file], text=True, capture_output=True)
+    assert [int(value) for value in re.findall(r">\s*(-?\d+)", process.stdout)] == case["expected_outputs"]
+
+def test_write_code_streams_same_text():
+    with open("../tests/advanced_tests/example_adv_4.imp") as file:
+        data = file.read()
+    root = MyParser().parse(StreamLexer().tokenize(data), data)
+    Resolver().resolve(root)
+    codegen = CodeGenerator()
+    codegen.generate(root)
+    for chunk_lines in (1, 7, 1 << 16):
+        output = io.StringIO()
+        count = codegen.write_code(output, chunk_lines)
+        assert output.getvalue() == codegen.get_code()
+        assert count == output.getvalue().count("\n") + 1
+
+def test_phase_report(tmp_path):
+    report_file = tmp_path / "report.json"
+    process = subprocess.run(["python", "compiler.py", "--mem-report", "--report-json", report_file,
+                              "../tests/advanced_tests/example_adv_4.imp", tmp_path / "out.mr"],
+                             check=True, capture_output=True, text=True)
+    assert "total" in process.stderr
+    report = json.loads(report_file.read_text())
+    phases = {phase["name"]: phase for phase in report["phases"]}
+    assert list(phases) == ["lex", "parse", "resolve", "codegen", "emit"]
+    assert phases["lex"]["counts"]["tokens"] > 0
+    assert phases["parse"]["counts"]["nodes"] > 0
+    assert phases["codegen"]["counts"]["instructions"] == phases["emit"]["counts"]["instructions"]
+    assert all(phase["peak_bytes"] >= phase["retained_bytes"] for phase in phases.values())
+
+def test_synthetic_program_runs(tmp_path):
+    data = synthetic_program(200, procedures=3, depth=3, arrays=2, seed=1)
+    assert data == synthetic_program(200, procedures=3, depth=3, arrays=2, seed=1)
+    input_file = tmp_path / "synthetic.imp"
+    output_file = tmp_path / "synthetic.mr"
+    input_file.write_text(data)
+    subprocess.run(["python", "compiler.py", input_file, output_file], check=True, capture_output=True)
+    process = subprocess.run(["../maszyna_wirtualna/maszyna-wirtualna", output_file], input="", text=True,
+                             capture_output=True, timeout=60)
+    assert process.returncode == 0 and "koszt" in process.stdout
+
+def test_incremental_recompile(capsys):
+    data = synthetic_program(200, procedures=4, depth=2, arrays=1, seed=2)
+    incremental = IncrementalCompiler()
+    assert incremental.update(data)
+    # an edit in the last procedure moves the main program down by one line
+    position = data.index("BEGIN\n", data.index("PROCEDURE pd")) + len("BEGIN\n")
+    edited = data[:position] + "  WRITE 1;\n" + data[position:]
+    assert incremental.update(edited)
+    assert (incremental.parsed, incremental.fragments.hits) == (1, 3)
+    full = Compiler()
+    assert full.generate(edited, "stream")
+    assert incremental.compiler.codegen.get_code() == full.codegen.get_code()
+    # errors in reused units are reported at their new lines
+    broken = edited.replace("PROGRAM IS\n", "PROGRAM IS\n  va,\n")
+    assert not incremental.update(broken)
+    broken = broken[:position] + "  WRITE 2;\n" + broken[position:]
+    assert not incremental.update(broken)
+    assert incremental.parsed == 1
+    assert not full.generate(broken, "stream")
+    assert incremental.compiler.diagnostics == full.diagnostics
+
+def vm_outputs(output_file, inputs=()):
+    process = subprocess.run(["../maszyna_wirtualna/maszyna-wirtualna", output_file], input="".join(f"{value}\n" for value in inputs),
+                             text=True, capture_output=True, timeout=60)
+    return [int(value) for value in re.findall(r">\s*(-?\d+)", process.stdout)]
+
+def compile_ir(data, ssa=False):
+    root = MyParser().parse(StreamLexer().tokenize(data), data)
+    with contextlib.redirect_stdout(io.StringIO()):
+        Resolver().resolve(root)
+    program = lower(root)
+    if ssa:
+        for function in program.functions:
+            from_ssa(to_ssa(function))
+    backend = Backend()
+    backend.generate_ir(program)
+    return backend.get_code()
+
+@pytest.mark.parametrize("ssa", [False, True])
+@pytest.mark.parametrize("test_case", all_tests)
+def test_ir_backend(test_case, ssa, tmp_path):
+    with open(test_case["input_file"]) as file:
+        data = file.read()
+    output_file = tmp_path / "ir.mr"
+    output_file.write_text(compile_ir(data, ssa))
+    assert vm_outputs(output_file, test_case["inputs"]) == test_case["expected_outputs"]
+
+def test_ir_arithmetic(tmp_path):
+    # runtime division and modulo round like constant folding does
+    data = """PROGRAM IS
+  a, b, q, r, p
+BEGIN
+  REPEAT
+    READ a;
+    READ b;
+    q := a / b;
+    r := a % b;
+    p := a * b;
+    WRITE q;
+    WRITE r;
+    WRITE p;
+  UNTIL b = 12345;
+END
+"""
+    values = list(range(-9, 10)) + [1000003, -999983, 2**30 + 7, -2**31]
+    pairs = [(a, b) for a in values for b in values] + [(7, 12345)]
+    expected = [result for a, b in pairs for result in (a // b if b else 0, a % b if b else 0, a * b)]
+    output_file = tmp_path / "arithmetic.mr"
+    output_file.write_text(compile_ir(data))
+    assert vm_outputs(output_file, [value for pair in pairs for value in pair]) == expected
+
+def test_emit_ir(tmp_path):
+    output_file = tmp_path / "program2.ir"
+    subprocess.run(["python", "compiler.py", "--emit-ir", "--ssa", "../tests/basic_tests/program2.imp", output_file],
+                   check=True, capture_output=True)
+    text = output_file.read_text()
+    assert text.startswith("function licz(s[], &n):") and " = phi(" in text
+
+optimizing_compiler = Compiler()
+
+@pytest.mark.parametrize("level", ["1", "2", "s"])
+@pytest.mark.parametrize("test_case", all_tests)
+def test_optimized_program(test_case, level, tmp_path):
+    with open(test_case["input_file"]) as file:
+        data = file.read()
+    output_file = tmp_path / "optimized.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level=level)
+    assert vm_outputs(output_file, test_case["inputs"]) == test_case["expected_outputs"]
+
+def test_pass_report(tmp_path):
+    report_file = tmp_path / "report.json"
+    process = subprocess.run(["python", "compiler.py", "-O2", "--pass-report", "--report-json", report_file,
+                              "../tests/basic_tests/example1.imp", tmp_path / "example1.mr"],
+                             check=True, capture_output=True, text=True)
+    assert "cost saved" in process.stderr
+    report = json.loads(report_file.read_text())
+    assert [entry["name"] for entry in report["phases"]][:5] == ["lex", "parse", "resolve", "lower", "optimize"]
+    passes = report["optimization"]["passes"]
+    assert report["optimization"]["level"] == "2" and "simplify-cfg" in [entry["name"] for entry in passes]
+    assert all(entry["runs"] > 0 for entry in passes)
+
+def optimized_ir(data, level="2"):
+    compiler = Compiler()
+    root = compiler.parse(data, "stream")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert compiler.resolve(root)
+    return format_program(compiler.lower(root, level))
+
+def test_constant_propagation(tmp_path):
+    data = """PROGRAM IS
+  n, k, x, y, z
+BEGIN
+  n := 5;
+  k := 1;
+  READ x;
+  IF x > 100 THEN
+    k := n - 4;
+  ENDIF
+  y := x * k;
+  y := y + 0;
+  x := x - x;
+  WRITE y;
+  WHILE n > 0 DO
+    n := n - 1;
+  ENDWHILE
+  WRITE n;
+  z := x % k;
+  WRITE z;
+END
+"""
+    text = optimized_ir(data)
+    assert " * " not in text and " % " not in text and "write 0" in text and "if n > 0" in text
+    output_file = tmp_path / "constants.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [7]) == [7, 0, 0]
+    assert vm_outputs(output_file, [200]) == [200, 0, 0]
+
+def test_dead_code(tmp_path):
+    data = """PROCEDURE unused(x) IS
+BEGIN
+  x := x + 1;
+END
+PROCEDURE tick(n) IS
+  last
+BEGIN
+  n := last;
+  last := n + 10;
+END
+PROGRAM IS
+  a, b, t[1:3]
+BEGIN
+  b := 5;
+  b := 7;
+  IF b < 0 THEN
+    WRITE 99;
+  ENDIF
+  t[1] := b;
+  tick(a);
+  tick(a);
+  WRITE a;
+  WRITE t[1];
+END
+"""
+    text = optimized_ir(data)
+    # every call of tick leaves last for the next one
+    assert "unused" not in text and "init" not in text and "b = 5" not in text and "99" not in text
+    assert "last = n + 10" in text
+    output_file = tmp_path / "dead.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file) == [10, 7]
+
+def test_value_numbering(tmp_path):
+    data = """PROCEDURE bump(T t, i) IS
+BEGIN
+  t[i] := t[i] + 1;
+END
+PROGRAM IS
+  a, b, i, x, y, t[0:3]
+BEGIN
+  READ a;
+  READ b;
+  READ i;
+  t[i] := a;
+  x := a * b;
+  y := b * a;
+  WRITE y;
+  IF t[i] > 0 THEN
+    WRITE t[i];
+  ENDIF
+  bump(t, i);
+  WRITE t[i];
+  WRITE x;
+END
+"""
+    main = optimized_ir(data).split("function main")[1]
+    # b * a is a * b, t[i] holds a until bump may change it
+    assert main.count(" * ") == 1 and "write a" in main and main.count("= t[i]") == 1
+    output_file = tmp_path / "values.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [3, 4, 2]) == [12, 3, 4, 12]
+
+def test_value_numbering_loop_store(tmp_path):
+    data = """PROGRAM IS
+  t[0:3]
+BEGIN
+  t[2] := 5;
+  FOR i FROM 0 TO 3 DO
+    t[i] := 7;
+  ENDFOR
+  WRITE t[2];
+END
+"""
+    # the loop may store to t[2] whatever i was before it
+    for level in ("1", "2", "s"):
+        output_file = tmp_path / f"loop-store-{level}.mr"
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert optimizing_compiler.compile_to(data, str(output_file), level=level)
+        assert vm_outputs(output_file, []) == [7]
+
+def test_loop_invariant_code_motion(tmp_path):
+    data = """PROCEDURE scale(T t, n, k) IS
+  i, m
+BEGIN
+  i := 0;
+  WHILE i < n DO
+    FOR j FROM 0 TO 3 DO
+      m := k * k;
+      t[j] := t[j] + m;
+    ENDFOR
+    i := i + 1;
+  ENDWHILE
+END
+PROGRAM IS
+  n, k, t[0:3]
+BEGIN
+  READ n;
+  READ k;
+  t[0] := 0;
+  t[1] := 1;
+  t[2] := 2;
+  t[3] := 3;
+  scale(t, n, k);
+  WRITE t[0];
+  WRITE t[3];
+END
+"""
+    text = optimized_ir(data)
+    # the inner loop is unrolled, m computed once out of the outer one,
+    # behind its guard
+    assert text.count("m = k * k") == 1
+    assert text.index("if 0 < n") < text.index("m = k * k") < text.index("%1 = t[0]")
+    output_file = tmp_path / "invariant.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [2, 5]) == [50, 53]
+    assert vm_outputs(output_file, [0, 5]) == [0, 3]
+
+def test_strength_reduction(tmp_path):
+    data = """PROCEDURE square(a, b) IS
+BEGIN
+  b := a * a;
+END
+PROGRAM IS
+  n, i, k, m, s
+BEGIN
+  READ n;
+  READ k;
+  i := 1;
+  s := 0;
+  WHILE i <= n DO
+    square(i, m);
+    s := s + m;
+    m := i * i;
+    s := s + m;
+    m := k * i;
+    s := s + m;
+    i := i + 2;
+  ENDWHILE
+  WRITE s;
+END
+"""
+    main = optimized_ir(data).split("function main")[1]
+    # square never writes a, so i only steps by 2
+    assert "m = i*i" in main and "m = i*k" in main and "i*i = i*i + i*i:step" in main
+    output_file = tmp_path / "strength.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [7, 3]) == [216]
+    assert vm_outputs(output_file, [0, 3]) == [0]
+
+def test_pointer_increments(tmp_path):
+    data = """PROGRAM IS
+  n, j, s, t[0:20]
+BEGIN
+  READ n;
+  FOR i FROM 0 TO 20 DO
+    t[i] := 1;
+  ENDFOR
+  j := 3;
+  WHILE j <= n DO
+    t[j] := t[j] - 1;
+    j := j + 3;
+  ENDWHILE
+  s := 0;
+  FOR i FROM 20 DOWNTO 0 DO
+    s := s + t[i];
+  ENDFOR
+  WRITE s;
+  WRITE j;
+END
+"""
+    text = optimized_ir(data)
+    # the FOR loops test the pointer instead of i, j is read after its loop
+    assert "i = i" not in text and "j = j + 3" in text
+    assert "t[j]:addr = t[j]:addr + 3" in text and "*t[i]:addr = 1" in text
+    output_file = tmp_path / "pointers.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [10]) == [18, 12]
+    assert vm_outputs(output_file, [0]) == [21, 3]
+
+def test_loop_unrolling(tmp_path):
+    data = """PROGRAM IS
+  n, s, t[0:9]
+BEGIN
+  READ n;
+  FOR i FROM 0 TO 9 DO
+    t[i] := n;
+  ENDFOR
+  s := 0;
+  FOR i FROM 1 TO 50 DO
+    s := s + i;
+  ENDFOR
+  FOR i FROM 9 DOWNTO 5 DO
+    s := s + t[i];
+  ENDFOR
+  WRITE s;
+END
+"""
+    text = optimized_ir(data)
+    # the short loops go away, the long one runs four iterations per test
+    # after the two left over
+    assert "t[9] = n" in text and "t[i]" not in text
+    assert text.count("if ") == 1 and text.count("i#2 = i#2 + 1") == 4
+    # -Os keeps them
+    assert "t[i] = n" in optimized_ir(data, "s")
+    output_file = tmp_path / "unrolled.mr"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert optimizing_compiler.compile_to(data, str(output_file), level="2")
+    assert vm_outputs(output_file, [2]) == [1285]
+    assert vm_outputs(output_file, [0]) == [1275]
@@ -0,0 +1,168 @@
+from ir import Instr, Var, MIRRORED, NEGATED
+from licm import over_loops, live_in, retarget, tested_at_top
+from strength import step
+
+# Unrolling of loops whose trip count is known when compiling: a loop tested
+# only at its header, against a constant, by a variable the loop steps once
+# per iteration by a constant and that holds a constant on the way in - the
+# shape a FOR loop with constant bounds is lowered to.
+#
+# A short loop is unrolled fully: its body is laid out once per iteration
+# and the header goes away, so constant propagation finds the iterator
+# constant in every copy and A[i] becomes an access to a fixed cell. A
+# longer one is unrolled partially, by the factor of MAX_FACTOR or below
+# that saves the most tests: its body is laid out factor times between two
+# tests, the iterations left over run first, in copies of their own, so the
+# test still sees a whole number of rounds to go.
+#
+# Both only happen while the instructions they add to a function stay within
+# BUDGET; inner loops go first and what is left of the budget goes to the
+# loops around them.
+
+BUDGET = 64
+MAX_FACTOR = 4
+TEST_COST = 23  # the test and the jump back, per iteration
+DIRECT_SAVED = 40  # of an access at a constant index, per iteration
+
+def trip_count(operation, start, bound, amount):
+    # iterations of a loop running while start (stepped by amount) <operation>
+    # bound, or None unless each step brings it closer to leaving
+    if amount > 0 and operation in ("<", "<="):
+        last = bound if operation == "<=" else bound - 1
+        return max(0, (last - start) // amount + 1)
+    if amount < 0 and operation in (">", ">="):
+        last = bound if operation == ">=" else bound + 1
+        return max(0, (start - last) // -amount + 1)
+    return None
+
+def initial_value(block, var):
+    # the constant block leaves in var, if it sets var to one
+    for instr in reversed(block.instrs):
+        if var in instr.defs():
+            if instr.op == "copy" and isinstance(instr.args[0], int):
+                return instr.args[0]
+            return None
+    return None
+
+def counted(loop, summary, context):
+    # (iterator, trips) of a loop with a known trip count, or None
+    header = loop.header
+    body = tested_at_top(loop, context.innermost)
+    if body is None or len(header.instrs) != 1 or any(block is not header for block, _ in summary.exits):
+        return None
+    operation, a, b, if_true, _ = header.terminator.args
+    if not isinstance(a, Var):
+        operation, a, b = MIRRORED[operation], b, a
+    if if_true is not body:
+        operation = NEGATED[operation]
+    if not isinstance(a, Var) or not isinstance(b, int) or a.by_ref or summary.defined[a] != 1:
+        return None
+    updates = [(block, instr) for block in loop.own for instr in block.body if instr.dst is a]
+    if not updates:
+        return None
+    block, update = updates[0]
+    amount = step(update)
+    if not amount or not all(context.dominates(block, latch) for latch in loop.latches):
+        return None
+    outside = [pred for pred in context.preds[header] if not loop.contains(pred, context.innermost)]
+    if len(outside) != 1:
+        return None
+    start = initial_value(outside[0], a)
+    if start is None:
+        return None
+    trips = trip_count(operation, start, b, amount)
+    return None if trips is None else (a, trips)
+
+def copy_blocks(function, blocks, temps):
+    # a copy of blocks, jumping between the copies where the blocks jump
+    # between themselves and defining fresh temporaries for temps; returns
+    # block -> its copy
+    copies = {block: function.new_block() for block in blocks}
+    renamed = {temp: function.new_temp() for temp in temps}
+    for block in blocks:
+        instrs = []
+        for instr in block.instrs:
+            copy = Instr(instr.op, renamed.get(instr.dst, instr.dst), instr.args, instr.written)
+            copy.replace_uses(renamed)
+            if copy.op == "jump":
+                copy.args[0] = copies.get(copy.args[0], copy.args[0])
+            elif copy.op == "branch":
+                copy.args[3:] = [copies.get(target, target) for target in copy.args[3:]]
+            instrs.append(copy)
+        copies[block].instrs = instrs
+    return copies
+
+def chain(copies, body, header, following):
+    # lays the iterations in copies one after the other, the last going on
+    # to following
+    for k, copy in enumerate(copies):
+        target = copies[k + 1][body] if k + 1 < len(copies) else following
+        for block in copy.values():
+            if header in block.successors():
+                retarget(block, header, target)
+
+def unroll_loop(function, loop, summary, context, budget):
+    # returns (how many fewer tests run, instructions added)
+    found = counted(loop, summary, context)
+    if found is None:
+        return 0, 0
+    var, trips = found
+    if trips == 0:
+        return 0, 0  # constant propagation drops the loop
+    header = loop.header
+    blocks = [block for block in function.blocks if loop.contains(block, context.innermost) and block is not header]
+    size = sum(len(block.instrs) for block in blocks)
+    direct = sum(1 for block in blocks for instr in block.instrs
+                 if instr.op in ("load", "store") and instr.args[1] is var and not instr.args[0].by_ref)
+    # (cost saved, iterations per test, copies of the body added) of each
+    # way, the full one first
+    options = [(TEST_COST * (trips + 1) + DIRECT_SAVED * direct * trips, trips, trips - 1)]
+    for factor in range(2, min(MAX_FACTOR, trips - 1) + 1):
+        options.append((TEST_COST * (trips - trips // factor), factor, factor - 1 + trips % factor))
+    options = [option for option in options if option[2] * size <= budget]
+    if not options:
+        return 0, 0
+    _, factor, added = max(options, key=lambda option: (option[0], -option[2]))
+    body = tested_at_top(loop, context.innermost)
+    temps = {instr.dst for block in blocks for instr in block.instrs if instr.dst is not None and instr.dst.temp}
+    temps -= live_in(header, context.live_out)
+    iterations = [{block: block for block in blocks}]
+    iterations += [copy_blocks(function, blocks, temps) for _ in range(added)]
+    outside = [pred for pred in context.preds[header] if not loop.contains(pred, context.innermost)]
+    after = function.blocks.index(blocks[-1]) + 1
+    if factor == trips:
+        # the iterations one after the other, in place of the loop
+        exit = next(target for target in header.terminator.targets() if target is not body)
+        chain(iterations, body, header, exit)
+        preds = context.preds
+        preds[exit] = [pred for pred in preds[exit] if pred is not header]
+        preds[exit] += [block for block in iterations[-1].values() if exit in block.successors()]
+        function.blocks[after:after] = [copy[block] for copy in iterations[1:] for block in blocks]
+        function.blocks.remove(header)
+        entry = body
+        tests = 0
+    else:
+        # factor iterations between two tests, after the ones left over
+        rounds, left_over = iterations[:factor], iterations[factor:]
+        chain(rounds, body, header, header)
+        chain(left_over, body, header, header)
+        function.blocks[after:after] = [copy[block] for copy in rounds[1:] for block in blocks]
+        before = function.blocks.index(header)
+        function.blocks[before:before] = [copy[block] for copy in left_over for block in blocks]
+        entry = left_over[0][body] if left_over else header
+        tests = trips // factor + 1
+    for pred in outside:
+        retarget(pred, header, entry)
+    return trips + 1 - tests, added * size
+
+def unroll_loops(function, budget=BUDGET):
+    # returns how many fewer tests run
+    left = budget
+
+    def unroll(function, loop, summary, context):
+        nonlocal left
+        saved, grown = unroll_loop(function, loop, summary, context, left)
+        left -= grown
+        return saved
+
+    return over_loops(function, unroll)
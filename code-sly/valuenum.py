@@ -0,0 +1,223 @@
+from itertools import count
+from ir import Var, COMMUTATIVE
+from analysis import predecessors, reverse_postorder, dominators, dominator_tree, instruction_cost
+
+# Value numbering over the dominator tree of an IR function. Every variable
+# and every computed expression gets a value number; an instruction
+# recomputing a value some variable still holds copies that variable
+# instead - or nothing, when it is the variable itself - and a temporary is
+# read from the first variable that got its value. Array reads are numbered
+# too, and a read of a cell just stored to gets the value stored, until a
+# store that may be to the same cell - of the same array, or of any array
+# parameter, they may all be one array - or a call that may write the
+# array.
+#
+# The IR is not in SSA form, so a block starts from what held at the end of
+# its immediate dominator, less whatever the blocks on the paths in between
+# may change. Past REGION_LIMIT such blocks nothing is carried over. A
+# recomputation is only replaced when it costs more than the copy and the
+# store of the value it takes (analysis.instruction_cost).
+
+REGION_LIMIT = 40
+COPY_COST = 30
+PURE = frozenset(("copy", "half", "add", "sub", "mul", "div", "mod", "load", "addr"))
+
+def array_class(array):
+    # arrays a store to array may change
+    return "parameters" if array.by_ref else array
+
+def is_constant(value):
+    return isinstance(value, tuple)
+
+class Table:
+    # value numbers at one point of the walk, with an undo log so that the
+    # walk can go back to the end of a dominator
+    def __init__(self, by_ref):
+        self.by_ref = by_ref  # scalar parameters, which may all be one variable
+        self.numbers = {}  # Var -> value number
+        self.expressions = {}  # key -> value number
+        self.loads = {}  # key of an array read -> value number
+        self.holders = {}  # value number -> Var first given it
+        self.log = []
+        self.fresh = count()
+
+    def set(self, mapping, key, value):
+        self.log.append((mapping, key, mapping.get(key)))
+        if value is None:
+            del mapping[key]
+        else:
+            mapping[key] = value
+
+    def undo(self, mark):
+        while len(self.log) > mark:
+            mapping, key, old = self.log.pop()
+            if old is None:
+                mapping.pop(key, None)
+            else:
+                mapping[key] = old
+
+    def number(self, operand):
+        if isinstance(operand, int):
+            return ("constant", operand)
+        if operand not in self.numbers:
+            self.renumber(operand)
+        return self.numbers[operand]
+
+    def holder(self, value):
+        var = self.holders.get(value)
+        return var if var is not None and self.numbers.get(var) == value else None
+
+    def assign(self, var, value):
+        if var.by_ref:
+            self.kill_by_ref()
+        self.set(self.numbers, var, value)
+        if self.holder(value) is None:
+            self.set(self.holders, value, var)
+
+    def renumber(self, var):
+        # var holds a value nothing else is known to
+        value = next(self.fresh)
+        self.set(self.numbers, var, value)
+        self.set(self.holders, value, var)
+
+    def kill(self, var):
+        if var.by_ref:
+            self.kill_by_ref()
+        self.renumber(var)
+
+    def kill_by_ref(self):
+        for var in self.by_ref:
+            if var in self.numbers:
+                self.renumber(var)
+
+    def kill_arrays(self, classes, index=None):
+        # forgets reads of arrays in classes; given the value number of a
+        # constant index, only the reads that may be of the same cell
+        for key in [key for key in self.loads if array_class(key[1]) in classes
+                    and not (is_constant(index) and is_constant(key[2]) and index != key[2])]:
+            self.set(self.loads, key, None)
+
+    def kill_all(self):
+        for var in list(self.numbers):
+            self.renumber(var)
+        for key in list(self.loads):
+            self.set(self.loads, key, None)
+
+    def effects(self, instr):
+        # forgets what instr may change, for an instruction not numbered;
+        # the values of its operands may be other than the table's
+        op = instr.op
+        if op == "call":
+            arrays = set()
+            for arg in instr.writes():
+                if isinstance(arg, Var):
+                    self.kill(arg)
+                else:
+                    arrays.add(array_class(arg))
+            self.kill_arrays(arrays)
+        elif op == "store":
+            self.kill_arrays({array_class(instr.args[0])})
+        elif op == "storei":
+            self.kill_arrays({array_class(instr.args[-1])})
+        if instr.dst is not None:
+            self.kill(instr.dst)
+
+    def key(self, instr):
+        op, args = instr.op, instr.args
+        if op in ("load", "addr"):
+            return op, args[0], self.number(args[1])
+        values = tuple(self.number(arg) for arg in args)
+        if op in COMMUTATIVE:
+            values = tuple(sorted(values, key=repr))
+        return (op,) + values
+
+    def visit(self, instr):
+        # numbers instr, rewriting it where it recomputes a value; returns
+        # whether it changed
+        changed = False
+        for position in instr.operands():
+            operand = instr.args[position]
+            if isinstance(operand, Var) and operand.temp:
+                holder = self.holder(self.number(operand))
+                if holder is not None and holder is not operand:
+                    instr.args[position] = holder
+                    changed = True
+        op = instr.op
+        if op == "store":
+            # a read of the cell right after gets the value stored
+            array, index, value = instr.args
+            self.kill_arrays({array_class(array)}, self.number(index))
+            self.set(self.loads, ("load", array, self.number(index)), self.number(value))
+            return changed
+        if op not in PURE:
+            self.effects(instr)
+            return changed
+        if op == "copy":
+            self.assign(instr.dst, self.number(instr.args[0]))
+            return changed
+        key = self.key(instr)
+        table = self.loads if op == "load" else self.expressions
+        value = table.get(key)
+        if is_constant(value):
+            instr.op, instr.args = "copy", [value[1]]
+            changed = True
+        elif value is not None:
+            holder = self.holder(value)
+            if holder is instr.dst:
+                # already there, simplify_algebra drops the copy
+                instr.op, instr.args = "copy", [holder]
+                changed = True
+            elif holder is not None and instruction_cost(instr) > COPY_COST:
+                instr.op, instr.args = "copy", [holder]
+                changed = True
+        else:
+            value = next(self.fresh)
+            self.set(table, key, value)
+        self.assign(instr.dst, value)
+        return changed
+
+def region(block, idom, preds, limit):
+    # blocks on the paths from the immediate dominator of block to block,
+    # or None when there are more than limit of them
+    top = idom[block]
+    found = []
+    seen = {top}
+    stack = [pred for pred in preds[block] if pred in idom]
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        found.append(current)
+        if len(found) > limit:
+            return None
+        stack.extend(pred for pred in preds[current] if pred in idom)
+    return found
+
+def number_values(function):
+    order = reverse_postorder(function)
+    idom = dominators(function, order)
+    preds = predecessors(function)
+    children = dominator_tree(idom)
+    table = Table([var for var in function.variables if var.by_ref])
+    changed = 0
+    stack = [(function.entry, None)]
+    while stack:
+        block, mark = stack.pop()
+        if mark is not None:
+            table.undo(mark)
+            continue
+        mark = len(table.log)
+        if block is not function.entry:
+            between = region(block, idom, preds, REGION_LIMIT)
+            if between is None:
+                table.kill_all()
+            else:
+                for other in between:
+                    for instr in other.instrs:
+                        table.effects(instr)
+        for instr in block.instrs:
+            changed += table.visit(instr)
+        stack.append((block, mark))
+        stack.extend((child, None) for child in children[block])
+    return changed